@@ -1,13 +1,47 @@
 #!/usr/bin/env python
 from __future__ import print_function
 from builtins import str
+import json
+import sys
 from argparse import ArgumentParser
 from pytasched import get_storage_engine, Task
 
+
+def add_bulk(engine, lines, batch_size):
+    """
+    Add tasks from JSON lines, e.g. {"task": "...", "seconds": 5}, where the
+    keys are the arguments to Task
+
+    :param pytasched.engines.StorageEngine engine:
+    :param iterable lines: Lines of JSON
+    :param int batch_size: How many tasks to add at once
+    :return int: Number of tasks added
+    """
+
+    added = 0
+    batch = []
+
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+
+        batch.append(Task(**json.loads(line)))
+
+        if len(batch) >= batch_size:
+            added += len(engine.add_tasks(batch))
+            batch = []
+
+    if batch:
+        added += len(engine.add_tasks(batch))
+
+    return added
+
+
 if __name__ == "__main__":
     ap = ArgumentParser()
 
-    ap.add_argument("task", help="Task to be run, module.path:function")
+    ap.add_argument("task", nargs="?", help="Task to be run, module.path:function")
     ap.add_argument(
         "--seconds",
         type=float,
@@ -19,9 +53,30 @@ if __name__ == "__main__":
     )
     ap.add_argument("--recurring", action="store_true", help="Make the task recurring")
     ap.add_argument("--args", help="Comma separated list of arguments")
+    ap.add_argument(
+        "--bulk",
+        action="store_true",
+        help="Read tasks from stdin as JSON lines, with the keys being the "
+        'arguments to Task, e.g. {"task": "module.path:function", "seconds": 5}',
+    )
+    ap.add_argument(
+        "--batch-size",
+        type=int,
+        default=1000,
+        help="How many tasks to add at once with --bulk",
+    )
     ap.set_defaults(recurring=False, args=[])
 
     options = ap.parse_args()
+
+    if options.bulk:
+        count = add_bulk(get_storage_engine(), sys.stdin, options.batch_size)
+        print("Created {} tasks".format(count))
+        sys.exit(0)
+
+    if not options.task:
+        ap.error("Task must be specified unless using --bulk.")
+
     if not (options.when or options.seconds):
         ap.error("Either seconds or when must be specified.")
 
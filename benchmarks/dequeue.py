@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+"""
+Compare the number of storage and lock round trips needed per executed task
+when dequeueing with batched locks vs. claiming tasks in the storage engine.
+
+Run with: python -m benchmarks.dequeue
+"""
+
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import logging
+from argparse import ArgumentParser
+from builtins import object
+from time import time
+
+import mongomock
+from mock import Mock, patch
+
+import settings
+from pytasched.engines import MongoDBStorageEngine
+from pytasched.locking import BatchLocks
+from pytasched.server import PytaschedServer
+from pytasched.tasks import Task
+
+
+class _Counter(object):
+    def __init__(self):
+        self.round_trips = 0
+
+
+class _CountingCursor(object):
+    """
+    Cursor proxy, fetching the results is a round trip
+    """
+
+    def __init__(self, cursor, counter):
+        self._cursor = cursor
+        self._counter = counter
+        self._started = False
+
+    def __getattr__(self, item):
+        attr = getattr(self._cursor, item)
+
+        if item not in ("sort", "limit", "batch_size"):
+            return attr
+
+        def _chain(*args, **kwargs):
+            self._cursor = attr(*args, **kwargs)
+            return self
+
+        return _chain
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._started:
+            self._started = True
+            self._counter.round_trips += 1
+        return next(self._cursor)
+
+    next = __next__
+
+
+class _CountingCollection(object):
+    """
+    Collection proxy that counts every call as a round trip
+    """
+
+    def __init__(self, collection, counter):
+        self._collection = collection
+        self._counter = counter
+
+    def __getattr__(self, item):
+        attr = getattr(self._collection, item)
+
+        if not callable(attr):
+            return attr
+
+        def _call(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            if item == "find":
+                return _CountingCursor(result, self._counter)
+            self._counter.round_trips += 1
+            return result
+
+        return _call
+
+
+def _get_batch_locks_factory(counter):
+    """
+    Get a get_batch_locks replacement whose locks count every batch call as
+    a round trip
+    """
+
+    class _CountingBatchLocks(BatchLocks):
+        def acquire_many(self, names):
+            counter.round_trips += 1
+            return list(names)
+
+        def renew_many(self, names):
+            counter.round_trips += 1
+
+        def release_many(self, names):
+            counter.round_trips += 1
+
+    return _CountingBatchLocks
+
+
+class _Settings(object):
+    """
+    The global settings, with overrides for the benchmark
+    """
+
+    def __init__(self, claim):
+        for name in dir(settings):
+            if name.isupper():
+                setattr(self, name, getattr(settings, name))
+
+        self.WORKER_ID = "benchmark"
+        self.AUTORELOAD = False
+        self.EXECUTOR = "inline"
+        self.CLAIM_TASKS = claim
+        self.LOCKS = not claim
+
+
+def run(tasks, claim):
+    """
+    Run all the given number of due tasks through the server
+
+    :param int tasks: Number of tasks to schedule
+    :param bool claim: Use storage engine claims instead of locks
+    :return dict: Results
+    """
+
+    counter = _Counter()
+    db = mongomock.MongoClient().pytasched
+    engine = MongoDBStorageEngine({"indices": {}}, db=db)
+
+    when = time() - 1
+    for i in range(tasks):
+        engine.add_task(Task("task-{}".format(i), when=when))
+
+    collection = _CountingCollection(engine._get_collection(), counter)
+    engine._get_collection = lambda: collection
+
+    server = PytaschedServer(
+        _Settings(claim),
+        logging.getLogger(__name__),
+        storage_engine=engine,
+        task_engine=Mock(),
+    )
+
+    executed = 0
+    start = time()
+    with patch(
+        "pytasched.server.core.get_batch_locks", _get_batch_locks_factory(counter)
+    ):
+        server._setup()
+
+        while True:
+            count = server.process_tasks()
+            if not count:
+                break
+            executed += count
+    elapsed = time() - start
+
+    return {
+        "mode": "claim" if claim else "lock",
+        "executed": executed,
+        "round_trips": counter.round_trips,
+        "round_trips_per_task": counter.round_trips / float(executed),
+        "seconds": elapsed,
+    }
+
+
+if __name__ == "__main__":
+    ap = ArgumentParser()
+    ap.add_argument("--tasks", type=int, default=1000, help="Tasks to schedule")
+    options = ap.parse_args()
+
+    for claim in (False, True):
+        result = run(options.tasks, claim)
+        print(
+            "{mode:>6}: {executed} tasks, {round_trips} round trips, "
+            "{round_trips_per_task:.2f} per task, {seconds:.2f}s".format(**result)
+        )
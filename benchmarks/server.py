@@ -0,0 +1,492 @@
+#!/usr/bin/env python
+"""
+Measure enqueue throughput, dispatch throughput, dispatch latency and memory
+use of the server loop for each storage and task engine combination, with a
+JSON report that can be compared against an earlier one to catch regressions.
+
+Everything runs offline, MongoDB is stood in for by mongomock and Redis by
+fakeredis. Each combination runs in a fresh process to measure its memory.
+mongomock scans the whole collection for every claim, so it's only run when
+asked for with --storage and mostly measures mongomock itself.
+
+Run with: python -m benchmarks.server --tasks 10000 100000 --output report.json
+Compare with: python -m benchmarks.server --compare report.json
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+from argparse import ArgumentParser
+from builtins import object
+from time import time
+
+import settings
+from pytasched.engines import (
+    FunctionTaskEngine,
+    MemoryStorageEngine,
+    MongoDBStorageEngine,
+    RedisStorageEngine,
+    ShellTaskEngine,
+    SQLiteStorageEngine,
+    TaskEngine,
+)
+from pytasched.server import PytaschedServer
+from pytasched.tasks import Task
+
+STORAGE_ENGINES = ("memory", "sqlite", "mongomock", "redis")
+DEFAULT_STORAGE_ENGINES = ("memory", "sqlite", "redis")
+TASK_ENGINES = ("noop", "function", "shell")
+
+# Results where higher is better, the rest are lower is better
+HIGHER_IS_BETTER = ("enqueue_per_second", "dispatch_per_second")
+
+# Tasks are added in chunks of this many
+CHUNK_SIZE = 1000
+
+
+def noop():
+    """
+    Task for FunctionTaskEngine that does nothing
+    """
+    pass
+
+
+class _NoopTaskEngine(TaskEngine):
+    """
+    Task engine that does nothing, to measure the server alone
+    """
+
+    def run(self, task):
+        pass
+
+
+class _RecordingTaskEngine(object):
+    """
+    Task engine proxy that records how late each task started
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.lags = []
+        self.recording = False
+
+    def __getattr__(self, item):
+        return getattr(self.engine, item)
+
+    def run(self, task):
+        if self.recording:
+            self.lags.append(time() - task.when)
+
+        self.engine.run(task)
+
+
+class _Settings(object):
+    """
+    The global settings, with overrides for the benchmark
+    """
+
+    def __init__(self, batch_size):
+        for name in dir(settings):
+            if name.isupper():
+                setattr(self, name, getattr(settings, name))
+
+        self.WORKER_ID = "benchmark"
+        self.AUTORELOAD = False
+        self.EXECUTOR = "inline"
+        self.CLAIM_TASKS = True
+        self.LOCKS = False
+        self.METRICS_PORT = None
+        self.TARGET_LAG_SECONDS = None
+        self.LOOKAHEAD_SECONDS = None
+        self.TOPOLOGY = "peers"
+        self.BATCH_SIZE = batch_size
+
+
+def _get_storage_engine(name, directory):
+    """
+    :param str name: One of STORAGE_ENGINES
+    :param str directory: Temporary directory for files
+    :return pytasched.engines.StorageEngine:
+    """
+
+    if name == "memory":
+        return MemoryStorageEngine({})
+    elif name == "sqlite":
+        return SQLiteStorageEngine({"path": os.path.join(directory, "bench.sqlite3")})
+    elif name == "mongomock":
+        import mongomock
+
+        db = mongomock.MongoClient().pytasched
+        return MongoDBStorageEngine({"indices": {}}, db=db)
+    elif name == "redis":
+        import fakeredis
+
+        client = fakeredis.FakeStrictRedis(decode_responses=True)
+        return RedisStorageEngine({"prefix": "bench"}, client=client)
+
+    raise ValueError("Unknown storage engine {}".format(name))
+
+
+def _get_task_engine(name):
+    """
+    :param str name: One of TASK_ENGINES
+    :return tuple: The engine and the task to give it
+    """
+
+    if name == "noop":
+        return _NoopTaskEngine({}), "noop"
+    elif name == "function":
+        return FunctionTaskEngine({}), "benchmarks.server:noop"
+    elif name == "shell":
+        return ShellTaskEngine({"style": "system"}), "true"
+
+    raise ValueError("Unknown task engine {}".format(name))
+
+
+def _get_peak_memory():
+    """
+    :return float: Peak resident memory of this process in MB
+    """
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Bytes on macOS, kilobytes elsewhere
+    if sys.platform == "darwin":
+        return peak / 1024.0 / 1024.0
+
+    return peak / 1024.0
+
+
+def percentile(values, percent):
+    """
+    Get the nearest rank percentile of the values
+
+    :param list values:
+    :param float percent: 0 - 100
+    :return float|None: None if there are no values
+    """
+
+    if not values:
+        return None
+
+    values = sorted(values)
+    rank = int(round(percent / 100.0 * len(values) + 0.5))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+def run(storage, task_engine, tasks, due, latency_tasks, window, batch_size):
+    """
+    Run a single benchmark
+
+    :param str storage: One of STORAGE_ENGINES
+    :param str task_engine: One of TASK_ENGINES
+    :param int tasks: Number of tasks to schedule
+    :param int due: How many of them are due, the rest are far in the future
+    :param int latency_tasks: Number of tasks to measure the latency with
+    :param float window: Seconds over which the latency tasks come due
+    :param int batch_size: BATCH_SIZE for the server
+    :return dict: Results
+    """
+
+    directory = tempfile.mkdtemp(prefix="pytasched-bench-")
+    baseline_memory = _get_peak_memory()
+
+    try:
+        storage_engine = _get_storage_engine(storage, directory)
+        engine, name = _get_task_engine(task_engine)
+        recorder = _RecordingTaskEngine(engine)
+
+        logger = logging.getLogger(__name__)
+        logger.setLevel(logging.WARNING)
+
+        server = PytaschedServer(
+            _Settings(batch_size),
+            logger,
+            storage_engine=storage_engine,
+            task_engine=recorder,
+        )
+        server._setup()
+
+        # Enqueue
+        due = min(due, tasks)
+        now = time()
+        start = time()
+        for offset in range(0, tasks, CHUNK_SIZE):
+            storage_engine.add_tasks(
+                [
+                    Task(name, when=now if i < due else now + 86400 + i)
+                    for i in range(offset, min(offset + CHUNK_SIZE, tasks))
+                ]
+            )
+        enqueue_seconds = time() - start
+
+        # Dispatch the due tasks as fast as possible
+        dispatched = 0
+        start = time()
+        while dispatched < due:
+            count = server.process_tasks()
+            if not count:
+                break
+            dispatched += count
+        dispatch_seconds = time() - start
+
+        # Latency of tasks coming due over time, with the server loop waiting
+        # for them like it normally does
+        recorder.recording = True
+        now = time()
+        storage_engine.add_tasks(
+            [
+                Task(name, when=now + window * i / latency_tasks)
+                for i in range(latency_tasks)
+            ]
+        )
+
+        deadline = now + window + 30
+        thread = threading.Thread(target=_run_until, args=(server, recorder, deadline))
+        thread.start()
+        while len(recorder.lags) < latency_tasks and time() < deadline:
+            thread.join(0.05)
+        server.stop()
+        thread.join()
+        recorder.recording = False
+
+        server.shutdown()
+        lags = recorder.lags
+
+        return {
+            "storage": storage,
+            "task_engine": task_engine,
+            "tasks": tasks,
+            "due": due,
+            "dispatched": dispatched,
+            "enqueue_per_second": tasks / max(enqueue_seconds, 1e-9),
+            "dispatch_per_second": dispatched / max(dispatch_seconds, 1e-9),
+            "latency_ms": {
+                "p50": percentile(lags, 50) * 1000 if lags else None,
+                "p90": percentile(lags, 90) * 1000 if lags else None,
+                "p99": percentile(lags, 99) * 1000 if lags else None,
+                "max": max(lags) * 1000 if lags else None,
+            },
+            "latency_tasks": len(lags),
+            "memory_mb": _get_peak_memory() - baseline_memory,
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _run_until(server, recorder, deadline):
+    """
+    The server loop, without the setup done already
+    """
+
+    while server.waiter.running and time() < deadline:
+        server.process_tasks()
+        server.waiter.wait(server._get_next_when())
+
+
+def _run_in_process(kwargs):
+    try:
+        return run(**kwargs)
+    except ImportError as e:
+        return {
+            "storage": kwargs["storage"],
+            "task_engine": kwargs["task_engine"],
+            "tasks": kwargs["tasks"],
+            "skipped": "{}".format(e),
+        }
+
+
+def _get_key(result):
+    return result["storage"], result["task_engine"], result["tasks"]
+
+
+def _flatten(result):
+    """
+    Get the comparable numbers of a result
+
+    :param dict result:
+    :return dict:
+    """
+
+    values = {
+        "enqueue_per_second": result["enqueue_per_second"],
+        "dispatch_per_second": result["dispatch_per_second"],
+        "memory_mb": result["memory_mb"],
+    }
+
+    for name, value in result["latency_ms"].items():
+        values["latency_ms." + name] = value
+
+    return values
+
+
+def compare(report, baseline, tolerance):
+    """
+    Find the results that got worse than the baseline by more than the
+    tolerance
+
+    :param dict report:
+    :param dict baseline:
+    :param float tolerance: E.g. 0.2 for 20%
+    :return list: Descriptions of the regressions
+    """
+
+    previous = {
+        _get_key(result): result
+        for result in baseline["results"]
+        if "skipped" not in result
+    }
+    regressions = []
+
+    for result in report["results"]:
+        if "skipped" in result or _get_key(result) not in previous:
+            continue
+
+        old = _flatten(previous[_get_key(result)])
+        for name, value in sorted(_flatten(result).items()):
+            before = old.get(name)
+            if value is None or not before:
+                continue
+
+            change = (value - before) / before
+            if name in HIGHER_IS_BETTER:
+                change = -change
+
+            if change > tolerance:
+                regressions.append(
+                    "{} {} {}: {} {:.4g} -> {:.4g}".format(
+                        *_get_key(result) + (name, before, value)
+                    )
+                )
+
+    return regressions
+
+
+def _print_result(result):
+    if "skipped" in result:
+        print(
+            "{storage:>9} {task_engine:>8} {tasks:>8}: skipped, {skipped}".format(
+                **result
+            )
+        )
+        return
+
+    print(
+        "{storage:>9} {task_engine:>8} {tasks:>8}: "
+        "enqueue {enqueue_per_second:>9.0f}/s, "
+        "dispatch {dispatch_per_second:>8.0f}/s, "
+        "latency p50 {p50:.1f}ms p99 {p99:.1f}ms, "
+        "memory {memory_mb:.1f}MB".format(
+            p50=result["latency_ms"]["p50"] or 0,
+            p99=result["latency_ms"]["p99"] or 0,
+            **result
+        )
+    )
+
+
+if __name__ == "__main__":
+    ap = ArgumentParser()
+    ap.add_argument(
+        "--tasks",
+        type=int,
+        nargs="+",
+        default=[10000],
+        help="Numbers of tasks to schedule, e.g. 10000 100000 1000000",
+    )
+    ap.add_argument(
+        "--storage",
+        nargs="+",
+        choices=STORAGE_ENGINES,
+        default=list(DEFAULT_STORAGE_ENGINES),
+        help="Storage engines to benchmark",
+    )
+    ap.add_argument(
+        "--task-engine",
+        nargs="+",
+        choices=TASK_ENGINES,
+        default=["noop", "function"],
+        help="Task engines to benchmark",
+    )
+    ap.add_argument(
+        "--due", type=int, default=10000, help="How many of the tasks are due"
+    )
+    ap.add_argument(
+        "--latency-tasks",
+        type=int,
+        default=200,
+        help="Tasks to measure the dispatch latency with",
+    )
+    ap.add_argument(
+        "--window",
+        type=float,
+        default=2.0,
+        help="Seconds over which the latency tasks come due",
+    )
+    ap.add_argument("--batch-size", type=int, default=100, help="BATCH_SIZE")
+    ap.add_argument("--output", help="Write the JSON report to this file")
+    ap.add_argument("--compare", help="Compare against this earlier JSON report")
+    ap.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="How much worse a result can get before it's a regression",
+    )
+    options = ap.parse_args()
+
+    jobs = [
+        {
+            "storage": storage,
+            "task_engine": task_engine,
+            "tasks": tasks,
+            "due": options.due,
+            "latency_tasks": options.latency_tasks,
+            "window": options.window,
+            "batch_size": options.batch_size,
+        }
+        for tasks in options.tasks
+        for storage in options.storage
+        for task_engine in options.task_engine
+    ]
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for job in jobs:
+        # A fresh process each, so the memory use is comparable
+        with context.Pool(1) as pool:
+            result = pool.apply(_run_in_process, (job,))
+
+        _print_result(result)
+        results.append(result)
+
+    report = {
+        "created": time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": vars(options),
+        "results": results,
+    }
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if options.compare:
+        with open(options.compare) as f:
+            regressions = compare(report, json.load(f), options.tolerance)
+
+        for regression in regressions:
+            print("Regression: {}".format(regression))
+
+        if regressions:
+            sys.exit(1)
@@ -1,7 +1,8 @@
 from __future__ import unicode_literals
+import asyncio
 import logging
 
-from pytasched.server import PytaschedServer
+from pytasched.server import AsyncPytaschedServer, PytaschedServer
 import settings
 
 
@@ -26,9 +27,14 @@ def _get_logger():
 
 if __name__ == "__main__":
     logger = _get_logger()
-    server = PytaschedServer(settings, logger)
 
     try:
-        server.run()
+        if settings.ASYNCIO:
+            server = AsyncPytaschedServer(settings, logger)
+            loop = asyncio.new_event_loop()
+            loop.run_until_complete(server.run())
+        else:
+            server = PytaschedServer(settings, logger)
+            server.run()
     except KeyboardInterrupt:
         logger.info("Exiting...")
@@ -0,0 +1,686 @@
+"""
+asyncio versions of the storage and task engines, for use with
+pytasched.server.AsyncPytaschedServer
+"""
+from __future__ import unicode_literals
+
+import inspect
+import sys
+from builtins import str
+from copy import copy
+from logging import DEBUG, INFO, WARNING
+from time import time
+
+import settings as global_settings
+from pytasched.engines import (
+    DeadLetter,
+    Engine,
+    MemoryStorageEngine,
+    _MONGO_ENGINE_PARAMS,
+    _MONGO_TASK_PROJECTION,
+    _MONGO_UNSET_CLAIM,
+    _get_mongo_index_plan,
+    _mongo_indexed,
+    _mongo_item_to_task,
+    _task_to_mongo_item,
+)
+from pytasched.errors import StorageEngineNotAvailableError
+from pytasched.tools import CallableCache
+
+try:
+    import pymongo
+    from bson import ObjectId
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:
+    AsyncIOMotorClient = None
+
+
+class AsyncStorageEngine(Engine):
+    """
+    Base class for asyncio storage engines, the same as
+    pytasched.engines.StorageEngine except all the methods are coroutines.
+    """
+
+    def __init__(self, params):
+        self.params = params
+        super(AsyncStorageEngine, self).__init__()
+
+    async def setup(self):
+        """
+        Set up the storage engine, e.g. tables, indexes, etc.
+        """
+        pass
+
+    async def add_task(self, task):
+        """
+        Add a new task to be processed
+
+        :param pytasched.tasks.Task task:
+        :returns str: The ID of the task
+        """
+        raise NotImplementedError()
+
+    async def get_task(self, id):
+        """
+        Get the specific task
+
+        :param str id:
+        :return pytasched.tasks.Task:
+        """
+        raise NotImplementedError()
+
+    async def get_task_list(self, limit=None):
+        """
+        Get a list of tasks that need to be run, the ones that should have
+        been run first are first in the list.
+
+        :param int limit: Maximum number of tasks to return, None for all
+        :return list:
+        """
+        raise NotImplementedError()
+
+    async def remove_task(self, id):
+        """
+        Remove a task from the queue
+
+        :param str id: The task ID
+        :return bool:
+        """
+        raise NotImplementedError()
+
+    async def has_task_changed(self, task):
+        """
+        Check if the task has changed / been deleted since it was loaded.
+
+        :param pytasched.tasks.Task task:
+        :return bool:
+        """
+        raise NotImplementedError()
+
+    async def reschedule(self, task, recur=False, delay=None):
+        """
+        Update task to be rescheduled, with its attempts
+
+        :param pytasched.task.Task task:
+        :param bool recur: If this is for recurring and we should try and keep
+                           the same schedule
+        :param float delay: Seconds from now to run the task in instead of its
+                            wait, e.g. to retry it
+        """
+        raise NotImplementedError()
+
+    async def dead_letter_task(self, task, error):
+        """
+        Move a task that has failed too many times out of the schedule and to
+        the dead letters, for someone to look into
+
+        :param pytasched.tasks.Task task:
+        :param str error: Why the last attempt failed
+        :return bool: If the task was still in the schedule
+        """
+        raise NotImplementedError()
+
+    async def get_dead_letters(self, limit=None):
+        """
+        Get the tasks that were given up on, the latest first
+
+        :param int limit: Maximum number of dead letters to return, None for all
+        :return list: List of pytasched.engines.DeadLetter
+        """
+        raise NotImplementedError()
+
+    async def remove_dead_letter(self, id):
+        """
+        Forget a task that was given up on, e.g. after adding it again
+
+        :param str id: The task ID
+        :return bool:
+        """
+        raise NotImplementedError()
+
+    async def get_next_when(self):
+        """
+        Get the time the next task is scheduled for
+
+        :return float|None: None if there are no tasks
+        """
+        raise NotImplementedError()
+
+    async def claim_due_tasks(self, worker_id, limit, lease_seconds):
+        """
+        Atomically claim tasks that need to be run for the given worker.
+
+        :param str worker_id: Identifier of the worker claiming the tasks
+        :param int limit: Maximum number of tasks to claim
+        :param float lease_seconds: How long the tasks are reserved for
+        :return list: The claimed tasks, as they were before claiming
+        """
+        raise NotImplementedError()
+
+    async def extend_claims(self, tasks, worker_id, lease_seconds):
+        """
+        Move the leases of tasks the worker has claimed and is still running
+        forward, so they aren't claimed again while they run. Tasks that were
+        completed or claimed by others since are left alone.
+
+        :param list tasks: Tasks claimed by the worker
+        :param str worker_id: Identifier of the worker that claimed the tasks
+        :param float lease_seconds: How long the tasks are reserved for from now
+        :return int: Number of leases extended
+        """
+        raise NotImplementedError()
+
+
+class MotorStorageEngine(AsyncStorageEngine):
+    """
+    Storage engine that uses MongoDB via Motor to store tasks, compatible with
+    the data stored by pytasched.engines.MongoDBStorageEngine
+    """
+
+    def __init__(self, params, db=None):
+        if not AsyncIOMotorClient:
+            raise StorageEngineNotAvailableError("Could not find motor")
+
+        self._db = db
+        super(MotorStorageEngine, self).__init__(params)
+
+    async def _get_db(self):
+        if not self._db:
+            self.log(DEBUG, "Connecting to MongoDB")
+
+            params = copy(self.params)
+            for param in _MONGO_ENGINE_PARAMS:
+                params.pop(param, None)
+
+            params.setdefault("host", global_settings.MONGODB_CONNECTION_STRING)
+            params.setdefault("maxPoolSize", global_settings.MONGODB_MAX_POOL_SIZE)
+
+            client = AsyncIOMotorClient(**params)
+            database = self.params.get("database", global_settings.MONGODB_DATABASE)
+            self._db = getattr(client, database)
+            await self.setup()
+
+        return self._db
+
+    async def _get_collection(self):
+        """
+        Get the collection our tasks are stored in
+        :return motor.motor_asyncio.AsyncIOMotorCollection:
+        """
+        db = await self._get_db()
+        name = self.params.get("collection", global_settings.MONGODB_COLLECTION)
+        return getattr(db, name)
+
+    async def _get_dead_letters_collection(self):
+        """
+        Get the collection the tasks that were given up on are moved to
+        :return motor.motor_asyncio.AsyncIOMotorCollection:
+        """
+        collection = await self._get_collection()
+        return collection.database[collection.name + "_dead_letters"]
+
+    def _get_now(self):
+        """
+        Get current time
+        """
+        return time()
+
+    async def setup(self):
+        """
+        Set up the storage engine, e.g. tables, indexes, etc.
+        """
+        collection = await self._get_collection()
+
+        # Shared with MongoDBStorageEngine, the indexes are the same
+        key = (id(collection.database.client), collection.full_name)
+        if key in _mongo_indexed:
+            return
+
+        for keys, options in _get_mongo_index_plan(self.params):
+            self.log(DEBUG, "Ensuring we have index for {}".format(keys))
+            await collection.create_index(keys, **options)
+
+        _mongo_indexed.add(key)
+
+    async def add_task(self, task):
+        """
+        Add a new task to be processed
+
+        :param pytasched.tasks.Task task:
+        :returns str: The ID of the task
+        """
+
+        self.log(INFO, "Adding task {} in {}s".format(task.task, task.wait))
+
+        collection = await self._get_collection()
+
+        if not task.when:
+            task.when = self._get_now() + task.wait
+
+        result = await collection.insert_one(_task_to_mongo_item(task))
+        self.notify(task.when)
+
+        return str(result.inserted_id)
+
+    async def get_task(self, id):
+        """
+        Get the specific task
+
+        :param str id:
+        :return pytasched.tasks.Task:
+        """
+
+        collection = await self._get_collection()
+
+        item = await collection.find_one({"_id": ObjectId(id)})
+
+        if item:
+            return _mongo_item_to_task(item)
+        else:
+            return None
+
+    async def get_task_list(self, limit=None):
+        """
+        Get the tasks that should be run, the ones that should have been run
+        first are first in the list.
+
+        :param int limit: Maximum number of tasks to return, None for all
+        :return list:
+        """
+
+        collection = await self._get_collection()
+
+        cursor = collection.find(
+            {"when": {"$lt": self._get_now()}}, projection=_MONGO_TASK_PROJECTION
+        ).sort("when", pymongo.ASCENDING)
+
+        if limit:
+            cursor = cursor.limit(limit)
+
+        return [_mongo_item_to_task(item) for item in await cursor.to_list(limit)]
+
+    async def get_next_when(self):
+        """
+        Get the time the next task is scheduled for
+
+        :return float|None: None if there are no tasks
+        """
+
+        collection = await self._get_collection()
+
+        item = await collection.find_one(
+            {}, projection=["when"], sort=[("when", pymongo.ASCENDING)]
+        )
+
+        return item["when"] if item else None
+
+    async def has_task_changed(self, task):
+        """
+        Check if the task has changed / been deleted since it was loaded.
+
+        :param pytasched.tasks.Task task:
+        :return bool:
+        """
+
+        reloaded = await self.get_task(task.id)
+
+        return reloaded is None or reloaded.when != task.when
+
+    async def claim_due_tasks(self, worker_id, limit, lease_seconds):
+        """
+        Atomically claim tasks that need to be run for the given worker, see
+        pytasched.engines.MongoDBStorageEngine.claim_due_tasks
+
+        :param str worker_id: Identifier of the worker claiming the tasks
+        :param int limit: Maximum number of tasks to claim
+        :param float lease_seconds: How long the tasks are reserved for
+        :return list: The claimed tasks, as they were before claiming
+        """
+
+        collection = await self._get_collection()
+
+        now = self._get_now()
+        tasks = []
+
+        while len(tasks) < limit:
+            item = await collection.find_one_and_update(
+                {"when": {"$lt": now}},
+                {
+                    "$set": {
+                        "when": now + lease_seconds,
+                        "status": "leased",
+                        "owner": worker_id,
+                    }
+                },
+                sort=[("when", pymongo.ASCENDING)],
+            )
+
+            if not item:
+                break
+
+            tasks.append(_mongo_item_to_task(item))
+
+        return tasks
+
+    async def extend_claims(self, tasks, worker_id, lease_seconds):
+        """
+        Move the leases of tasks the worker has claimed and is still running
+        forward, so they aren't claimed again while they run
+
+        :param list tasks: Tasks claimed by the worker
+        :param str worker_id: Identifier of the worker that claimed the tasks
+        :param float lease_seconds: How long the tasks are reserved for from now
+        :return int: Number of leases extended
+        """
+
+        if not tasks:
+            return 0
+
+        collection = await self._get_collection()
+        result = await collection.update_many(
+            {
+                "_id": {"$in": [ObjectId(task.id) for task in tasks]},
+                "owner": worker_id,
+                "queued_at": {"$exists": False},
+            },
+            {"$set": {"when": self._get_now() + lease_seconds}},
+        )
+
+        return result.matched_count
+
+    async def reschedule(self, task, recur=False, delay=None):
+        """
+        Update task to be rescheduled, with its attempts
+
+        :param pytasched.task.Task task:
+        :param bool recur: If this is for recurring and we should try and keep
+                           the same schedule
+        :param float delay: Seconds from now to run the task in instead of its
+                            wait, e.g. to retry it
+        """
+
+        if delay is not None:
+            task.when = self._get_now() + delay
+        elif recur:
+            task.when = task.when + task.wait
+        else:
+            task.when = self._get_now() + task.wait
+
+        self.log(
+            INFO,
+            "Rescheduling task {} for {}".format(task.id, task.get_readable_when()),
+        )
+
+        collection = await self._get_collection()
+        result = await collection.update_one(
+            {"_id": ObjectId(task.id)},
+            {
+                "$set": {
+                    "when": task.when,
+                    "attempts": task.attempts,
+                    "status": "pending",
+                },
+                "$unset": _MONGO_UNSET_CLAIM,
+            },
+        )
+        self.notify(task.when)
+
+        return bool(result.modified_count)
+
+    async def remove_task(self, id):
+        """
+        Remove a task from the queue
+
+        :param str id: The task ID
+        :return bool:
+        """
+
+        self.log(INFO, "Removing task {}".format(id))
+
+        collection = await self._get_collection()
+        result = await collection.delete_one({"_id": ObjectId(id)})
+
+        return bool(result.deleted_count)
+
+    async def dead_letter_task(self, task, error):
+        """
+        Move a task that has failed too many times out of the schedule and to
+        the dead letters, for someone to look into
+
+        :param pytasched.tasks.Task task:
+        :param str error: Why the last attempt failed
+        :return bool: If the task was still in the schedule
+        """
+
+        self.log(WARNING, "Moving task {} to the dead letters".format(task.id))
+
+        item = _task_to_mongo_item(task)
+        item.update({"error": error, "failed_at": self._get_now()})
+        del item["status"]
+
+        dead_letters = await self._get_dead_letters_collection()
+        await dead_letters.replace_one({"_id": ObjectId(task.id)}, item, upsert=True)
+
+        collection = await self._get_collection()
+        result = await collection.delete_one({"_id": ObjectId(task.id)})
+
+        return bool(result.deleted_count)
+
+    async def get_dead_letters(self, limit=None):
+        """
+        Get the tasks that were given up on, the latest first
+
+        :param int limit: Maximum number of dead letters to return, None for all
+        :return list: List of pytasched.engines.DeadLetter
+        """
+
+        collection = await self._get_dead_letters_collection()
+        cursor = collection.find(
+            sort=[("failed_at", pymongo.DESCENDING)], limit=limit or 0
+        )
+
+        return [
+            DeadLetter(_mongo_item_to_task(item), item["error"], item["failed_at"])
+            for item in await cursor.to_list(limit)
+        ]
+
+    async def remove_dead_letter(self, id):
+        """
+        Forget a task that was given up on, e.g. after adding it again
+
+        :param str id: The task ID
+        :return bool:
+        """
+
+        collection = await self._get_dead_letters_collection()
+        result = await collection.delete_one({"_id": ObjectId(id)})
+
+        return bool(result.deleted_count)
+
+
+class AsyncMemoryStorageEngine(AsyncStorageEngine):
+    """
+    Storage engine that keeps the tasks in memory of the current process,
+    mostly useful for tests. Wraps pytasched.engines.MemoryStorageEngine.
+    """
+
+    def __init__(self, params):
+        super(AsyncMemoryStorageEngine, self).__init__(params)
+        self.engine = MemoryStorageEngine(params)
+        self.engine.add_listener(self.notify)
+
+    def set_logger(self, logger):
+        super(AsyncMemoryStorageEngine, self).set_logger(logger)
+        self.engine.set_logger(logger)
+
+    async def add_task(self, task):
+        """
+        Add a new task to be processed
+
+        :param pytasched.tasks.Task task:
+        :returns str: The ID of the task
+        """
+        return self.engine.add_task(task)
+
+    async def get_task(self, id):
+        """
+        Get the specific task
+
+        :param str id:
+        :return pytasched.tasks.Task:
+        """
+        return self.engine.get_task(id)
+
+    async def get_task_list(self, limit=None):
+        """
+        Get the tasks that should be run, the ones that should have been run
+        first are first in the list.
+
+        :param int limit: Maximum number of tasks to return, None for all
+        :return list:
+        """
+        return self.engine.get_task_list(limit)
+
+    async def get_next_when(self):
+        """
+        Get the time the next task is scheduled for
+
+        :return float|None: None if there are no tasks
+        """
+        return self.engine.get_next_when()
+
+    async def has_task_changed(self, task):
+        """
+        Check if the task has changed / been deleted since it was loaded.
+
+        :param pytasched.tasks.Task task:
+        :return bool:
+        """
+        return self.engine.has_task_changed(task)
+
+    async def claim_due_tasks(self, worker_id, limit, lease_seconds):
+        """
+        Claim tasks that need to be run for the given worker
+
+        :param str worker_id: Identifier of the worker claiming the tasks
+        :param int limit: Maximum number of tasks to claim
+        :param float lease_seconds: How long the tasks are reserved for
+        :return list: The claimed tasks, as they were before claiming
+        """
+        return self.engine.claim_due_tasks(worker_id, limit, lease_seconds)
+
+    async def extend_claims(self, tasks, worker_id, lease_seconds):
+        """
+        Move the leases of tasks the worker has claimed and is still running
+        forward, so they aren't claimed again while they run
+
+        :param list tasks: Tasks claimed by the worker
+        :param str worker_id: Identifier of the worker that claimed the tasks
+        :param float lease_seconds: How long the tasks are reserved for from now
+        :return int: Number of leases extended
+        """
+        return self.engine.extend_claims(tasks, worker_id, lease_seconds)
+
+    async def reschedule(self, task, recur=False, delay=None):
+        """
+        Update task to be rescheduled, with its attempts
+
+        :param pytasched.task.Task task:
+        :param bool recur: If this is for recurring and we should try and keep
+                           the same schedule
+        :param float delay: Seconds from now to run the task in instead of its
+                            wait, e.g. to retry it
+        """
+        return self.engine.reschedule(task, recur, delay)
+
+    async def remove_task(self, id):
+        """
+        Remove a task from the queue
+
+        :param str id: The task ID
+        :return bool:
+        """
+        return self.engine.remove_task(id)
+
+    async def dead_letter_task(self, task, error):
+        """
+        Move a task that has failed too many times out of the schedule and to
+        the dead letters, for someone to look into
+
+        :param pytasched.tasks.Task task:
+        :param str error: Why the last attempt failed
+        :return bool: If the task was still in the schedule
+        """
+        return self.engine.dead_letter_task(task, error)
+
+    async def get_dead_letters(self, limit=None):
+        """
+        Get the tasks that were given up on, the latest first
+
+        :param int limit: Maximum number of dead letters to return, None for all
+        :return list: List of pytasched.engines.DeadLetter
+        """
+        return self.engine.get_dead_letters(limit)
+
+    async def remove_dead_letter(self, id):
+        """
+        Forget a task that was given up on, e.g. after adding it again
+
+        :param str id: The task ID
+        :return bool:
+        """
+        return self.engine.remove_dead_letter(id)
+
+
+class AsyncTaskEngine(Engine):
+    """
+    Engine to execute tasks in asyncio
+    """
+
+    def __init__(self, params):
+        self.params = params
+        super(AsyncTaskEngine, self).__init__()
+
+    async def run(self, task):
+        """
+        Run a task
+        :param pytasched.tasks.Task task:
+        """
+        raise NotImplementedError()
+
+
+class AsyncFunctionTaskEngine(AsyncTaskEngine):
+    """
+    Forward tasks to Python functions, awaiting the result if the function
+    returns something awaitable such as a coroutine. The functions should not
+    block, as they run in the event loop.
+    """
+
+    def __init__(self, params):
+        super(AsyncFunctionTaskEngine, self).__init__(params)
+        self.configured = False
+        self.callables = CallableCache(params.get("cache_size", 1024))
+
+    def _setup(self):
+        if not self.configured:
+            if "paths" in self.params:
+                for path in self.params["paths"]:
+                    self.log(DEBUG, "Adding {} to PYTHONPATH".format(path))
+                    sys.path.append(path)
+
+            self.configured = True
+
+    async def run(self, task):
+        """
+        Run the given task
+
+        :param pytasched.tasks.Task task:
+        """
+
+        self._setup()
+
+        runnable = self.callables.get(task.task)
+        result = runnable(*task.get_args(), **task.get_kwargs())
+
+        if inspect.isawaitable(result):
+            await result
@@ -0,0 +1,103 @@
+"""
+Connections shared by everything in the process, so e.g. the storage engine
+and locks use the same connection pool.
+"""
+from __future__ import unicode_literals
+
+from threading import Lock
+
+import settings as global_settings
+
+try:
+    import pymongo
+except ImportError:
+    pymongo = None
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+try:
+    from psycopg2.pool import ThreadedConnectionPool
+except ImportError:
+    ThreadedConnectionPool = None
+
+_lock = Lock()
+_mongo_clients = {}
+_redis_clients = {}
+_postgres_pools = {}
+
+
+def get_mongo_client(host=None, **options):
+    """
+    Get a shared MongoClient for the given connection string and options. The
+    pool size defaults to MONGODB_MAX_POOL_SIZE and MONGODB_MIN_POOL_SIZE in
+    settings.
+
+    :param str host: Connection string, defaults to MONGODB_CONNECTION_STRING
+    :param options: Other options for pymongo.MongoClient
+    :return pymongo.MongoClient:
+    """
+
+    if not host:
+        host = global_settings.MONGODB_CONNECTION_STRING
+
+    options.setdefault("maxPoolSize", global_settings.MONGODB_MAX_POOL_SIZE)
+    options.setdefault("minPoolSize", global_settings.MONGODB_MIN_POOL_SIZE)
+
+    key = (host, repr(sorted(options.items())))
+
+    with _lock:
+        if key not in _mongo_clients:
+            _mongo_clients[key] = pymongo.MongoClient(host, **options)
+
+        return _mongo_clients[key]
+
+
+def get_redis_client(url=None, **options):
+    """
+    Get a shared Redis client for the given URL and options, returning str
+    instead of bytes.
+
+    :param str url: Redis URL, defaults to REDIS_URL
+    :param options: Other options for redis.Redis.from_url
+    :return redis.Redis:
+    """
+
+    if not url:
+        url = global_settings.REDIS_URL
+
+    options.setdefault("decode_responses", True)
+
+    key = (url, repr(sorted(options.items())))
+
+    with _lock:
+        if key not in _redis_clients:
+            _redis_clients[key] = redis.Redis.from_url(url, **options)
+
+        return _redis_clients[key]
+
+
+def get_postgres_pool(dsn=None, maxconn=None):
+    """
+    Get a shared connection pool for the given PostgreSQL DSN
+
+    :param str dsn: Connection string, defaults to POSTGRES_DSN
+    :param int maxconn: Size of the pool, defaults to POSTGRES_MAX_POOL_SIZE
+    :return psycopg2.pool.ThreadedConnectionPool:
+    """
+
+    if not dsn:
+        dsn = global_settings.POSTGRES_DSN
+
+    if not maxconn:
+        maxconn = global_settings.POSTGRES_MAX_POOL_SIZE
+
+    key = (dsn, maxconn)
+
+    with _lock:
+        if key not in _postgres_pools:
+            _postgres_pools[key] = ThreadedConnectionPool(0, maxconn, dsn)
+
+        return _postgres_pools[key]
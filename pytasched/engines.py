@@ -1,26 +1,302 @@
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import json
 import os
+import select
+import shlex
+import signal
+import sqlite3
+import subprocess
 import sys
-from builtins import next
 from builtins import object
 from builtins import str
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from copy import copy
-from logging import DEBUG, INFO
-from time import time
+from heapq import heappop, heappush
+from itertools import count
+from logging import DEBUG, ERROR, INFO, WARNING
+from random import randrange
+from threading import Lock, RLock, Thread, Timer, local
+from time import sleep, time
 
 import settings as global_settings
+from pytasched.connections import (
+    get_mongo_client,
+    get_postgres_pool,
+    get_redis_client,
+)
 from pytasched.errors import StorageEngineNotAvailableError, TaskEngineError
 from pytasched.tasks import Task
-from pytasched.tools import load_from_module
+from pytasched.tools import CallableCache, load_from_module
+from pytasched.workers import WorkerPool
 
 try:
     import pymongo
     from bson import ObjectId
+    from pymongo.errors import DuplicateKeyError, PyMongoError
 except ImportError:
     pymongo = None
 
+try:
+    import redis
+except ImportError:
+    redis = None
+
+try:
+    import psycopg2
+    from psycopg2.extras import Json, execute_values
+except ImportError:
+    psycopg2 = None
+
+# Params for MongoDBStorageEngine that are not passed on to MongoClient
+_MONGO_ENGINE_PARAMS = ("indices", "watch", "database", "collection", "shards")
+
+# Fields to remove when a task is no longer claimed or queued
+_MONGO_UNSET_CLAIM = {"owner": "", "queued_at": "", "scheduled": ""}
+
+# Indexes for the queries MongoDBStorageEngine runs, as (keys, options)
+_MONGO_INDEXES = [
+    # Finding and claiming due tasks in order, and the next due time
+    ([("when", 1)], {}),
+]
+
+# Tables and indexes for SQLiteStorageEngine. claimed_when keeps the schedule
+# of a claimed task, as the UPDATE ... RETURNING used for claiming can only
+# return the new values.
+_SQLITE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS tasks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        task TEXT NOT NULL,
+        args TEXT,
+        kwargs TEXT,
+        wait REAL NOT NULL,
+        recurring INTEGER NOT NULL,
+        "when" REAL NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        owner TEXT,
+        claimed_when REAL,
+        options TEXT,
+        retry TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    'CREATE INDEX IF NOT EXISTS tasks_when ON tasks ("when")',
+    """
+    CREATE TABLE IF NOT EXISTS dead_letters (
+        id INTEGER PRIMARY KEY,
+        task TEXT NOT NULL,
+        args TEXT,
+        kwargs TEXT,
+        wait REAL NOT NULL,
+        recurring INTEGER NOT NULL,
+        "when" REAL NOT NULL,
+        options TEXT,
+        retry TEXT,
+        attempts INTEGER NOT NULL,
+        error TEXT,
+        failed_at REAL NOT NULL
+    )
+    """,
+]
+
+# Fields needed to construct a Task from a SQLite row
+_SQLITE_TASK_COLUMNS = (
+    'id, task, args, kwargs, wait, recurring, "when", options, retry, attempts'
+)
+
+# Columns added after the tasks table was first released, as (name, type), to
+# add to existing tables
+_SQLITE_ADDED_COLUMNS = [
+    ("options", "TEXT"),
+    ("retry", "TEXT"),
+    ("attempts", "INTEGER NOT NULL DEFAULT 0"),
+]
+
+# Adding a task, with the values from _task_to_sqlite_row
+_SQLITE_INSERT = (
+    'INSERT INTO tasks (task, args, kwargs, wait, recurring, "when", options, '
+    "retry, attempts) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+# Moving a task to a new time, releasing any claim on it
+_SQLITE_RESCHEDULE = (
+    "UPDATE tasks SET \"when\" = ?, attempts = ?, status = 'pending', "
+    "owner = NULL, claimed_when = NULL WHERE id = ?"
+)
+
+# UPDATE ... RETURNING is available from SQLite 3.35
+_SQLITE_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Table and index for PostgresStorageEngine, formatted with the table name
+_POSTGRES_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS {table} (
+        id BIGSERIAL PRIMARY KEY,
+        task TEXT NOT NULL,
+        args JSONB,
+        kwargs JSONB,
+        wait DOUBLE PRECISION NOT NULL,
+        recurring BOOLEAN NOT NULL,
+        "when" DOUBLE PRECISION NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        owner TEXT,
+        options JSONB,
+        retry JSONB,
+        attempts INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    # Tables created before these were stored
+    "ALTER TABLE {table} ADD COLUMN IF NOT EXISTS options JSONB",
+    "ALTER TABLE {table} ADD COLUMN IF NOT EXISTS retry JSONB",
+    "ALTER TABLE {table} ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL "
+    "DEFAULT 0",
+    'CREATE INDEX IF NOT EXISTS {table}_when ON {table} ("when")',
+    """
+    CREATE TABLE IF NOT EXISTS {table}_dead_letters (
+        id BIGINT PRIMARY KEY,
+        task TEXT NOT NULL,
+        args JSONB,
+        kwargs JSONB,
+        wait DOUBLE PRECISION NOT NULL,
+        recurring BOOLEAN NOT NULL,
+        "when" DOUBLE PRECISION NOT NULL,
+        options JSONB,
+        retry JSONB,
+        attempts INTEGER NOT NULL,
+        error TEXT,
+        failed_at DOUBLE PRECISION NOT NULL
+    )
+    """,
+]
+
+# Fields needed to construct a Task from a PostgreSQL row
+_POSTGRES_TASK_COLUMNS = (
+    'id, task, args, kwargs, wait, recurring, "when", options, retry, attempts'
+)
+
+# Task fields stored in the Redis hash of each task, in the order the scripts
+# return them
+_REDIS_TASK_FIELDS = (
+    "task",
+    "args",
+    "kwargs",
+    "wait",
+    "recurring",
+    "when",
+    "options",
+    "retry",
+    "attempts",
+)
+
+# Claim up to ARGV[2] tasks due before ARGV[1] for worker ARGV[4], moving them
+# to ARGV[3] in the schedule KEYS[1]. Task hashes are ARGV[5] .. id. Returns
+# the id and _REDIS_TASK_FIELDS of each claimed task, as they were before.
+_REDIS_CLAIM_SCRIPT = """
+local ids = redis.call("ZRANGEBYSCORE", KEYS[1], "-inf", "(" .. ARGV[1],
+                       "LIMIT", 0, ARGV[2])
+local claimed = {}
+
+for _, id in ipairs(ids) do
+    local key = ARGV[5] .. id
+    local item = redis.call("HMGET", key, "task", "args", "kwargs", "wait",
+                            "recurring", "when", "options", "retry",
+                            "attempts")
+
+    if item[1] then
+        redis.call("ZADD", KEYS[1], ARGV[3], id)
+        redis.call("HSET", key, "when", ARGV[3], "status", "leased",
+                   "owner", ARGV[4])
+        table.insert(item, 1, id)
+        table.insert(claimed, item)
+    else
+        -- The task was removed, but not from the schedule
+        redis.call("ZREM", KEYS[1], id)
+    end
+end
+
+return claimed
+"""
+
+# Claim task ARGV[1] for worker ARGV[4] by moving it to ARGV[3] in the
+# schedule KEYS[1], if it's still scheduled for ARGV[2]. Returns 1 if claimed.
+_REDIS_CLAIM_TASK_SCRIPT = """
+if redis.call("HGET", KEYS[2], "when") ~= ARGV[2] then
+    return 0
+end
+
+redis.call("ZADD", KEYS[1], ARGV[3], ARGV[1])
+redis.call("HSET", KEYS[2], "when", ARGV[3], "status", "leased",
+           "owner", ARGV[4])
+
+return 1
+"""
+
+# Move the tasks ARGV[4] .. that worker ARGV[1] has claimed to ARGV[2] in the
+# schedule KEYS[1]. Task hashes are ARGV[3] .. id. Returns the number moved.
+_REDIS_EXTEND_SCRIPT = """
+local extended = 0
+
+for i = 4, #ARGV do
+    local key = ARGV[3] .. ARGV[i]
+
+    if redis.call("HGET", key, "owner") == ARGV[1] then
+        redis.call("ZADD", KEYS[1], ARGV[2], ARGV[i])
+        redis.call("HSET", key, "when", ARGV[2])
+        extended = extended + 1
+    end
+end
+
+return extended
+"""
+
+# Move task ARGV[1] with hash KEYS[2] to ARGV[2] in the schedule KEYS[1] with
+# ARGV[3] attempts, releasing any claim on it. Returns 1 if the task exists.
+_REDIS_RESCHEDULE_SCRIPT = """
+if redis.call("EXISTS", KEYS[2]) == 0 then
+    return 0
+end
+
+redis.call("ZADD", KEYS[1], ARGV[2], ARGV[1])
+redis.call("HSET", KEYS[2], "when", ARGV[2], "attempts", ARGV[3], "status",
+           "pending")
+redis.call("HDEL", KEYS[2], "owner")
+
+return 1
+"""
+
+# Collections we have already ensured the indexes for in this process
+_mongo_indexed = set()
+
+# Engines shared in the process, by settings and type of engine
+_engines = {}
+_engines_lock = Lock()
+
+# Change stream events that might make a task due earlier than expected, or
+# put a task in the work queue
+_MONGO_WATCH_PIPELINE = [
+    {
+        "$match": {
+            "$or": [
+                {"operationType": {"$in": ["insert", "replace"]}},
+                {"updateDescription.updatedFields.when": {"$exists": True}},
+                {"updateDescription.updatedFields.queued_at": {"$exists": True}},
+            ]
+        }
+    },
+    {
+        "$project": {
+            "operationType": 1,
+            "fullDocument.when": 1,
+            "updateDescription.updatedFields.when": 1,
+            "updateDescription.updatedFields.queued_at": 1,
+        }
+    },
+]
+
 
 def _setup_engine(class_definition, params):
     """
@@ -35,33 +311,181 @@ def _setup_engine(class_definition, params):
     return cls(params)
 
 
-def get_storage_engine(settings=None):
+def _get_shared_engine(settings, name):
+    """
+    Get the engine configured in settings, creating it if it's not been used
+    in this process yet.
+
+    :param module settings:
+    :param str name: Name of the engine setting, "STORAGE" or "TASKS"
+    :return Engine:
+    """
+
+    key = (settings, name)
+
+    with _engines_lock:
+        if key not in _engines:
+            config = getattr(settings, name)
+            _engines[key] = _setup_engine(config["engine"], config["params"])
+
+        return _engines[key]
+
+
+def clear_engines():
+    """
+    Forget the shared engines, the next call to get_storage_engine or
+    get_task_engine creates new ones.
+    """
+
+    with _engines_lock:
+        _engines.clear()
+
+
+def get_storage_engine(settings=None, shared=True):
     """
     Get a storage engine for tasks based on settings
 
     :param module settings: If you want to override global settings
+    :param bool shared: Use the engine shared in this process for the same
+                        settings instead of creating a new one
     :return pytasched.engines.StorageEngine: Instance of the engine that's
                                              already configured
     """
     if not settings:
         settings = global_settings
 
+    if shared:
+        return _get_shared_engine(settings, "STORAGE")
+
     return _setup_engine(settings.STORAGE["engine"], settings.STORAGE["params"])
 
 
-def get_task_engine(settings=None):
+def get_task_engine(settings=None, shared=True):
     """
     Get a task engine for processing tasks based on settings
 
     :param module settings: If you want to override global settings
+    :param bool shared: Use the engine shared in this process for the same
+                        settings instead of creating a new one
     :return TaskEngine: Instance of the engine that's already configured
     """
     if not settings:
         settings = global_settings
 
+    if shared:
+        return _get_shared_engine(settings, "TASKS")
+
     return _setup_engine(settings.TASKS["engine"], settings.TASKS["params"])
 
 
+# Fields needed to construct a Task from a MongoDB entry
+_MONGO_TASK_PROJECTION = [
+    "task",
+    "args",
+    "kwargs",
+    "wait",
+    "recurring",
+    "when",
+    "shard",
+    "options",
+    "retry",
+    "attempts",
+]
+
+
+def _get_mongo_index_plan(params):
+    """
+    Get the indexes to create for the given MongoDB engine params, the ones in
+    "indices" replace the default ones on the same keys.
+
+    :param dict params: "indices" maps a field name, or a tuple of them for a
+                        compound index, to options for create_index
+    :return list: (keys, options) tuples for create_index
+    """
+
+    indexes = list(_MONGO_INDEXES)
+    if params.get("shards"):
+        # Finding due tasks in the shards owned by a server
+        indexes.append(([("shard", 1), ("when", 1)], {}))
+
+    plan = OrderedDict(
+        (tuple(field for field, _ in keys), (keys, options))
+        for keys, options in indexes
+    )
+
+    for fields, options in params.get("indices", {}).items():
+        if isinstance(fields, str):
+            fields = (fields,)
+
+        plan[tuple(fields)] = ([(field, 1) for field in fields], options)
+
+    return list(plan.values())
+
+
+def _get_mongo_due_query(until, shards=None):
+    """
+    Get the query for the tasks due before until
+
+    :param float until:
+    :param list shards: Only tasks in these shards, None for all
+    :return dict:
+    """
+
+    query = {"when": {"$lt": until}}
+
+    if shards is not None:
+        query["shard"] = _get_mongo_shard_filter(shards)
+
+    return query
+
+
+def _get_mongo_shard_filter(shards):
+    """
+    Get the filter for the tasks in the given shards. Tasks added without
+    shards, e.g. before they were enabled or by clients without the "shards"
+    param, are left to the owner of shard 0 so they still run.
+
+    :param list shards:
+    :return dict:
+    """
+
+    shards = list(shards)
+
+    if 0 in shards:
+        shards.append(None)
+
+    return {"$in": shards}
+
+
+def _get_mongo_plan_stages(plan):
+    """
+    Get all the stages used in the explain() output for a query
+
+    :param dict plan: The "queryPlanner" of explain()
+    :return set:
+    """
+
+    stages = set()
+    pending = [plan["winningPlan"]]
+
+    while pending:
+        stage = pending.pop()
+
+        if "stage" in stage:
+            stages.add(stage["stage"])
+
+        if "inputStage" in stage:
+            pending.append(stage["inputStage"])
+
+        pending.extend(stage.get("inputStages", []))
+
+        # Sharded clusters have a plan per shard
+        for shard in stage.get("shards", []):
+            pending.append(shard["winningPlan"])
+
+    return stages
+
+
 def _mongo_item_to_task(item):
     """
     Convert a MongoDB entry to a Task
@@ -77,32 +501,185 @@ def _mongo_item_to_task(item):
         wait=item["wait"],
         recurring=item["recurring"],
         when=item["when"],
+        shard=item.get("shard"),
+        options=item.get("options"),
+        attempts=item.get("attempts", 0),
+        **(item.get("retry") or {})
     )
 
 
-class _MongoDBCursorWrapper(object):
+def _task_to_mongo_item(task):
     """
-    Wraps MongoDB cursor to make it look a bit more like a list of Tasks
+    Convert a Task to a MongoDB entry
+
+    :param pytasched.tasks.Task task:
+    :return dict:
     """
+    return {
+        "task": task.task,
+        "args": task.args,
+        "kwargs": task.kwargs,
+        "wait": task.wait,
+        "when": task.when,
+        "recurring": task.recurring,
+        "status": "pending",
+        "shard": task.shard,
+        "options": task.options,
+        "retry": task.get_retry(),
+        "attempts": task.attempts,
+    }
 
-    def __init__(self, cursor):
-        """
-        :param pymongo.cursor.Cursor cursor:
-        :return:
-        """
-        self.cursor = cursor
 
-    def __len__(self):
-        return self.cursor.count()
+def _postgres_row_to_task(row):
+    """
+    Convert a PostgreSQL row to a Task
+
+    :param tuple row: Values for _POSTGRES_TASK_COLUMNS
+    :return pytasched.tasks.Task:
+    """
+    id, task, args, kwargs, wait, recurring, when, options, retry, attempts = row
+
+    return Task(
+        id=str(id),
+        task=task,
+        args=args,
+        kwargs=kwargs,
+        wait=wait,
+        recurring=recurring,
+        when=when,
+        options=options,
+        attempts=attempts,
+        **(retry or {})
+    )
+
+
+def _task_to_postgres_row(task):
+    """
+    Convert a Task to values for inserting to PostgreSQL
+
+    :param pytasched.tasks.Task task:
+    :return tuple: task, args, kwargs, wait, recurring, when, options, retry,
+                   attempts
+    """
+    return (
+        task.task,
+        Json(task.args),
+        Json(task.kwargs),
+        task.wait,
+        bool(task.recurring),
+        task.when,
+        Json(task.options),
+        Json(task.get_retry()),
+        task.attempts,
+    )
+
+
+def _redis_when(when):
+    """
+    Format a time for storing in Redis, so it can be compared as a string
+
+    :param float when:
+    :return str:
+    """
+    return repr(float(when))
+
+
+def _redis_item_to_task(id, item):
+    """
+    Convert the fields of a Redis hash to a Task
+
+    :param str id:
+    :param list item: Values for _REDIS_TASK_FIELDS
+    :return pytasched.tasks.Task:
+    """
+    task, args, kwargs, wait, recurring, when, options, retry, attempts = item
+    retry = json.loads(retry) if retry else None
+
+    return Task(
+        id=id,
+        task=task,
+        args=json.loads(args),
+        kwargs=json.loads(kwargs),
+        wait=float(wait),
+        recurring=recurring == "1",
+        when=float(when),
+        options=json.loads(options) if options else None,
+        attempts=int(attempts) if attempts else 0,
+        **(retry or {})
+    )
+
+
+def _task_to_redis_item(task):
+    """
+    Convert a Task to the fields of a Redis hash
+
+    :param pytasched.tasks.Task task:
+    :return dict:
+    """
+    return {
+        "task": task.task,
+        "args": json.dumps(task.args),
+        "kwargs": json.dumps(task.kwargs),
+        "wait": repr(float(task.wait)),
+        "recurring": "1" if task.recurring else "0",
+        "when": _redis_when(task.when),
+        "options": json.dumps(task.options),
+        "retry": json.dumps(task.get_retry()),
+        "attempts": "{}".format(task.attempts),
+        "status": "pending",
+    }
+
+
+def _sqlite_row_to_task(row):
+    """
+    Convert a SQLite row to a Task
+
+    :param tuple row: Values for _SQLITE_TASK_COLUMNS
+    :return pytasched.tasks.Task:
+    """
+    id, task, args, kwargs, wait, recurring, when, options, retry, attempts = row
+    retry = json.loads(retry) if retry else None
+
+    return Task(
+        id=str(id),
+        task=task,
+        args=json.loads(args) if args else None,
+        kwargs=json.loads(kwargs) if kwargs else None,
+        wait=wait,
+        recurring=bool(recurring),
+        when=when,
+        options=json.loads(options) if options else None,
+        attempts=attempts,
+        **(retry or {})
+    )
 
-    def __getitem__(self, index):
-        return _mongo_item_to_task(self.cursor[index])
 
-    def __iter__(self):
-        return self
+def _task_to_sqlite_row(task):
+    """
+    Convert a Task to values for inserting to SQLite
+
+    :param pytasched.tasks.Task task:
+    :return tuple: task, args, kwargs, wait, recurring, when, options, retry,
+                   attempts
+    """
+    retry = task.get_retry()
+
+    return (
+        task.task,
+        json.dumps(task.args) if task.args is not None else None,
+        json.dumps(task.kwargs) if task.kwargs is not None else None,
+        task.wait,
+        int(bool(task.recurring)),
+        task.when,
+        json.dumps(task.options) if task.options is not None else None,
+        json.dumps(retry) if retry is not None else None,
+        task.attempts,
+    )
+
 
-    def __next__(self):
-        return _mongo_item_to_task(next(self.cursor))
+# A task that was given up on, with the error from the last attempt and when
+# it was given up on
+DeadLetter = namedtuple("DeadLetter", ["task", "error", "failed_at"])
 
 
 class Engine(object):
@@ -112,6 +689,7 @@ class Engine(object):
 
     def __init__(self):
         self.logger = None
+        self.listeners = []
 
     def set_logger(self, logger):
         """
@@ -127,18 +705,59 @@ class Engine(object):
         if self.logger:
             self.logger.log(level, msg, *args, **kwargs)
 
+    def add_listener(self, callback):
+        """
+        Add a callback to be notified when a task is scheduled, e.g. so the
+        server can wake up early for it.
+
+        :param function callback: Called with the "when" of the task
+        """
+        self.listeners.append(callback)
+
+    def notify(self, when):
+        """
+        Notify the listeners that a task was scheduled
+
+        :param float|None when: When the task is scheduled for, None for now
+        """
+        for callback in self.listeners:
+            callback(when)
+
 
 class StorageEngine(Engine):
     """
     Base class for storage engines. Storage engines are responsible for storing
     the information about the tasks, and allow convenient functions to add,
     search, and remove tasks from the schedule.
+
+    Engines that support sharding assign each task to one of the "shards" in
+    their params when it's added, can limit the due task queries to some of
+    the shards, and keep track of the servers sharing the shards.
+
+    Engines that support the work queue can be used with the "dispatcher"
+    TOPOLOGY, where a leader moves the due tasks to a queue that the workers
+    take them from.
     """
 
+    supports_shards = False
+    supports_work_queue = False
+
     def __init__(self, params):
         self.params = params
         super(StorageEngine, self).__init__()
 
+    def _assign_shard(self, task):
+        """
+        Put the task in a random shard, if shards are used and it's not in
+        one already
+
+        :param pytasched.tasks.Task task:
+        """
+
+        shards = self.params.get("shards")
+        if shards and task.shard is None:
+            task.shard = randrange(shards)
+
     def setup(self):
         """
         Set up the storage engine, e.g. tables, indexes, etc.
@@ -158,6 +777,15 @@ class StorageEngine(Engine):
         """
         raise NotImplementedError()
 
+    def add_tasks(self, tasks):
+        """
+        Add many new tasks to be processed at once
+
+        :param list tasks: List of pytasched.tasks.Task
+        :return list: The IDs of the tasks, in the same order
+        """
+        return [self.add_task(task) for task in tasks]
+
     def get_task(self, id):
         """
         Get the specific task
@@ -167,9 +795,23 @@ class StorageEngine(Engine):
         """
         raise NotImplementedError()
 
-    def get_task_list(self):
+    def get_task_names(self):
+        """
+        Get the distinct names of all the scheduled tasks, i.e. their task
+        field, e.g. to prepare the task engine for them
+
+        :return set:
+        """
+        return {task.task for task in self.get_task_list(until=float("inf"))}
+
+    def get_task_list(self, limit=None, until=None, shards=None):
         """
-        Get a list of tasks that need to be run
+        Get a list of tasks that need to be run, the ones that should have
+        been run first are first in the list.
+
+        :param int limit: Maximum number of tasks to return, None for all
+        :param float until: Get tasks scheduled before this instead of now
+        :param list shards: Only tasks in these shards, None for all
         :return list:
         """
         raise NotImplementedError()
@@ -183,6 +825,44 @@ class StorageEngine(Engine):
         """
         raise NotImplementedError()
 
+    def remove_tasks(self, ids):
+        """
+        Remove many tasks from the queue at once
+
+        :param list ids: The task IDs
+        :return int: Number of tasks removed
+        """
+        return sum(1 for id in ids if self.remove_task(id))
+
+    def dead_letter_task(self, task, error):
+        """
+        Move a task that has failed too many times out of the schedule and to
+        the dead letters, for someone to look into
+
+        :param pytasched.tasks.Task task:
+        :param str error: Why the last attempt failed
+        :return bool: If the task was still in the schedule
+        """
+        raise NotImplementedError()
+
+    def get_dead_letters(self, limit=None):
+        """
+        Get the tasks that were given up on, the latest first
+
+        :param int limit: Maximum number of dead letters to return, None for all
+        :return list: List of DeadLetter
+        """
+        raise NotImplementedError()
+
+    def remove_dead_letter(self, id):
+        """
+        Forget a task that was given up on, e.g. after adding it again
+
+        :param str id: The task ID
+        :return bool:
+        """
+        raise NotImplementedError()
+
     def has_task_changed(self, task):
         """
         Check if the task has changed / been deleted since it was loaded.
@@ -192,86 +872,424 @@ class StorageEngine(Engine):
         """
         raise NotImplementedError()
 
-    def reschedule(self, task, recur=False):
+    def reschedule(self, task, recur=False, delay=None):
         """
-        Update task to be rescheduled
+        Update task to be rescheduled, with its attempts
 
         :param pytasched.task.Task task:
         :param bool recur: If this is for recurring and we should try and keep
                            the same schedule
+        :param float delay: Seconds from now to run the task in instead of its
+                            wait, e.g. to retry it
         """
         raise NotImplementedError()
 
+    def reschedule_many(self, tasks, recur=False):
+        """
+        Update many tasks to be rescheduled at once
 
-class MongoDBStorageEngine(StorageEngine):
-    """
-    Storage engine that uses MongoDB to store tasks
-    """
-
-    def __init__(self, params, db=None):
-        if not pymongo:
-            raise StorageEngineNotAvailableError("Could not find pymongo")
-
-        self._db = db
-        super(MongoDBStorageEngine, self).__init__(params)
+        :param list tasks: List of pytasched.tasks.Task
+        :param bool recur: If this is for recurring and we should try and keep
+                           the same schedule
+        :return int: Number of tasks rescheduled
+        """
+        return sum(1 for task in tasks if self.reschedule(task, recur))
 
-    def _get_db(self):
-        if not self._db:
-            self.log(DEBUG, "Connecting to MongoDB")
+    def get_next_when(self, shards=None):
+        """
+        Get the time the next task is scheduled for
 
-            params = copy(self.params)
-            del params["indices"]
+        :param list shards: Only tasks in these shards, None for all
+        :return float|None: None if there are no tasks
+        """
+        raise NotImplementedError()
 
-            client = pymongo.MongoClient(**params)
-            self._db = getattr(client, global_settings.MONGODB_DATABASE)
-            self.setup()
+    def claim_due_tasks(self, worker_id, limit, lease_seconds, shards=None):
+        """
+        Atomically claim tasks that need to be run for the given worker. A
+        claimed task will not be returned to other workers until the lease
+        expires, so it should be removed or rescheduled before that.
 
-        return self._db
+        :param str worker_id: Identifier of the worker claiming the tasks
+        :param int limit: Maximum number of tasks to claim
+        :param float lease_seconds: How long the tasks are reserved for
+        :param list shards: Only tasks in these shards, None for all
+        :return list: The claimed tasks, as they were before claiming
+        """
+        raise NotImplementedError()
 
-    def _get_collection(self):
+    def claim_task(self, task, worker_id, lease_seconds):
         """
-        Get the collection our tasks are stored in
-        :return pymongo.collection.Collection:
+        Atomically claim a specific task for the given worker, if it has not
+        changed since it was loaded.
+
+        :param pytasched.tasks.Task task:
+        :param str worker_id: Identifier of the worker claiming the task
+        :param float lease_seconds: How long the task is reserved for
+        :return bool: If the task was claimed
         """
-        db = self._get_db()
-        return getattr(db, global_settings.MONGODB_COLLECTION)
+        raise NotImplementedError()
 
-    def _get_now(self):
+    def extend_claims(self, tasks, worker_id, lease_seconds):
         """
-        Get current time
+        Move the leases of tasks the worker has claimed and is still running
+        forward, so they aren't claimed again while they run. Tasks that were
+        completed or claimed by others since are left alone.
+
+        :param list tasks: Tasks claimed by the worker
+        :param str worker_id: Identifier of the worker that claimed the tasks
+        :param float lease_seconds: How long the tasks are reserved for from now
+        :return int: Number of leases extended
         """
-        return time()
+        raise NotImplementedError()
 
-    def set_db(self, db):
+    def watch(self):
         """
-        Override the database, if you already have a connection made so we
-        don't need to make another one.
+        Start watching for changes made by others, notifying the listeners
+        about new and rescheduled tasks.
 
-        :param pymongo.database.Database db:
+        :return bool: If watching is supported, if not you have to poll
         """
-        self._db = db
+        return False
 
-    def setup(self):
+    def unwatch(self):
         """
-        Set up the storage engine, e.g. tables, indexes, etc.
+        Stop watching for changes
         """
-        collection = self._get_collection()
+        pass
 
-        indices = copy(self.params["indices"])
+    def heartbeat(self, worker_id, timeout):
+        """
+        Let others know the worker is sharing the shards, for the next timeout
+        seconds
 
-        if "when" not in indices:
-            indices["when"] = {}
+        :param str worker_id: Identifier of the worker
+        :param float timeout: Seconds until the worker is considered gone
+        """
+        raise NotImplementedError()
 
-        for index in indices:
-            self.log(DEBUG, "Ensuring we have index for {}".format(index))
+    def get_members(self):
+        """
+        Get the workers sharing the shards
 
-            options = indices[index]
-            collection.create_index(index, *options)
-            self.log(DEBUG, "Done.")
+        :return list: Identifiers of the workers with a valid heartbeat
+        """
+        raise NotImplementedError()
 
-    def add_task(self, task):
+    def leave(self, worker_id):
         """
-        Add a new task to be processed
+        Stop sharing the shards with the others
+
+        :param str worker_id: Identifier of the worker
+        """
+        raise NotImplementedError()
+
+    def acquire_leadership(self, worker_id, lease_seconds):
+        """
+        Become or stay the leader for the next lease_seconds, if nobody else
+        is the leader.
+
+        :param str worker_id: Identifier of the worker
+        :param float lease_seconds: How long the leadership lasts if not renewed
+        :return bool: If the worker is the leader
+        """
+        raise NotImplementedError()
+
+    def release_leadership(self, worker_id):
+        """
+        Stop being the leader, if the worker is the leader
+
+        :param str worker_id: Identifier of the worker
+        """
+        raise NotImplementedError()
+
+    def setup_work_queue(self):
+        """
+        Set up the storage engine for handing claimed tasks to other workers
+        with queue_tasks() and take_queued_tasks()
+        """
+        raise NotImplementedError()
+
+    def queue_tasks(self, tasks):
+        """
+        Put claimed tasks in the work queue for any worker to take
+
+        :param list tasks: Tasks returned by claim_due_tasks()
+        :return int: Number of tasks queued
+        """
+        raise NotImplementedError()
+
+    def take_queued_tasks(self, worker_id, limit, lease_seconds):
+        """
+        Atomically take tasks from the work queue for the given worker, in
+        the order they were queued.
+
+        :param str worker_id: Identifier of the worker taking the tasks
+        :param int limit: Maximum number of tasks to take
+        :param float lease_seconds: How long the tasks are reserved for
+        :return list: The tasks, with the time they were scheduled for
+        """
+        raise NotImplementedError()
+
+
+class MongoDBStorageEngine(StorageEngine):
+    """
+    Storage engine that uses MongoDB to store tasks
+    """
+
+    supports_shards = True
+    supports_work_queue = True
+
+    def __init__(self, params, db=None):
+        if not pymongo:
+            raise StorageEngineNotAvailableError("Could not find pymongo")
+
+        self._db = db
+        self._change_stream = None
+        super(MongoDBStorageEngine, self).__init__(params)
+
+    def _get_db(self):
+        if not self._db:
+            self.log(DEBUG, "Connecting to MongoDB")
+
+            params = copy(self.params)
+            for param in _MONGO_ENGINE_PARAMS:
+                params.pop(param, None)
+
+            client = get_mongo_client(**params)
+            database = self.params.get("database", global_settings.MONGODB_DATABASE)
+            self._db = getattr(client, database)
+            self.setup()
+
+        return self._db
+
+    def _get_collection(self):
+        """
+        Get the collection our tasks are stored in
+        :return pymongo.collection.Collection:
+        """
+        db = self._get_db()
+        name = self.params.get("collection", global_settings.MONGODB_COLLECTION)
+        return getattr(db, name)
+
+    def _get_members_collection(self):
+        """
+        Get the collection the servers sharing the shards are tracked in
+        :return pymongo.collection.Collection:
+        """
+        collection = self._get_collection()
+        return collection.database[collection.name + "_members"]
+
+    def _get_leader_collection(self):
+        """
+        Get the collection the leadership is tracked in
+        :return pymongo.collection.Collection:
+        """
+        collection = self._get_collection()
+        return collection.database[collection.name + "_leader"]
+
+    def _get_dead_letters_collection(self):
+        """
+        Get the collection the tasks that were given up on are moved to
+        :return pymongo.collection.Collection:
+        """
+        collection = self._get_collection()
+        return collection.database[collection.name + "_dead_letters"]
+
+    def _get_now(self):
+        """
+        Get current time
+        """
+        return time()
+
+    def set_db(self, db):
+        """
+        Override the database, if you already have a connection made so we
+        don't need to make another one.
+
+        :param pymongo.database.Database db:
+        """
+        self._db = db
+
+    def watch(self):
+        """
+        Start watching a change stream for new and rescheduled tasks, if
+        enabled with the "watch" param. Change streams need a replica set or
+        a sharded cluster, if they are not available we fall back to polling.
+
+        :return bool: If watching was started
+        """
+
+        if not self.params.get("watch"):
+            return False
+
+        try:
+            self._change_stream = self._get_collection().watch(_MONGO_WATCH_PIPELINE)
+        except (PyMongoError, NotImplementedError) as e:
+            self.log(
+                WARNING,
+                "Could not watch for changes, falling back to polling: {}".format(e),
+            )
+            return False
+
+        self.log(INFO, "Watching for changes to tasks")
+
+        thread = Thread(target=self._watch_changes, name="pytasched-watch")
+        thread.daemon = True
+        thread.start()
+
+        return True
+
+    def unwatch(self):
+        """
+        Stop watching for changes
+        """
+
+        stream = self._change_stream
+        self._change_stream = None
+
+        if stream:
+            stream.close()
+
+    def _watch_changes(self):
+        """
+        Notify listeners about the changes from the change stream until it's
+        closed. If the stream breaks it's resumed, and if that fails we give up
+        and leave it to polling.
+        """
+
+        while self._change_stream:
+            stream = self._change_stream
+
+            try:
+                for change in stream:
+                    self._notify_change(change)
+            except PyMongoError as e:
+                if not self._change_stream:
+                    return
+
+                self.log(WARNING, "Change stream failed, resuming: {}".format(e))
+                sleep(1)
+
+                try:
+                    self._change_stream = self._get_collection().watch(
+                        _MONGO_WATCH_PIPELINE, resume_after=stream.resume_token
+                    )
+                except PyMongoError as e:
+                    self.log(
+                        WARNING,
+                        "Could not resume watching for changes, falling back "
+                        "to polling: {}".format(e),
+                    )
+                    self._change_stream = None
+            else:
+                # Iteration only ends when the stream is closed
+                return
+
+    def _notify_change(self, change):
+        """
+        Notify listeners about a change stream event
+
+        :param dict change:
+        """
+
+        if change["operationType"] != "update":
+            when = change["fullDocument"]["when"]
+        else:
+            # Queued tasks can be taken right away
+            when = change["updateDescription"]["updatedFields"].get("when")
+
+        self.notify(when)
+
+    def setup(self):
+        """
+        Set up the storage engine, e.g. tables, indexes, etc.
+        """
+        collection = self._get_collection()
+
+        key = (id(collection.database.client), collection.full_name)
+        if key in _mongo_indexed:
+            return
+
+        for keys, options in _get_mongo_index_plan(self.params):
+            self.log(DEBUG, "Ensuring we have index for {}".format(keys))
+            collection.create_index(keys, **options)
+            self.log(DEBUG, "Done.")
+
+        _mongo_indexed.add(key)
+        self.check_indexes()
+
+        if self.params.get("shards"):
+            self.assign_missing_shards()
+
+    def assign_missing_shards(self):
+        """
+        Put the tasks stored without a shard, e.g. before "shards" was
+        enabled, in random shards so they're spread between the servers
+
+        :return int: Number of tasks assigned a shard
+        """
+
+        shards = self.params["shards"]
+        collection = self._get_collection()
+
+        by_shard = {}
+        for item in collection.find({"shard": None}, projection=["_id"]):
+            by_shard.setdefault(randrange(shards), []).append(item["_id"])
+
+        assigned = 0
+        for shard, ids in by_shard.items():
+            result = collection.update_many(
+                {"_id": {"$in": ids}, "shard": None}, {"$set": {"shard": shard}}
+            )
+            assigned += result.modified_count
+
+        if assigned:
+            self.log(INFO, "Assigned {} task(s) without a shard".format(assigned))
+
+        return assigned
+
+    def check_indexes(self):
+        """
+        Check with explain() that the queries used for finding tasks to run
+        use indexes, logging a warning for the ones that scan the collection.
+
+        :return list: Names of the queries that scan the whole collection
+        """
+
+        collection = self._get_collection()
+
+        now = self._get_now()
+        queries = [
+            ("due tasks", {"when": {"$lt": now}}),
+            ("next due time", {}),
+        ]
+
+        scans = []
+
+        for name, query in queries:
+            cursor = collection.find(query, projection=["when"])
+            cursor = cursor.sort("when", pymongo.ASCENDING).limit(1)
+
+            try:
+                plan = cursor.explain()
+            except PyMongoError as e:
+                self.log(WARNING, "Could not explain {} query: {}".format(name, e))
+                continue
+
+            if "COLLSCAN" in _get_mongo_plan_stages(plan["queryPlanner"]):
+                self.log(
+                    WARNING,
+                    "The {} query is scanning the whole collection, check the "
+                    "indexes on {}".format(name, collection.full_name),
+                )
+                scans.append(name)
+
+        return scans
+
+    def add_task(self, task):
+        """
+        Add a new task to be processed
 
         :param pytasched.tasks.Task task:
         :returns str: The ID of the task
@@ -284,79 +1302,2273 @@ class MongoDBStorageEngine(StorageEngine):
         if not task.when:
             task.when = self._get_now() + task.wait
 
-        result = collection.insert_one(
+        self._assign_shard(task)
+
+        result = collection.insert_one(_task_to_mongo_item(task))
+        self.notify(task.when)
+
+        return str(result.inserted_id)
+
+    def add_tasks(self, tasks):
+        """
+        Add many new tasks to be processed at once
+
+        :param list tasks: List of pytasched.tasks.Task
+        :return list: The IDs of the tasks, in the same order
+        """
+
+        if not tasks:
+            return []
+
+        self.log(INFO, "Adding {} tasks".format(len(tasks)))
+
+        collection = self._get_collection()
+
+        now = self._get_now()
+        for task in tasks:
+            if not task.when:
+                task.when = now + task.wait
+
+            self._assign_shard(task)
+
+        result = collection.insert_many(
+            [_task_to_mongo_item(task) for task in tasks], ordered=False
+        )
+        self.notify(min(task.when for task in tasks))
+
+        return [str(id) for id in result.inserted_ids]
+
+    def get_task(self, id):
+        """
+        Get the specific task
+
+        :param str id:
+        :return pytasched.tasks.Task:
+        """
+
+        collection = self._get_collection()
+
+        item = collection.find_one({"_id": ObjectId(id)})
+
+        if item:
+            return _mongo_item_to_task(item)
+        else:
+            return None
+
+    def get_task_names(self):
+        """
+        Get the distinct names of all the scheduled tasks, i.e. their task
+        field, e.g. to prepare the task engine for them
+
+        :return set:
+        """
+        return set(self._get_collection().distinct("task"))
+
+    def get_task_list(self, limit=None, until=None, shards=None):
+        """
+        Get the tasks that should be run, the ones that should have been run
+        first are first in the list.
+
+        :param int limit: Maximum number of tasks to return, None for all
+        :param float until: Get tasks scheduled before this instead of now
+        :param list shards: Only tasks in these shards, None for all
+        :return list:
+        """
+
+        collection = self._get_collection()
+
+        if until is None:
+            until = self._get_now()
+
+        cursor = collection.find(
+            _get_mongo_due_query(until, shards), projection=_MONGO_TASK_PROJECTION
+        ).sort("when", pymongo.ASCENDING)
+
+        if limit:
+            cursor = cursor.limit(limit).batch_size(limit)
+
+        return [_mongo_item_to_task(item) for item in cursor]
+
+    def get_next_when(self, shards=None):
+        """
+        Get the time the next task is scheduled for
+
+        :param list shards: Only tasks in these shards, None for all
+        :return float|None: None if there are no tasks
+        """
+
+        collection = self._get_collection()
+
+        query = {} if shards is None else {"shard": _get_mongo_shard_filter(shards)}
+        item = collection.find_one(
+            query, projection=["when"], sort=[("when", pymongo.ASCENDING)]
+        )
+
+        return item["when"] if item else None
+
+    def has_task_changed(self, task):
+        """
+        Check if the task has changed / been deleted since it was loaded.
+
+        :param pytasched.tasks.Task task:
+        :return bool:
+        """
+
+        reloaded = self.get_task(task.id)
+
+        if reloaded is None:
+            return True
+
+        if reloaded.when != task.when:
+            return True
+
+        return False
+
+    def claim_due_tasks(self, worker_id, limit, lease_seconds, shards=None):
+        """
+        Atomically claim tasks that need to be run for the given worker.
+
+        The lease works by moving the task's "when" forward by lease_seconds,
+        so if the worker never removes or reschedules the task it becomes due
+        again and another worker can claim it.
+
+        :param str worker_id: Identifier of the worker claiming the tasks
+        :param int limit: Maximum number of tasks to claim
+        :param float lease_seconds: How long the tasks are reserved for
+        :param list shards: Only tasks in these shards, None for all
+        :return list: The claimed tasks, as they were before claiming
+        """
+
+        collection = self._get_collection()
+
+        now = self._get_now()
+        query = _get_mongo_due_query(now, shards)
+        tasks = []
+
+        while len(tasks) < limit:
+            item = collection.find_one_and_update(
+                query,
+                {
+                    "$set": {
+                        "when": now + lease_seconds,
+                        "status": "leased",
+                        "owner": worker_id,
+                    }
+                },
+                sort=[("when", pymongo.ASCENDING)],
+            )
+
+            if not item:
+                break
+
+            tasks.append(_mongo_item_to_task(item))
+
+        return tasks
+
+    def claim_task(self, task, worker_id, lease_seconds):
+        """
+        Atomically claim a specific task for the given worker, if it has not
+        changed since it was loaded.
+
+        :param pytasched.tasks.Task task:
+        :param str worker_id: Identifier of the worker claiming the task
+        :param float lease_seconds: How long the task is reserved for
+        :return bool: If the task was claimed
+        """
+
+        collection = self._get_collection()
+
+        result = collection.update_one(
+            {"_id": ObjectId(task.id), "when": task.when},
             {
-                "task": task.task,
-                "args": task.args,
-                "kwargs": task.kwargs,
-                "wait": task.wait,
-                "when": task.when,
-                "recurring": task.recurring,
-            }
+                "$set": {
+                    "when": self._get_now() + lease_seconds,
+                    "status": "leased",
+                    "owner": worker_id,
+                }
+            },
         )
 
-        return str(result.inserted_id)
+        return bool(result.modified_count)
+
+    def extend_claims(self, tasks, worker_id, lease_seconds):
+        """
+        Move the leases of tasks the worker has claimed and is still running
+        forward, so they aren't claimed again while they run
+
+        :param list tasks: Tasks claimed by the worker
+        :param str worker_id: Identifier of the worker that claimed the tasks
+        :param float lease_seconds: How long the tasks are reserved for from now
+        :return int: Number of leases extended
+        """
+
+        if not tasks:
+            return 0
+
+        result = self._get_collection().update_many(
+            {
+                "_id": {"$in": [ObjectId(task.id) for task in tasks]},
+                "owner": worker_id,
+                "queued_at": {"$exists": False},
+            },
+            {"$set": {"when": self._get_now() + lease_seconds}},
+        )
+
+        return result.matched_count
+
+    def reschedule(self, task, recur=False, delay=None):
+        """
+        Update task to be rescheduled, with its attempts
+
+        :param pytasched.task.Task task:
+        :param bool recur: If this is for recurring and we should try and keep
+                           the same schedule
+        :param float delay: Seconds from now to run the task in instead of its
+                            wait, e.g. to retry it
+        """
+
+        if delay is not None:
+            task.when = self._get_now() + delay
+        elif recur:
+            task.when = task.when + task.wait
+        else:
+            task.when = self._get_now() + task.wait
+
+        self.log(
+            INFO,
+            "Rescheduling task {} for {}".format(task.id, task.get_readable_when()),
+        )
+
+        collection = self._get_collection()
+        result = collection.update_one(
+            {"_id": ObjectId(task.id)},
+            {
+                "$set": {
+                    "when": task.when,
+                    "attempts": task.attempts,
+                    "status": "pending",
+                },
+                "$unset": _MONGO_UNSET_CLAIM,
+            },
+        )
+        self.notify(task.when)
+
+        return bool(result.modified_count)
+
+    def reschedule_many(self, tasks, recur=False):
+        """
+        Update many tasks to be rescheduled at once
+
+        :param list tasks: List of pytasched.tasks.Task
+        :param bool recur: If this is for recurring and we should try and keep
+                           the same schedule
+        :return int: Number of tasks rescheduled
+        """
+
+        if not tasks:
+            return 0
+
+        now = self._get_now()
+        for task in tasks:
+            if recur:
+                task.when = task.when + task.wait
+            else:
+                task.when = now + task.wait
+
+        self.log(INFO, "Rescheduling {} tasks".format(len(tasks)))
+
+        collection = self._get_collection()
+        result = collection.bulk_write(
+            [
+                pymongo.UpdateOne(
+                    {"_id": ObjectId(task.id)},
+                    {
+                        "$set": {
+                            "when": task.when,
+                            "attempts": task.attempts,
+                            "status": "pending",
+                        },
+                        "$unset": _MONGO_UNSET_CLAIM,
+                    },
+                )
+                for task in tasks
+            ],
+            ordered=False,
+        )
+        self.notify(min(task.when for task in tasks))
+
+        return result.modified_count
+
+    def remove_task(self, id):
+        """
+        Remove a task from the queue
+
+        :param str id: The task ID
+        :return bool:
+        """
+
+        self.log(INFO, "Removing task {}".format(id))
+
+        collection = self._get_collection()
+        result = collection.delete_one({"_id": ObjectId(id)})
+
+        return bool(result.deleted_count)
+
+    def remove_tasks(self, ids):
+        """
+        Remove many tasks from the queue at once
+
+        :param list ids: The task IDs
+        :return int: Number of tasks removed
+        """
+
+        if not ids:
+            return 0
+
+        self.log(INFO, "Removing {} tasks".format(len(ids)))
+
+        collection = self._get_collection()
+        result = collection.delete_many({"_id": {"$in": [ObjectId(id) for id in ids]}})
+
+        return result.deleted_count
+
+    def dead_letter_task(self, task, error):
+        """
+        Move a task that has failed too many times out of the schedule and to
+        the dead letters, for someone to look into
+
+        :param pytasched.tasks.Task task:
+        :param str error: Why the last attempt failed
+        :return bool: If the task was still in the schedule
+        """
+
+        self.log(WARNING, "Moving task {} to the dead letters".format(task.id))
+
+        item = _task_to_mongo_item(task)
+        item.update({"error": error, "failed_at": self._get_now()})
+        del item["status"]
+
+        self._get_dead_letters_collection().replace_one(
+            {"_id": ObjectId(task.id)}, item, upsert=True
+        )
+        result = self._get_collection().delete_one({"_id": ObjectId(task.id)})
+
+        return bool(result.deleted_count)
+
+    def get_dead_letters(self, limit=None):
+        """
+        Get the tasks that were given up on, the latest first
+
+        :param int limit: Maximum number of dead letters to return, None for all
+        :return list: List of DeadLetter
+        """
+
+        cursor = self._get_dead_letters_collection().find(
+            sort=[("failed_at", pymongo.DESCENDING)], limit=limit or 0
+        )
+
+        return [
+            DeadLetter(_mongo_item_to_task(item), item["error"], item["failed_at"])
+            for item in cursor
+        ]
+
+    def remove_dead_letter(self, id):
+        """
+        Forget a task that was given up on, e.g. after adding it again
+
+        :param str id: The task ID
+        :return bool:
+        """
+
+        collection = self._get_dead_letters_collection()
+        result = collection.delete_one({"_id": ObjectId(id)})
+
+        return bool(result.deleted_count)
+
+    def heartbeat(self, worker_id, timeout):
+        """
+        Let others know the worker is sharing the shards, for the next timeout
+        seconds. Also forgets the workers that have stopped sending heartbeats.
+
+        :param str worker_id: Identifier of the worker
+        :param float timeout: Seconds until the worker is considered gone
+        """
+
+        collection = self._get_members_collection()
+
+        now = self._get_now()
+        collection.update_one(
+            {"_id": worker_id}, {"$set": {"expires": now + timeout}}, upsert=True
+        )
+        collection.delete_many({"expires": {"$lt": now}})
+
+    def get_members(self):
+        """
+        Get the workers sharing the shards
+
+        :return list: Identifiers of the workers with a valid heartbeat
+        """
+
+        collection = self._get_members_collection()
+        items = collection.find({"expires": {"$gte": self._get_now()}}, ["_id"])
+
+        return sorted(item["_id"] for item in items)
+
+    def leave(self, worker_id):
+        """
+        Stop sharing the shards with the others
+
+        :param str worker_id: Identifier of the worker
+        """
+        self._get_members_collection().delete_one({"_id": worker_id})
+
+    def acquire_leadership(self, worker_id, lease_seconds):
+        """
+        Become or stay the leader for the next lease_seconds, if nobody else
+        is the leader.
+
+        :param str worker_id: Identifier of the worker
+        :param float lease_seconds: How long the leadership lasts if not renewed
+        :return bool: If the worker is the leader
+        """
+
+        collection = self._get_leader_collection()
+        now = self._get_now()
+
+        try:
+            # Fails to insert a new document if someone else is the leader
+            collection.update_one(
+                {
+                    "_id": "leader",
+                    "$or": [{"owner": worker_id}, {"expires": {"$lt": now}}],
+                },
+                {"$set": {"owner": worker_id, "expires": now + lease_seconds}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            return False
+
+        return True
+
+    def release_leadership(self, worker_id):
+        """
+        Stop being the leader, if the worker is the leader
+
+        :param str worker_id: Identifier of the worker
+        """
+        self._get_leader_collection().delete_one({"_id": "leader", "owner": worker_id})
+
+    def setup_work_queue(self):
+        """
+        Set up the storage engine for handing claimed tasks to other workers.
+        Only queued tasks have "queued_at", so the sparse index on it stays
+        small.
+        """
+
+        self.log(DEBUG, "Ensuring we have index for the work queue")
+        self._get_collection().create_index([("queued_at", 1)], sparse=True)
+
+    def queue_tasks(self, tasks):
+        """
+        Put claimed tasks in the work queue for any worker to take. Tasks
+        that were queued before, and whose lease ran out before they were
+        run, keep the time they were originally scheduled for instead of the
+        end of the lease, so recurring tasks don't drift.
+
+        :param list tasks: Tasks returned by claim_due_tasks()
+        :return int: Number of tasks queued
+        """
+
+        if not tasks:
+            return 0
+
+        collection = self._get_collection()
+
+        collection.bulk_write(
+            [
+                pymongo.UpdateOne(
+                    {"_id": ObjectId(task.id), "scheduled": {"$exists": False}},
+                    {"$set": {"scheduled": task.when}},
+                )
+                for task in tasks
+            ],
+            ordered=False,
+        )
+
+        now = self._get_now()
+        result = collection.bulk_write(
+            [
+                pymongo.UpdateOne(
+                    {"_id": ObjectId(task.id)},
+                    {"$set": {"status": "queued", "queued_at": now}},
+                )
+                for task in tasks
+            ],
+            ordered=False,
+        )
+
+        return result.modified_count
+
+    def take_queued_tasks(self, worker_id, limit, lease_seconds):
+        """
+        Atomically take tasks from the work queue for the given worker, in
+        the order they were queued.
+
+        :param str worker_id: Identifier of the worker taking the tasks
+        :param int limit: Maximum number of tasks to take
+        :param float lease_seconds: How long the tasks are reserved for
+        :return list: The tasks, with the time they were scheduled for
+        """
+
+        collection = self._get_collection()
+
+        now = self._get_now()
+        tasks = []
+
+        while len(tasks) < limit:
+            item = collection.find_one_and_update(
+                {"queued_at": {"$exists": True}},
+                {
+                    "$set": {
+                        "when": now + lease_seconds,
+                        "status": "leased",
+                        "owner": worker_id,
+                    },
+                    "$unset": {"queued_at": ""},
+                },
+                sort=[("queued_at", pymongo.ASCENDING)],
+            )
+
+            if not item:
+                break
+
+            item["when"] = item["scheduled"]
+            tasks.append(_mongo_item_to_task(item))
+
+        return tasks
+
+
+class SQLiteStorageEngine(StorageEngine):
+    """
+    Storage engine that uses SQLite to store tasks, for when running MongoDB
+    just for the scheduler is too much. The database is in WAL mode, so
+    multiple server processes on the same host can share it, with readers not
+    blocking the writer. Each thread gets its own connection.
+    """
+
+    def __init__(self, params):
+        """
+        :param dict params: "path" to the database file, "timeout" in seconds
+                            to wait for other processes' write locks, and
+                            "synchronous" for PRAGMA synchronous
+        """
+        super(SQLiteStorageEngine, self).__init__(params)
+        self._local = local()
+        self._setup_done = False
+        self._setup_lock = Lock()
+
+    def _get_connection(self):
+        """
+        Get the connection for the current thread and process
+
+        :return sqlite3.Connection:
+        """
+
+        pid = os.getpid()
+        if getattr(self._local, "pid", None) != pid:
+            path = self.params.get("path", "pytasched.sqlite3")
+            self.log(DEBUG, "Connecting to SQLite database {}".format(path))
+
+            # Autocommit mode, statements are atomic and we start the
+            # transactions we need ourselves
+            connection = sqlite3.connect(
+                path, timeout=self.params.get("timeout", 30.0), isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "PRAGMA synchronous={}".format(self.params.get("synchronous", "NORMAL"))
+            )
+
+            self._local.connection = connection
+            self._local.pid = pid
+
+            with self._setup_lock:
+                if not self._setup_done:
+                    self.setup()
+                    self._setup_done = True
+
+        return self._local.connection
+
+    def _get_now(self):
+        """
+        Get current time
+        """
+        return time()
+
+    def setup(self):
+        """
+        Set up the storage engine, e.g. tables, indexes, etc.
+        """
+
+        self.log(DEBUG, "Ensuring we have the tasks table")
+
+        connection = self._get_connection()
+        for statement in _SQLITE_SCHEMA:
+            connection.execute(statement)
+
+        columns = {row[1] for row in connection.execute("PRAGMA table_info(tasks)")}
+        for name, type in _SQLITE_ADDED_COLUMNS:
+            if name not in columns:
+                connection.execute(
+                    "ALTER TABLE tasks ADD COLUMN {} {}".format(name, type)
+                )
+
+    def add_task(self, task):
+        """
+        Add a new task to be processed
+
+        :param pytasched.tasks.Task task:
+        :returns str: The ID of the task
+        """
+
+        self.log(INFO, "Adding task {} in {}s".format(task.task, task.wait))
+
+        if not task.when:
+            task.when = self._get_now() + task.wait
+
+        cursor = self._get_connection().execute(
+            _SQLITE_INSERT,
+            _task_to_sqlite_row(task),
+        )
+        self.notify(task.when)
+
+        return str(cursor.lastrowid)
+
+    def add_tasks(self, tasks):
+        """
+        Add many new tasks to be processed at once, in a single transaction
+
+        :param list tasks: List of pytasched.tasks.Task
+        :return list: The IDs of the tasks, in the same order
+        """
+
+        if not tasks:
+            return []
+
+        self.log(INFO, "Adding {} tasks".format(len(tasks)))
+
+        now = self._get_now()
+        for task in tasks:
+            if not task.when:
+                task.when = now + task.wait
+
+        connection = self._get_connection()
+        ids = []
+
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            for task in tasks:
+                cursor = connection.execute(
+                    _SQLITE_INSERT,
+                    _task_to_sqlite_row(task),
+                )
+                ids.append(str(cursor.lastrowid))
+
+        self.notify(min(task.when for task in tasks))
+
+        return ids
+
+    def get_task(self, id):
+        """
+        Get the specific task
+
+        :param str id:
+        :return pytasched.tasks.Task:
+        """
+
+        row = (
+            self._get_connection()
+            .execute(
+                "SELECT {} FROM tasks WHERE id = ?".format(_SQLITE_TASK_COLUMNS),
+                (int(id),),
+            )
+            .fetchone()
+        )
+
+        return _sqlite_row_to_task(row) if row else None
+
+    def get_task_names(self):
+        """
+        Get the distinct names of all the scheduled tasks, i.e. their task
+        field, e.g. to prepare the task engine for them
+
+        :return set:
+        """
+        rows = self._get_connection().execute("SELECT DISTINCT task FROM tasks")
+
+        return {row[0] for row in rows}
+
+    def get_task_list(self, limit=None, until=None):
+        """
+        Get the tasks that should be run, the ones that should have been run
+        first are first in the list.
+
+        :param int limit: Maximum number of tasks to return, None for all
+        :param float until: Get tasks scheduled before this instead of now
+        :return list:
+        """
+
+        if until is None:
+            until = self._get_now()
+
+        rows = self._get_connection().execute(
+            'SELECT {} FROM tasks WHERE "when" < ? ORDER BY "when" LIMIT ?'.format(
+                _SQLITE_TASK_COLUMNS
+            ),
+            (until, limit or -1),
+        )
+
+        return [_sqlite_row_to_task(row) for row in rows]
+
+    def get_next_when(self):
+        """
+        Get the time the next task is scheduled for
+
+        :return float|None: None if there are no tasks
+        """
+
+        row = self._get_connection().execute('SELECT MIN("when") FROM tasks').fetchone()
+
+        return row[0]
+
+    def has_task_changed(self, task):
+        """
+        Check if the task has changed / been deleted since it was loaded.
+
+        :param pytasched.tasks.Task task:
+        :return bool:
+        """
+
+        row = (
+            self._get_connection()
+            .execute('SELECT "when" FROM tasks WHERE id = ?', (int(task.id),))
+            .fetchone()
+        )
+
+        return row is None or row[0] != task.when
+
+    def claim_due_tasks(self, worker_id, limit, lease_seconds):
+        """
+        Atomically claim tasks that need to be run for the given worker, by
+        moving them forward by lease_seconds in a single UPDATE statement.
+
+        :param str worker_id: Identifier of the worker claiming the tasks
+        :param int limit: Maximum number of tasks to claim
+        :param float lease_seconds: How long the tasks are reserved for
+        :return list: The claimed tasks, as they were before claiming
+        """
+
+        now = self._get_now()
+        connection = self._get_connection()
+        params = (now + lease_seconds, worker_id, now, limit)
+
+        if _SQLITE_RETURNING:
+            rows = connection.execute(
+                'UPDATE tasks SET claimed_when = "when", "when" = ?, '
+                "status = 'leased', owner = ? WHERE id IN (SELECT id FROM tasks "
+                'WHERE "when" < ? ORDER BY "when" LIMIT ?) RETURNING '
+                + _SQLITE_TASK_COLUMNS.replace('"when"', "claimed_when"),
+                params,
+            ).fetchall()
+        else:
+            with connection:
+                connection.execute("BEGIN IMMEDIATE")
+                rows = connection.execute(
+                    'SELECT {} FROM tasks WHERE "when" < ? ORDER BY "when" '
+                    "LIMIT ?".format(_SQLITE_TASK_COLUMNS),
+                    (now, limit),
+                ).fetchall()
+                connection.executemany(
+                    'UPDATE tasks SET claimed_when = "when", "when" = ?, '
+                    "status = 'leased', owner = ? WHERE id = ?",
+                    [(now + lease_seconds, worker_id, row[0]) for row in rows],
+                )
+
+        # RETURNING does not keep the order of the subquery
+        tasks = [_sqlite_row_to_task(row) for row in rows]
+        tasks.sort(key=lambda task: task.when)
+
+        return tasks
+
+    def claim_task(self, task, worker_id, lease_seconds):
+        """
+        Atomically claim a specific task for the given worker, if it has not
+        changed since it was loaded.
+
+        :param pytasched.tasks.Task task:
+        :param str worker_id: Identifier of the worker claiming the task
+        :param float lease_seconds: How long the task is reserved for
+        :return bool: If the task was claimed
+        """
+
+        cursor = self._get_connection().execute(
+            'UPDATE tasks SET claimed_when = "when", "when" = ?, '
+            "status = 'leased', owner = ? WHERE id = ? AND \"when\" = ?",
+            (
+                self._get_now() + lease_seconds,
+                worker_id,
+                int(task.id),
+                task.when,
+            ),
+        )
+
+        return cursor.rowcount == 1
+
+    def extend_claims(self, tasks, worker_id, lease_seconds):
+        """
+        Move the leases of tasks the worker has claimed and is still running
+        forward, so they aren't claimed again while they run
+
+        :param list tasks: Tasks claimed by the worker
+        :param str worker_id: Identifier of the worker that claimed the tasks
+        :param float lease_seconds: How long the tasks are reserved for from now
+        :return int: Number of leases extended
+        """
+
+        if not tasks:
+            return 0
+
+        when = self._get_now() + lease_seconds
+        connection = self._get_connection()
+
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            cursor = connection.executemany(
+                'UPDATE tasks SET "when" = ? WHERE id = ? AND owner = ?',
+                [(when, int(task.id), worker_id) for task in tasks],
+            )
+
+        return cursor.rowcount
+
+    def reschedule(self, task, recur=False, delay=None):
+        """
+        Update task to be rescheduled, with its attempts
+
+        :param pytasched.task.Task task:
+        :param bool recur: If this is for recurring and we should try and keep
+                           the same schedule
+        :param float delay: Seconds from now to run the task in instead of its
+                            wait, e.g. to retry it
+        """
+
+        if delay is not None:
+            task.when = self._get_now() + delay
+        elif recur:
+            task.when = task.when + task.wait
+        else:
+            task.when = self._get_now() + task.wait
+
+        self.log(
+            INFO,
+            "Rescheduling task {} for {}".format(task.id, task.get_readable_when()),
+        )
+
+        cursor = self._get_connection().execute(
+            _SQLITE_RESCHEDULE, (task.when, task.attempts, int(task.id))
+        )
+        self.notify(task.when)
+
+        return cursor.rowcount == 1
+
+    def reschedule_many(self, tasks, recur=False):
+        """
+        Update many tasks to be rescheduled at once, in a single transaction
+
+        :param list tasks: List of pytasched.tasks.Task
+        :param bool recur: If this is for recurring and we should try and keep
+                           the same schedule
+        :return int: Number of tasks rescheduled
+        """
+
+        if not tasks:
+            return 0
+
+        now = self._get_now()
+        for task in tasks:
+            if recur:
+                task.when = task.when + task.wait
+            else:
+                task.when = now + task.wait
+
+        self.log(INFO, "Rescheduling {} tasks".format(len(tasks)))
+
+        connection = self._get_connection()
+
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            cursor = connection.executemany(
+                _SQLITE_RESCHEDULE,
+                [(task.when, task.attempts, int(task.id)) for task in tasks],
+            )
+
+        self.notify(min(task.when for task in tasks))
+
+        return cursor.rowcount
+
+    def remove_task(self, id):
+        """
+        Remove a task from the queue
+
+        :param str id: The task ID
+        :return bool:
+        """
+
+        self.log(INFO, "Removing task {}".format(id))
+
+        cursor = self._get_connection().execute(
+            "DELETE FROM tasks WHERE id = ?", (int(id),)
+        )
+
+        return cursor.rowcount == 1
+
+    def remove_tasks(self, ids):
+        """
+        Remove many tasks from the queue at once, in a single transaction
+
+        :param list ids: The task IDs
+        :return int: Number of tasks removed
+        """
+
+        if not ids:
+            return 0
+
+        self.log(INFO, "Removing {} tasks".format(len(ids)))
+
+        connection = self._get_connection()
+
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            cursor = connection.executemany(
+                "DELETE FROM tasks WHERE id = ?", [(int(id),) for id in ids]
+            )
+
+        return cursor.rowcount
+
+    def dead_letter_task(self, task, error):
+        """
+        Move a task that has failed too many times out of the schedule and to
+        the dead letters, in a single transaction
+
+        :param pytasched.tasks.Task task:
+        :param str error: Why the last attempt failed
+        :return bool: If the task was still in the schedule
+        """
+
+        self.log(WARNING, "Moving task {} to the dead letters".format(task.id))
+
+        connection = self._get_connection()
+
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "INSERT OR REPLACE INTO dead_letters ({}, error, failed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)".format(
+                    _SQLITE_TASK_COLUMNS
+                ),
+                (int(task.id),) + _task_to_sqlite_row(task) + (error, self._get_now()),
+            )
+            cursor = connection.execute(
+                "DELETE FROM tasks WHERE id = ?", (int(task.id),)
+            )
+
+        return cursor.rowcount == 1
+
+    def get_dead_letters(self, limit=None):
+        """
+        Get the tasks that were given up on, the latest first
+
+        :param int limit: Maximum number of dead letters to return, None for all
+        :return list: List of DeadLetter
+        """
+
+        rows = self._get_connection().execute(
+            "SELECT {}, error, failed_at FROM dead_letters ORDER BY failed_at "
+            "DESC LIMIT ?".format(_SQLITE_TASK_COLUMNS),
+            (limit or -1,),
+        )
+
+        return [
+            DeadLetter(_sqlite_row_to_task(row[:-2]), row[-2], row[-1]) for row in rows
+        ]
+
+    def remove_dead_letter(self, id):
+        """
+        Forget a task that was given up on, e.g. after adding it again
+
+        :param str id: The task ID
+        :return bool:
+        """
+
+        cursor = self._get_connection().execute(
+            "DELETE FROM dead_letters WHERE id = ?", (int(id),)
+        )
+
+        return cursor.rowcount == 1
+
+
+class PostgresStorageEngine(StorageEngine):
+    """
+    Storage engine that uses PostgreSQL to store tasks. Due tasks are claimed
+    with SELECT ... FOR UPDATE SKIP LOCKED, so many servers can claim tasks
+    at the same time without waiting for each other or needing LOCKS.
+    """
+
+    def __init__(self, params):
+        """
+        :param dict params: "dsn" to connect to, defaults to POSTGRES_DSN,
+                            "table" to store the tasks in, and "watch" to
+                            wake up via LISTEN/NOTIFY
+        """
+        if not psycopg2:
+            raise StorageEngineNotAvailableError("Could not find psycopg2")
+
+        self._pool = None
+        self._listener = None
+        super(PostgresStorageEngine, self).__init__(params)
+
+        self._table = self.params.get("table", "pytasched_tasks")
+        self._channel = self._table
+
+    @contextmanager
+    def _cursor(self):
+        """
+        Get a cursor from a pooled connection, committing the transaction
+        when done or rolling it back on errors.
+        """
+
+        if not self._pool:
+            self.log(DEBUG, "Connecting to PostgreSQL")
+            self._pool = get_postgres_pool(self.params.get("dsn"))
+            self.setup()
+
+        connection = self._pool.getconn()
+
+        try:
+            with connection:
+                with connection.cursor() as cursor:
+                    yield cursor
+        finally:
+            self._pool.putconn(connection)
+
+    def _get_now(self):
+        """
+        Get current time
+        """
+        return time()
+
+    def setup(self):
+        """
+        Set up the storage engine, e.g. tables, indexes, etc.
+        """
+
+        self.log(DEBUG, "Ensuring we have the {} table".format(self._table))
+
+        with self._cursor() as cursor:
+            for statement in _POSTGRES_SCHEMA:
+                cursor.execute(statement.format(table=self._table))
+
+    def watch(self):
+        """
+        Start listening for notifications about new and rescheduled tasks, if
+        enabled with the "watch" param.
+
+        :return bool: If watching was started
+        """
+
+        if not self.params.get("watch"):
+            return False
+
+        try:
+            connection = psycopg2.connect(
+                self.params.get("dsn", global_settings.POSTGRES_DSN)
+            )
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute("LISTEN {}".format(self._channel))
+        except psycopg2.Error as e:
+            self.log(
+                WARNING,
+                "Could not listen for changes, falling back to polling: {}".format(e),
+            )
+            return False
+
+        self.log(INFO, "Listening for changes to tasks")
+        self._listener = connection
+
+        thread = Thread(target=self._listen, name="pytasched-listen")
+        thread.daemon = True
+        thread.start()
+
+        return True
+
+    def unwatch(self):
+        """
+        Stop listening for changes
+        """
+
+        connection = self._listener
+        self._listener = None
+
+        if connection:
+            connection.close()
+
+    def _listen(self):
+        """
+        Notify listeners about the notifications on the channel until we stop
+        listening. If the connection breaks we leave it to polling.
+        """
+
+        while self._listener:
+            connection = self._listener
+
+            try:
+                if select.select([connection], [], [], 5) == ([], [], []):
+                    continue
+
+                connection.poll()
+            except (psycopg2.Error, ValueError) as e:
+                if self._listener:
+                    self.log(
+                        WARNING,
+                        "Stopped listening for changes, falling back to "
+                        "polling: {}".format(e),
+                    )
+                    self._listener = None
+                return
+
+            while connection.notifies:
+                self.notify(float(connection.notifies.pop(0).payload))
+
+    def _send_notify(self, cursor, when):
+        """
+        Let servers listening for changes know about a task due at when, sent
+        when the transaction is committed.
+
+        :param psycopg2.extensions.cursor cursor:
+        :param float when:
+        """
+        cursor.execute("SELECT pg_notify(%s, %s)", (self._channel, repr(when)))
+
+    def add_task(self, task):
+        """
+        Add a new task to be processed
+
+        :param pytasched.tasks.Task task:
+        :returns str: The ID of the task
+        """
+
+        self.log(INFO, "Adding task {} in {}s".format(task.task, task.wait))
+
+        return self._add([task])[0]
+
+    def add_tasks(self, tasks):
+        """
+        Add many new tasks to be processed at once, in a single statement
+
+        :param list tasks: List of pytasched.tasks.Task
+        :return list: The IDs of the tasks, in the same order
+        """
+
+        if not tasks:
+            return []
+
+        self.log(INFO, "Adding {} tasks".format(len(tasks)))
+
+        return self._add(tasks)
+
+    def _add(self, tasks):
+        """
+        Insert the tasks
+
+        :param list tasks: List of pytasched.tasks.Task
+        :return list: The IDs of the tasks, in the same order
+        """
+
+        now = self._get_now()
+        for task in tasks:
+            if not task.when:
+                task.when = now + task.wait
+
+        when = min(task.when for task in tasks)
+
+        with self._cursor() as cursor:
+            rows = execute_values(
+                cursor,
+                "INSERT INTO {} (task, args, kwargs, wait, recurring, "
+                '"when", options, retry, attempts) VALUES %s '
+                "RETURNING id".format(self._table),
+                [_task_to_postgres_row(task) for task in tasks],
+                page_size=len(tasks),
+                fetch=True,
+            )
+            self._send_notify(cursor, when)
+
+        self.notify(when)
+
+        return [str(row[0]) for row in rows]
+
+    def get_task(self, id):
+        """
+        Get the specific task
+
+        :param str id:
+        :return pytasched.tasks.Task:
+        """
+
+        with self._cursor() as cursor:
+            cursor.execute(
+                "SELECT {} FROM {} WHERE id = %s".format(
+                    _POSTGRES_TASK_COLUMNS, self._table
+                ),
+                (int(id),),
+            )
+            row = cursor.fetchone()
+
+        return _postgres_row_to_task(row) if row else None
+
+    def get_task_names(self):
+        """
+        Get the distinct names of all the scheduled tasks, i.e. their task
+        field, e.g. to prepare the task engine for them
+
+        :return set:
+        """
+
+        with self._cursor() as cursor:
+            cursor.execute("SELECT DISTINCT task FROM {}".format(self._table))
+            rows = cursor.fetchall()
+
+        return {row[0] for row in rows}
+
+    def get_task_list(self, limit=None, until=None):
+        """
+        Get the tasks that should be run, the ones that should have been run
+        first are first in the list.
+
+        :param int limit: Maximum number of tasks to return, None for all
+        :param float until: Get tasks scheduled before this instead of now
+        :return list:
+        """
+
+        if until is None:
+            until = self._get_now()
+
+        with self._cursor() as cursor:
+            cursor.execute(
+                'SELECT {} FROM {} WHERE "when" < %s ORDER BY "when" '
+                "LIMIT %s".format(_POSTGRES_TASK_COLUMNS, self._table),
+                (until, limit),
+            )
+            rows = cursor.fetchall()
+
+        return [_postgres_row_to_task(row) for row in rows]
+
+    def get_next_when(self):
+        """
+        Get the time the next task is scheduled for
+
+        :return float|None: None if there are no tasks
+        """
+
+        with self._cursor() as cursor:
+            cursor.execute('SELECT MIN("when") FROM {}'.format(self._table))
+            return cursor.fetchone()[0]
+
+    def has_task_changed(self, task):
+        """
+        Check if the task has changed / been deleted since it was loaded.
+
+        :param pytasched.tasks.Task task:
+        :return bool:
+        """
+
+        with self._cursor() as cursor:
+            cursor.execute(
+                'SELECT "when" FROM {} WHERE id = %s'.format(self._table),
+                (int(task.id),),
+            )
+            row = cursor.fetchone()
+
+        return row is None or row[0] != task.when
+
+    def claim_due_tasks(self, worker_id, limit, lease_seconds):
+        """
+        Atomically claim tasks that need to be run for the given worker, by
+        moving them forward by lease_seconds. Rows being claimed by other
+        servers are skipped instead of waited for.
+
+        :param str worker_id: Identifier of the worker claiming the tasks
+        :param int limit: Maximum number of tasks to claim
+        :param float lease_seconds: How long the tasks are reserved for
+        :return list: The claimed tasks, as they were before claiming
+        """
+
+        now = self._get_now()
+
+        with self._cursor() as cursor:
+            cursor.execute(
+                'WITH due AS (SELECT id, "when" FROM {table} WHERE "when" < %s '
+                'ORDER BY "when" LIMIT %s FOR UPDATE SKIP LOCKED) '
+                "UPDATE {table} AS t SET \"when\" = %s, status = 'leased', "
+                "owner = %s FROM due WHERE t.id = due.id RETURNING t.id, t.task, "
+                't.args, t.kwargs, t.wait, t.recurring, due."when", '
+                "t.options, t.retry, t.attempts".format(table=self._table),
+                (now, limit, now + lease_seconds, worker_id),
+            )
+            rows = cursor.fetchall()
+
+        # RETURNING does not keep the order of the subquery
+        tasks = [_postgres_row_to_task(row) for row in rows]
+        tasks.sort(key=lambda task: task.when)
+
+        return tasks
+
+    def claim_task(self, task, worker_id, lease_seconds):
+        """
+        Atomically claim a specific task for the given worker, if it has not
+        changed since it was loaded.
+
+        :param pytasched.tasks.Task task:
+        :param str worker_id: Identifier of the worker claiming the task
+        :param float lease_seconds: How long the task is reserved for
+        :return bool: If the task was claimed
+        """
+
+        with self._cursor() as cursor:
+            cursor.execute(
+                "UPDATE {} SET \"when\" = %s, status = 'leased', owner = %s "
+                'WHERE id = %s AND "when" = %s'.format(self._table),
+                (
+                    self._get_now() + lease_seconds,
+                    worker_id,
+                    int(task.id),
+                    task.when,
+                ),
+            )
+            return cursor.rowcount == 1
+
+    def extend_claims(self, tasks, worker_id, lease_seconds):
+        """
+        Move the leases of tasks the worker has claimed and is still running
+        forward, so they aren't claimed again while they run
+
+        :param list tasks: Tasks claimed by the worker
+        :param str worker_id: Identifier of the worker that claimed the tasks
+        :param float lease_seconds: How long the tasks are reserved for from now
+        :return int: Number of leases extended
+        """
+
+        if not tasks:
+            return 0
+
+        with self._cursor() as cursor:
+            cursor.execute(
+                'UPDATE {} SET "when" = %s WHERE id = ANY(%s) AND '
+                "owner = %s".format(self._table),
+                (
+                    self._get_now() + lease_seconds,
+                    [int(task.id) for task in tasks],
+                    worker_id,
+                ),
+            )
+            return cursor.rowcount
+
+    def reschedule(self, task, recur=False, delay=None):
+        """
+        Update task to be rescheduled, with its attempts
+
+        :param pytasched.task.Task task:
+        :param bool recur: If this is for recurring and we should try and keep
+                           the same schedule
+        :param float delay: Seconds from now to run the task in instead of its
+                            wait, e.g. to retry it
+        """
+
+        if delay is not None:
+            task.when = self._get_now() + delay
+        elif recur:
+            task.when = task.when + task.wait
+        else:
+            task.when = self._get_now() + task.wait
+
+        self.log(
+            INFO,
+            "Rescheduling task {} for {}".format(task.id, task.get_readable_when()),
+        )
+
+        return bool(self._reschedule([task]))
+
+    def reschedule_many(self, tasks, recur=False):
+        """
+        Update many tasks to be rescheduled at once, in a single statement
+
+        :param list tasks: List of pytasched.tasks.Task
+        :param bool recur: If this is for recurring and we should try and keep
+                           the same schedule
+        :return int: Number of tasks rescheduled
+        """
+
+        if not tasks:
+            return 0
+
+        now = self._get_now()
+        for task in tasks:
+            if recur:
+                task.when = task.when + task.wait
+            else:
+                task.when = now + task.wait
+
+        self.log(INFO, "Rescheduling {} tasks".format(len(tasks)))
+
+        return self._reschedule(tasks)
+
+    def _reschedule(self, tasks):
+        """
+        Move the tasks to their new times, releasing any claims on them
+
+        :param list tasks: List of pytasched.tasks.Task
+        :return int: Number of tasks rescheduled
+        """
+
+        when = min(task.when for task in tasks)
+
+        with self._cursor() as cursor:
+            execute_values(
+                cursor,
+                'UPDATE {} AS t SET "when" = v."when", attempts = v.attempts, '
+                "status = 'pending', owner = NULL FROM (VALUES %s) AS "
+                'v (id, "when", attempts) WHERE t.id = v.id'.format(self._table),
+                [(int(task.id), task.when, task.attempts) for task in tasks],
+                template="(%s::bigint, %s::double precision, %s::integer)",
+                page_size=len(tasks),
+            )
+            rescheduled = cursor.rowcount
+            self._send_notify(cursor, when)
+
+        self.notify(when)
+
+        return rescheduled
+
+    def remove_task(self, id):
+        """
+        Remove a task from the queue
+
+        :param str id: The task ID
+        :return bool:
+        """
+
+        self.log(INFO, "Removing task {}".format(id))
+
+        return bool(self._remove([id]))
+
+    def remove_tasks(self, ids):
+        """
+        Remove many tasks from the queue at once, in a single statement
+
+        :param list ids: The task IDs
+        :return int: Number of tasks removed
+        """
+
+        if not ids:
+            return 0
+
+        self.log(INFO, "Removing {} tasks".format(len(ids)))
+
+        return self._remove(ids)
+
+    def _remove(self, ids):
+        """
+        Delete the tasks
+
+        :param list ids: The task IDs
+        :return int: Number of tasks removed
+        """
+
+        with self._cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM {} WHERE id = ANY(%s)".format(self._table),
+                ([int(id) for id in ids],),
+            )
+            return cursor.rowcount
+
+    def dead_letter_task(self, task, error):
+        """
+        Move a task that has failed too many times out of the schedule and to
+        the dead letters, in a single transaction
+
+        :param pytasched.tasks.Task task:
+        :param str error: Why the last attempt failed
+        :return bool: If the task was still in the schedule
+        """
+
+        self.log(WARNING, "Moving task {} to the dead letters".format(task.id))
+
+        with self._cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM {}_dead_letters WHERE id = %s".format(self._table),
+                (int(task.id),),
+            )
+            cursor.execute(
+                "INSERT INTO {}_dead_letters ({}, error, failed_at) VALUES "
+                "(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)".format(
+                    self._table, _POSTGRES_TASK_COLUMNS
+                ),
+                (int(task.id),)
+                + _task_to_postgres_row(task)
+                + (error, self._get_now()),
+            )
+            cursor.execute(
+                "DELETE FROM {} WHERE id = %s".format(self._table), (int(task.id),)
+            )
+            return cursor.rowcount == 1
+
+    def get_dead_letters(self, limit=None):
+        """
+        Get the tasks that were given up on, the latest first
+
+        :param int limit: Maximum number of dead letters to return, None for all
+        :return list: List of DeadLetter
+        """
+
+        with self._cursor() as cursor:
+            cursor.execute(
+                "SELECT {}, error, failed_at FROM {}_dead_letters ORDER BY "
+                "failed_at DESC LIMIT %s".format(_POSTGRES_TASK_COLUMNS, self._table),
+                (limit,),
+            )
+            rows = cursor.fetchall()
+
+        return [
+            DeadLetter(_postgres_row_to_task(row[:-2]), row[-2], row[-1])
+            for row in rows
+        ]
+
+    def remove_dead_letter(self, id):
+        """
+        Forget a task that was given up on, e.g. after adding it again
+
+        :param str id: The task ID
+        :return bool:
+        """
+
+        with self._cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM {}_dead_letters WHERE id = %s".format(self._table),
+                (int(id),),
+            )
+            return cursor.rowcount == 1
+
+
+class RedisStorageEngine(StorageEngine):
+    """
+    Storage engine that uses Redis to store tasks, for high dispatch rates.
+    The schedule is a sorted set of task IDs scored by when, and each task is
+    stored in a hash. Claiming is done with a Lua script, so it's atomic and
+    takes a single round trip.
+
+    All keys start with the "prefix" param, with Redis Cluster the prefix
+    should be a hash tag, e.g. "{pytasched}", so they end up on the same node.
+    """
+
+    def __init__(self, params, client=None):
+        """
+        :param dict params: "url" of the Redis server, defaults to REDIS_URL,
+                            and "prefix" for the keys
+        :param redis.Redis client: Use this client instead of connecting to
+                                   "url", it should decode responses
+        """
+        if not redis and not client:
+            raise StorageEngineNotAvailableError("Could not find redis")
+
+        self._client = client
+        self._scripts = None
+        super(RedisStorageEngine, self).__init__(params)
+
+        prefix = self.params.get("prefix", "pytasched")
+        self._schedule_key = prefix + ":schedule"
+        self._ids_key = prefix + ":ids"
+        self._task_prefix = prefix + ":task:"
+        self._dead_letters_key = prefix + ":dead_letters"
+        self._dead_letter_prefix = prefix + ":dead_letter:"
+
+    def _get_client(self):
+        if not self._client:
+            self.log(DEBUG, "Connecting to Redis")
+            self._client = get_redis_client(self.params.get("url"))
+
+        return self._client
+
+    def _get_scripts(self):
+        """
+        Get the Lua scripts, they are loaded to Redis on first use
+
+        :return dict: redis.client.Script by name
+        """
+
+        if not self._scripts:
+            client = self._get_client()
+            self._scripts = {
+                "claim": client.register_script(_REDIS_CLAIM_SCRIPT),
+                "claim_task": client.register_script(_REDIS_CLAIM_TASK_SCRIPT),
+                "extend": client.register_script(_REDIS_EXTEND_SCRIPT),
+                "reschedule": client.register_script(_REDIS_RESCHEDULE_SCRIPT),
+            }
+
+        return self._scripts
+
+    def _get_now(self):
+        """
+        Get current time
+        """
+        return time()
+
+    def add_task(self, task):
+        """
+        Add a new task to be processed
+
+        :param pytasched.tasks.Task task:
+        :returns str: The ID of the task
+        """
+
+        self.log(INFO, "Adding task {} in {}s".format(task.task, task.wait))
+
+        return self._add([task])[0]
+
+    def add_tasks(self, tasks):
+        """
+        Add many new tasks to be processed at once, in a single pipeline
+
+        :param list tasks: List of pytasched.tasks.Task
+        :return list: The IDs of the tasks, in the same order
+        """
+
+        if not tasks:
+            return []
+
+        self.log(INFO, "Adding {} tasks".format(len(tasks)))
+
+        return self._add(tasks)
+
+    def _add(self, tasks):
+        """
+        Store the tasks and add them to the schedule
+
+        :param list tasks: List of pytasched.tasks.Task
+        :return list: The IDs of the tasks, in the same order
+        """
+
+        now = self._get_now()
+        for task in tasks:
+            if not task.when:
+                task.when = now + task.wait
+
+        client = self._get_client()
+        last_id = client.incrby(self._ids_key, len(tasks))
+        ids = [str(id) for id in range(last_id - len(tasks) + 1, last_id + 1)]
+
+        pipeline = client.pipeline()
+        for id, task in zip(ids, tasks):
+            pipeline.hset(self._task_prefix + id, mapping=_task_to_redis_item(task))
+        pipeline.zadd(
+            self._schedule_key, {id: task.when for id, task in zip(ids, tasks)}
+        )
+        pipeline.execute()
+
+        self.notify(min(task.when for task in tasks))
+
+        return ids
+
+    def get_task(self, id):
+        """
+        Get the specific task
+
+        :param str id:
+        :return pytasched.tasks.Task:
+        """
+
+        item = self._get_client().hmget(self._task_prefix + id, _REDIS_TASK_FIELDS)
+
+        return _redis_item_to_task(id, item) if item[0] is not None else None
+
+    def get_task_list(self, limit=None, until=None):
+        """
+        Get the tasks that should be run, the ones that should have been run
+        first are first in the list.
+
+        :param int limit: Maximum number of tasks to return, None for all
+        :param float until: Get tasks scheduled before this instead of now
+        :return list:
+        """
+
+        if until is None:
+            until = self._get_now()
+
+        client = self._get_client()
+        ids = client.zrangebyscore(
+            self._schedule_key,
+            "-inf",
+            "(" + _redis_when(until),
+            start=0 if limit else None,
+            num=limit or None,
+        )
+
+        pipeline = client.pipeline(transaction=False)
+        for id in ids:
+            pipeline.hmget(self._task_prefix + id, _REDIS_TASK_FIELDS)
+
+        return [
+            _redis_item_to_task(id, item)
+            for id, item in zip(ids, pipeline.execute())
+            if item[0] is not None
+        ]
+
+    def get_next_when(self):
+        """
+        Get the time the next task is scheduled for
+
+        :return float|None: None if there are no tasks
+        """
+
+        first = self._get_client().zrange(self._schedule_key, 0, 0, withscores=True)
+
+        return first[0][1] if first else None
+
+    def has_task_changed(self, task):
+        """
+        Check if the task has changed / been deleted since it was loaded.
+
+        :param pytasched.tasks.Task task:
+        :return bool:
+        """
+
+        when = self._get_client().hget(self._task_prefix + task.id, "when")
+
+        return when is None or float(when) != task.when
+
+    def claim_due_tasks(self, worker_id, limit, lease_seconds):
+        """
+        Atomically claim tasks that need to be run for the given worker, by
+        moving them forward by lease_seconds in a Lua script.
+
+        :param str worker_id: Identifier of the worker claiming the tasks
+        :param int limit: Maximum number of tasks to claim
+        :param float lease_seconds: How long the tasks are reserved for
+        :return list: The claimed tasks, as they were before claiming
+        """
+
+        now = self._get_now()
+        claimed = self._get_scripts()["claim"](
+            keys=[self._schedule_key],
+            args=[
+                _redis_when(now),
+                limit,
+                _redis_when(now + lease_seconds),
+                worker_id,
+                self._task_prefix,
+            ],
+        )
+
+        return [_redis_item_to_task(item[0], item[1:]) for item in claimed]
+
+    def claim_task(self, task, worker_id, lease_seconds):
+        """
+        Atomically claim a specific task for the given worker, if it has not
+        changed since it was loaded.
+
+        :param pytasched.tasks.Task task:
+        :param str worker_id: Identifier of the worker claiming the task
+        :param float lease_seconds: How long the task is reserved for
+        :return bool: If the task was claimed
+        """
+
+        claimed = self._get_scripts()["claim_task"](
+            keys=[self._schedule_key, self._task_prefix + task.id],
+            args=[
+                task.id,
+                _redis_when(task.when),
+                _redis_when(self._get_now() + lease_seconds),
+                worker_id,
+            ],
+        )
+
+        return bool(claimed)
+
+    def extend_claims(self, tasks, worker_id, lease_seconds):
+        """
+        Move the leases of tasks the worker has claimed and is still running
+        forward, so they aren't claimed again while they run
+
+        :param list tasks: Tasks claimed by the worker
+        :param str worker_id: Identifier of the worker that claimed the tasks
+        :param float lease_seconds: How long the tasks are reserved for from now
+        :return int: Number of leases extended
+        """
+
+        if not tasks:
+            return 0
+
+        return self._get_scripts()["extend"](
+            keys=[self._schedule_key],
+            args=[
+                worker_id,
+                _redis_when(self._get_now() + lease_seconds),
+                self._task_prefix,
+            ]
+            + [task.id for task in tasks],
+        )
+
+    def reschedule(self, task, recur=False, delay=None):
+        """
+        Update task to be rescheduled, with its attempts
+
+        :param pytasched.task.Task task:
+        :param bool recur: If this is for recurring and we should try and keep
+                           the same schedule
+        :param float delay: Seconds from now to run the task in instead of its
+                            wait, e.g. to retry it
+        """
+
+        if delay is not None:
+            task.when = self._get_now() + delay
+        elif recur:
+            task.when = task.when + task.wait
+        else:
+            task.when = self._get_now() + task.wait
+
+        self.log(
+            INFO,
+            "Rescheduling task {} for {}".format(task.id, task.get_readable_when()),
+        )
+
+        rescheduled = self._get_scripts()["reschedule"](
+            keys=[self._schedule_key, self._task_prefix + task.id],
+            args=[task.id, _redis_when(task.when), task.attempts],
+        )
+        self.notify(task.when)
+
+        return bool(rescheduled)
+
+    def reschedule_many(self, tasks, recur=False):
+        """
+        Update many tasks to be rescheduled at once, in a single pipeline
+
+        :param list tasks: List of pytasched.tasks.Task
+        :param bool recur: If this is for recurring and we should try and keep
+                           the same schedule
+        :return int: Number of tasks rescheduled
+        """
+
+        if not tasks:
+            return 0
+
+        now = self._get_now()
+        for task in tasks:
+            if recur:
+                task.when = task.when + task.wait
+            else:
+                task.when = now + task.wait
+
+        self.log(INFO, "Rescheduling {} tasks".format(len(tasks)))
+
+        script = self._get_scripts()["reschedule"]
+        pipeline = self._get_client().pipeline(transaction=False)
+        for task in tasks:
+            script(
+                keys=[self._schedule_key, self._task_prefix + task.id],
+                args=[task.id, _redis_when(task.when), task.attempts],
+                client=pipeline,
+            )
+
+        rescheduled = sum(pipeline.execute())
+        self.notify(min(task.when for task in tasks))
+
+        return rescheduled
+
+    def remove_task(self, id):
+        """
+        Remove a task from the queue
+
+        :param str id: The task ID
+        :return bool:
+        """
+
+        self.log(INFO, "Removing task {}".format(id))
+
+        return bool(self._remove([id]))
+
+    def remove_tasks(self, ids):
+        """
+        Remove many tasks from the queue at once, in a single pipeline
+
+        :param list ids: The task IDs
+        :return int: Number of tasks removed
+        """
+
+        if not ids:
+            return 0
+
+        self.log(INFO, "Removing {} tasks".format(len(ids)))
+
+        return self._remove(ids)
+
+    def _remove(self, ids):
+        """
+        Remove the tasks and their place in the schedule
+
+        :param list ids: The task IDs
+        :return int: Number of tasks removed
+        """
+
+        pipeline = self._get_client().pipeline()
+        pipeline.delete(*[self._task_prefix + id for id in ids])
+        pipeline.zrem(self._schedule_key, *ids)
+
+        return pipeline.execute()[0]
+
+    def dead_letter_task(self, task, error):
+        """
+        Move a task that has failed too many times out of the schedule and to
+        the dead letters, in a single transaction. The dead letters are a
+        sorted set of task IDs scored by when they failed, and a hash for each.
+
+        :param pytasched.tasks.Task task:
+        :param str error: Why the last attempt failed
+        :return bool: If the task was still in the schedule
+        """
+
+        self.log(WARNING, "Moving task {} to the dead letters".format(task.id))
+
+        now = self._get_now()
+        item = _task_to_redis_item(task)
+        item.update({"error": error, "failed_at": repr(float(now))})
+        del item["status"]
+
+        key = self._dead_letter_prefix + task.id
+        pipeline = self._get_client().pipeline()
+        pipeline.delete(key)
+        pipeline.hset(key, mapping=item)
+        pipeline.zadd(self._dead_letters_key, {task.id: now})
+        pipeline.delete(self._task_prefix + task.id)
+        pipeline.zrem(self._schedule_key, task.id)
+
+        return bool(pipeline.execute()[3])
+
+    def get_dead_letters(self, limit=None):
+        """
+        Get the tasks that were given up on, the latest first
+
+        :param int limit: Maximum number of dead letters to return, None for all
+        :return list: List of DeadLetter
+        """
+
+        client = self._get_client()
+        ids = client.zrevrange(self._dead_letters_key, 0, (limit or 0) - 1)
+
+        pipeline = client.pipeline(transaction=False)
+        for id in ids:
+            pipeline.hmget(
+                self._dead_letter_prefix + id,
+                _REDIS_TASK_FIELDS + ("error", "failed_at"),
+            )
+
+        return [
+            DeadLetter(_redis_item_to_task(id, item[:-2]), item[-2], float(item[-1]))
+            for id, item in zip(ids, pipeline.execute())
+            if item[0] is not None
+        ]
+
+    def remove_dead_letter(self, id):
+        """
+        Forget a task that was given up on, e.g. after adding it again
+
+        :param str id: The task ID
+        :return bool:
+        """
+
+        pipeline = self._get_client().pipeline()
+        pipeline.delete(self._dead_letter_prefix + id)
+        pipeline.zrem(self._dead_letters_key, id)
+
+        return bool(pipeline.execute()[0])
+
+
+class MemoryStorageEngine(StorageEngine):
+    """
+    Storage engine that keeps the tasks in the memory of the current process,
+    for tests, benchmarks and single server setups where losing the tasks on
+    restart is fine. Tasks are kept in a heap by when, so finding the k due
+    tasks takes O(k log n) regardless of how many tasks there are.
+    """
+
+    supports_shards = True
+    supports_work_queue = True
+
+    def __init__(self, params):
+        super(MemoryStorageEngine, self).__init__(params)
+        self._tasks = {}
+        self._entries = {}
+        self._heap = []
+        self._ids = count(1)
+        self._members = {}
+        self._leader = None
+        self._queue = OrderedDict()
+        self._scheduled = {}
+        self._owners = {}
+        self._dead_letters = OrderedDict()
+        self._lock = RLock()
+
+    def _get_now(self):
+        """
+        Get current time
+        """
+        return time()
+
+    def _schedule(self, id, when):
+        """
+        Put the task in the heap for the given time. Any previous entries for
+        the task are ignored when they come up.
+
+        :param str id:
+        :param float when:
+        """
+        entry = (when, next(self._ids), id)
+        self._tasks[id].when = when
+        self._entries[id] = entry
+        heappush(self._heap, entry)
+
+    def _is_current(self, entry):
+        """
+        Check if the heap entry is the latest one for the task
+
+        :param tuple entry: (when, sequence, id)
+        :return bool:
+        """
+        return self._entries.get(entry[2]) is entry
+
+    def _pop_due(self, until, limit, shards=None):
+        """
+        Remove the due tasks from the heap, dropping outdated entries
+
+        :param float until:
+        :param int limit: None for all
+        :param list shards: Only tasks in these shards, None for all
+        :return list: (when, sequence, id) entries
+        """
+
+        entries = []
+        skipped = []
+
+        while self._heap and (limit is None or len(entries) < limit):
+            if not self._heap[0][0] < until:
+                break
+
+            entry = heappop(self._heap)
+            if not self._is_current(entry):
+                continue
+
+            if shards is None or self._tasks[entry[2]].shard in shards:
+                entries.append(entry)
+            else:
+                skipped.append(entry)
+
+        for entry in skipped:
+            heappush(self._heap, entry)
+
+        return entries
+
+    def add_task(self, task):
+        """
+        Add a new task to be processed
+
+        :param pytasched.tasks.Task task:
+        :returns str: The ID of the task
+        """
+
+        self.log(INFO, "Adding task {} in {}s".format(task.task, task.wait))
+
+        if not task.when:
+            task.when = self._get_now() + task.wait
+
+        self._assign_shard(task)
+
+        with self._lock:
+            stored = copy(task)
+            stored.id = str(next(self._ids))
+            self._tasks[stored.id] = stored
+            self._schedule(stored.id, task.when)
+
+        self.notify(task.when)
+
+        return stored.id
+
+    def get_task(self, id):
+        """
+        Get the specific task
+
+        :param str id:
+        :return pytasched.tasks.Task:
+        """
+
+        with self._lock:
+            task = self._tasks.get(id)
+            return copy(task) if task else None
+
+    def get_task_names(self):
+        """
+        Get the distinct names of all the scheduled tasks, i.e. their task
+        field, e.g. to prepare the task engine for them
+
+        :return set:
+        """
+        with self._lock:
+            return {task.task for task in self._tasks.values()}
+
+    def get_task_list(self, limit=None, until=None, shards=None):
+        """
+        Get the tasks that should be run, the ones that should have been run
+        first are first in the list.
+
+        :param int limit: Maximum number of tasks to return, None for all
+        :param float until: Get tasks scheduled before this instead of now
+        :param list shards: Only tasks in these shards, None for all
+        :return list:
+        """
+
+        if until is None:
+            until = self._get_now()
+
+        with self._lock:
+            entries = self._pop_due(until, limit, shards)
+
+            for entry in entries:
+                heappush(self._heap, entry)
+
+            return [copy(self._tasks[entry[2]]) for entry in entries]
 
-    def get_task(self, id):
+    def get_next_when(self, shards=None):
         """
-        Get the specific task
+        Get the time the next task is scheduled for
 
-        :param str id:
-        :return pytasched.tasks.Task:
+        :param list shards: Only tasks in these shards, None for all
+        :return float|None: None if there are no tasks
         """
 
-        collection = self._get_collection()
+        with self._lock:
+            while self._heap and not self._is_current(self._heap[0]):
+                heappop(self._heap)
 
-        item = collection.find_one({"_id": ObjectId(id)})
+            if shards is not None:
+                whens = [
+                    when
+                    for when, _, id in self._entries.values()
+                    if self._tasks[id].shard in shards
+                ]
+                return min(whens) if whens else None
 
-        if item:
-            return _mongo_item_to_task(item)
-        else:
-            return None
+            return self._heap[0][0] if self._heap else None
 
-    def get_task_list(self):
+    def has_task_changed(self, task):
         """
-        Get the tasks that should be run
+        Check if the task has changed / been deleted since it was loaded.
 
-        :return list:
+        :param pytasched.tasks.Task task:
+        :return bool:
         """
 
-        collection = self._get_collection()
+        with self._lock:
+            stored = self._tasks.get(task.id)
+            return stored is None or stored.when != task.when
+
+    def claim_due_tasks(self, worker_id, limit, lease_seconds, shards=None):
+        """
+        Claim tasks that need to be run for the given worker, moving them
+        forward by lease_seconds like MongoDBStorageEngine does.
+
+        :param str worker_id: Identifier of the worker claiming the tasks
+        :param int limit: Maximum number of tasks to claim
+        :param float lease_seconds: How long the tasks are reserved for
+        :param list shards: Only tasks in these shards, None for all
+        :return list: The claimed tasks, as they were before claiming
+        """
 
         now = self._get_now()
 
-        tasks = collection.find({"when": {"$lt": now}})
+        with self._lock:
+            tasks = []
 
-        return _MongoDBCursorWrapper(tasks)
+            for entry in self._pop_due(now, limit, shards):
+                tasks.append(copy(self._tasks[entry[2]]))
+                self._schedule(entry[2], now + lease_seconds)
+                self._owners[entry[2]] = worker_id
 
-    def has_task_changed(self, task):
+            return tasks
+
+    def claim_task(self, task, worker_id, lease_seconds):
         """
-        Check if the task has changed / been deleted since it was loaded.
+        Claim a specific task for the given worker, if it has not changed
+        since it was loaded.
 
         :param pytasched.tasks.Task task:
-        :return bool:
+        :param str worker_id: Identifier of the worker claiming the task
+        :param float lease_seconds: How long the task is reserved for
+        :return bool: If the task was claimed
         """
 
-        reloaded = self.get_task(task.id)
+        with self._lock:
+            if self.has_task_changed(task):
+                return False
 
-        if reloaded is None:
+            self._schedule(task.id, self._get_now() + lease_seconds)
+            self._owners[task.id] = worker_id
             return True
 
-        if reloaded.when != task.when:
-            return True
+    def extend_claims(self, tasks, worker_id, lease_seconds):
+        """
+        Move the leases of tasks the worker has claimed and is still running
+        forward, so they aren't claimed again while they run
 
-        return False
+        :param list tasks: Tasks claimed by the worker
+        :param str worker_id: Identifier of the worker that claimed the tasks
+        :param float lease_seconds: How long the tasks are reserved for from now
+        :return int: Number of leases extended
+        """
 
-    def reschedule(self, task, recur=False):
+        when = self._get_now() + lease_seconds
+
+        with self._lock:
+            extended = 0
+
+            for task in tasks:
+                if self._owners.get(task.id) == worker_id:
+                    self._schedule(task.id, when)
+                    extended += 1
+
+            return extended
+
+    def reschedule(self, task, recur=False, delay=None):
         """
-        Update task to be rescheduled
+        Update task to be rescheduled, with its attempts
 
         :param pytasched.task.Task task:
         :param bool recur: If this is for recurring and we should try and keep
                            the same schedule
+        :param float delay: Seconds from now to run the task in instead of its
+                            wait, e.g. to retry it
         """
 
-        if recur:
+        if delay is not None:
+            task.when = self._get_now() + delay
+        elif recur:
             task.when = task.when + task.wait
         else:
             task.when = self._get_now() + task.wait
@@ -366,16 +3578,24 @@ class MongoDBStorageEngine(StorageEngine):
             "Rescheduling task {} for {}".format(task.id, task.get_readable_when()),
         )
 
-        collection = self._get_collection()
-        result = collection.update_one(
-            {"_id": ObjectId(task.id)}, {"$set": {"when": task.when}}
-        )
+        with self._lock:
+            if task.id not in self._tasks:
+                return False
 
-        return bool(result.modified_count)
+            self._queue.pop(task.id, None)
+            self._scheduled.pop(task.id, None)
+            self._owners.pop(task.id, None)
+            self._tasks[task.id].attempts = task.attempts
+            self._schedule(task.id, task.when)
+
+        self.notify(task.when)
+
+        return True
 
     def remove_task(self, id):
         """
-        Remove a task from the queue
+        Remove a task from the queue, its heap entries are dropped when they
+        come up.
 
         :param str id: The task ID
         :return bool:
@@ -383,10 +3603,178 @@ class MongoDBStorageEngine(StorageEngine):
 
         self.log(INFO, "Removing task {}".format(id))
 
-        collection = self._get_collection()
-        result = collection.delete_one({"_id": ObjectId(id)})
+        with self._lock:
+            self._entries.pop(id, None)
+            self._queue.pop(id, None)
+            self._scheduled.pop(id, None)
+            self._owners.pop(id, None)
+            return self._tasks.pop(id, None) is not None
 
-        return bool(result.deleted_count)
+    def dead_letter_task(self, task, error):
+        """
+        Move a task that has failed too many times out of the schedule and to
+        the dead letters, for someone to look into
+
+        :param pytasched.tasks.Task task:
+        :param str error: Why the last attempt failed
+        :return bool: If the task was still in the schedule
+        """
+
+        self.log(WARNING, "Moving task {} to the dead letters".format(task.id))
+
+        with self._lock:
+            self._dead_letters.pop(task.id, None)
+            self._dead_letters[task.id] = DeadLetter(copy(task), error, self._get_now())
+            return self.remove_task(task.id)
+
+    def get_dead_letters(self, limit=None):
+        """
+        Get the tasks that were given up on, the latest first
+
+        :param int limit: Maximum number of dead letters to return, None for all
+        :return list: List of DeadLetter
+        """
+
+        with self._lock:
+            letters = list(reversed(self._dead_letters.values()))
+
+        return [
+            DeadLetter(copy(letter.task), letter.error, letter.failed_at)
+            for letter in letters[:limit]
+        ]
+
+    def remove_dead_letter(self, id):
+        """
+        Forget a task that was given up on, e.g. after adding it again
+
+        :param str id: The task ID
+        :return bool:
+        """
+
+        with self._lock:
+            return self._dead_letters.pop(id, None) is not None
+
+    def heartbeat(self, worker_id, timeout):
+        """
+        Let others know the worker is sharing the shards, for the next timeout
+        seconds
+
+        :param str worker_id: Identifier of the worker
+        :param float timeout: Seconds until the worker is considered gone
+        """
+
+        with self._lock:
+            self._members[worker_id] = self._get_now() + timeout
+
+    def get_members(self):
+        """
+        Get the workers sharing the shards
+
+        :return list: Identifiers of the workers with a valid heartbeat
+        """
+
+        now = self._get_now()
+
+        with self._lock:
+            return sorted(
+                worker_id
+                for worker_id, expires in self._members.items()
+                if expires >= now
+            )
+
+    def leave(self, worker_id):
+        """
+        Stop sharing the shards with the others
+
+        :param str worker_id: Identifier of the worker
+        """
+
+        with self._lock:
+            self._members.pop(worker_id, None)
+
+    def acquire_leadership(self, worker_id, lease_seconds):
+        """
+        Become or stay the leader for the next lease_seconds, if nobody else
+        is the leader.
+
+        :param str worker_id: Identifier of the worker
+        :param float lease_seconds: How long the leadership lasts if not renewed
+        :return bool: If the worker is the leader
+        """
+
+        now = self._get_now()
+
+        with self._lock:
+            if self._leader and self._leader[0] != worker_id:
+                if self._leader[1] >= now:
+                    return False
+
+            self._leader = (worker_id, now + lease_seconds)
+            return True
+
+    def release_leadership(self, worker_id):
+        """
+        Stop being the leader, if the worker is the leader
+
+        :param str worker_id: Identifier of the worker
+        """
+
+        with self._lock:
+            if self._leader and self._leader[0] == worker_id:
+                self._leader = None
+
+    def setup_work_queue(self):
+        """
+        Set up the storage engine for handing claimed tasks to other workers
+        """
+        pass
+
+    def queue_tasks(self, tasks):
+        """
+        Put claimed tasks in the work queue for any worker to take
+
+        :param list tasks: Tasks returned by claim_due_tasks()
+        :return int: Number of tasks queued
+        """
+
+        with self._lock:
+            queued = 0
+
+            for task in tasks:
+                if task.id in self._tasks:
+                    # Keep the original time if the task was queued before
+                    scheduled = self._scheduled.setdefault(task.id, task.when)
+                    self._queue[task.id] = scheduled
+                    self._owners.pop(task.id, None)
+                    queued += 1
+
+            return queued
+
+    def take_queued_tasks(self, worker_id, limit, lease_seconds):
+        """
+        Take tasks from the work queue for the given worker, in the order they
+        were queued.
+
+        :param str worker_id: Identifier of the worker taking the tasks
+        :param int limit: Maximum number of tasks to take
+        :param float lease_seconds: How long the tasks are reserved for
+        :return list: The tasks, with the time they were scheduled for
+        """
+
+        now = self._get_now()
+
+        with self._lock:
+            tasks = []
+
+            while self._queue and len(tasks) < limit:
+                id, scheduled = self._queue.popitem(last=False)
+                task = copy(self._tasks[id])
+                task.when = scheduled
+                tasks.append(task)
+                self._schedule(id, now + lease_seconds)
+                self._owners[id] = worker_id
+
+            return tasks
 
 
 class TaskEngine(Engine):
@@ -405,15 +3793,71 @@ class TaskEngine(Engine):
         """
         raise NotImplementedError()
 
+    def prepare(self, task_names):
+        """
+        Get ready to run the tasks with the given names, e.g. when the server
+        starts, so problems with them show up early
+
+        :param iterable task_names: The task field of the tasks
+        :return list: The names of the tasks that can't be run
+        """
+        return []
+
+    def clear_cache(self):
+        """
+        Forget anything cached for running the tasks, e.g. when the code is
+        reloaded
+        """
+        pass
+
+    def flush(self):
+        """
+        Send off anything batched up by run, called at the end of every tick
+        """
+        pass
+
+    def close(self):
+        """
+        Wait for any tasks running in the background and clean up, e.g. when
+        the server shuts down
+        """
+        pass
+
 
 class FunctionTaskEngine(TaskEngine):
     """
-    Forward tasks to Python functions
+    Forward tasks to Python functions. The functions are cached once loaded,
+    up to "cache_size" of them.
+
+    With "processes" set, the functions are run in that many persistent
+    worker processes instead, so CPU heavy tasks aren't limited by the GIL.
+    The workers are forked when the first task is run, or when the task
+    engine is prepared, and then already have the prepared functions loaded.
+    Workers are replaced after "max_tasks_per_worker" tasks, or when they've
+    used more than "max_worker_memory" MB.
     """
 
     def __init__(self, params):
         super(FunctionTaskEngine, self).__init__(params)
         self.configured = False
+        self.callables = CallableCache(params.get("cache_size", 1024))
+        self.workers = None
+
+        if params.get("processes"):
+            self.workers = WorkerPool(
+                params["processes"],
+                paths=params.get("paths", ()),
+                max_tasks=params.get("max_tasks_per_worker"),
+                max_memory=params.get("max_worker_memory"),
+                start_method=params.get("start_method"),
+                cache_size=params.get("cache_size", 1024),
+            )
+
+    def __getstate__(self):
+        # Sent to a process pool, the functions run in that process instead
+        state = self.__dict__.copy()
+        state["workers"] = None
+        return state
 
     def _setup(self):
         if not self.configured:
@@ -433,16 +3877,69 @@ class FunctionTaskEngine(TaskEngine):
 
         self._setup()
 
-        runnable = load_from_module(task.task)
+        if self.workers:
+            return self.workers.submit(task.task, task.get_args(), task.get_kwargs())
+
+        runnable = self.callables.get(task.task)
         runnable(*task.get_args(), **task.get_kwargs())
 
+    def prepare(self, task_names):
+        """
+        Load the functions for the given task names into the cache
+
+        :param iterable task_names: The task field of the tasks
+        :return list: The names of the tasks that can't be run
+        """
+
+        self._setup()
+        failed = []
+
+        for name in sorted(task_names):
+            try:
+                self.callables.get(name)
+            except ValueError as e:
+                self.log(ERROR, "Can't load task {}: {}".format(name, e))
+                failed.append(name)
+
+        if self.workers:
+            # Forked with the functions already loaded, and replacements load
+            # them when starting
+            self.workers.preload = [name for name in task_names if name not in failed]
+            self.workers.start()
+
+        return failed
+
+    def clear_cache(self):
+        """
+        Forget the loaded functions
+        """
+        self.callables.clear()
+
+    def close(self):
+        """
+        Stop the worker processes, if any
+        """
+
+        if self.workers:
+            self.workers.close()
+
 
 class ShellTaskEngine(TaskEngine):
     """
-    Execute tasks as shell commands
+    Execute tasks as shell commands. The "system" style runs them with
+    os.system, ignoring the result. The "subprocess" style runs the command
+    split into arguments without a shell, and fails the task if it exits with
+    an error or runs longer than the "timeout" param. The "pool" style does
+    the same in a pool of up to "max_workers" threads, so the server isn't
+    blocked while the commands run. Up to "max_output" bytes of the output is
+    kept, the rest is discarded.
+
+    Futures can't be sent back from a process pool, so when sent to one the
+    "pool" style runs the commands like "subprocess", the process pool
+    already runs them at the same time.
     """
 
-    STYLES = ("system",)
+    STYLES = ("system", "subprocess", "pool")
 
     def __init__(self, params):
         super(ShellTaskEngine, self).__init__(params)
@@ -455,14 +3952,43 @@ class ShellTaskEngine(TaskEngine):
                 "Shell style {} not supported".format(params["style"])
             )
 
+        self.pool = None
+        self.use_pool = True
+        self._pool_lock = Lock()
+
+    def __getstate__(self):
+        # Sent to a process pool, the commands run in that process instead
+        state = self.__dict__.copy()
+        state["pool"] = None
+        state["use_pool"] = False
+        del state["_pool_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._pool_lock = Lock()
+
+    def close(self):
+        """
+        Wait for the commands running in the pool
+        """
+
+        with self._pool_lock:
+            pool, self.pool = self.pool, None
+
+        if pool:
+            pool.shutdown(wait=True)
+
     def run(self, task):
         """
         Run the given task
 
         :param pytasched.tasks.Task task:
+        :return ShellResult|concurrent.futures.Future: The result of the
+            command, or with the "pool" style a future for it
         """
         f = getattr(self, "_run_" + self.params["style"])
-        f(task)
+        return f(task)
 
     @staticmethod
     def _run_system(task):
@@ -477,3 +4003,277 @@ class ShellTaskEngine(TaskEngine):
 
         print("Running: {}".format(cmd))
         os.system(cmd)
+
+    def _run_subprocess(self, task):
+        """
+        Run the command without a shell and wait for it to finish
+
+        :param pytasched.tasks.Task task:
+        :raises TaskEngineError: If the command fails or times out
+        :return ShellResult:
+        """
+
+        cmd = task.task.format(*task.get_args(), **task.get_kwargs())
+        args = shlex.split(cmd)
+
+        self.log(DEBUG, "Running: {}".format(cmd))
+
+        try:
+            process = subprocess.Popen(
+                args,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                start_new_session=True,
+            )
+        except OSError as e:
+            raise TaskEngineError("Could not run {}: {}".format(cmd, e))
+
+        max_output = self.params.get("max_output", 64 * 1024)
+        stdout = _CappedReader(process.stdout, max_output)
+        stderr = _CappedReader(process.stderr, max_output)
+
+        try:
+            returncode = process.wait(self.params.get("timeout"))
+        except subprocess.TimeoutExpired:
+            _kill(process)
+            raise TaskEngineError(
+                "{} timed out after {}s".format(cmd, self.params["timeout"])
+            )
+        finally:
+            stdout.join()
+            stderr.join()
+
+        result = ShellResult(returncode, stdout.get_output(), stderr.get_output())
+
+        if returncode:
+            raise TaskEngineError(
+                "{} exited with {}: {}".format(cmd, returncode, result.stderr.strip())
+            )
+
+        return result
+
+    def _run_pool(self, task):
+        """
+        Run the command in the pool, without waiting for it
+
+        :param pytasched.tasks.Task task:
+        :return concurrent.futures.Future|ShellResult: Finishes as
+            _run_subprocess would, or its result when in a process pool
+        """
+
+        if not self.use_pool:
+            return self._run_subprocess(task)
+
+        with self._pool_lock:
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(
+                    max_workers=self.params.get("max_workers", 4)
+                )
+
+        return self.pool.submit(self._run_subprocess, task)
+
+
+# The result of a shell task, the output is capped at "max_output" bytes
+ShellResult = namedtuple("ShellResult", ["returncode", "stdout", "stderr"])
+
+
+class _CappedReader(object):
+    """
+    Reads a pipe until it's closed in a thread, keeping the start of the
+    output up to a limit and discarding the rest, so the process never blocks
+    on a full pipe.
+    """
+
+    def __init__(self, stream, limit):
+        self.stream = stream
+        self.limit = limit
+        self.chunks = []
+        self.size = 0
+        self.thread = Thread(target=self._read)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _read(self):
+        try:
+            for chunk in iter(lambda: self.stream.read(8192), b""):
+                if self.size < self.limit:
+                    self.chunks.append(chunk[: self.limit - self.size])
+                self.size += len(chunk)
+        finally:
+            self.stream.close()
+
+    def join(self, timeout=5.0):
+        self.thread.join(timeout)
+
+    def get_output(self):
+        """
+        :return str: The output, decoded as UTF-8
+        """
+
+        output = b"".join(self.chunks).decode("utf-8", "replace")
+
+        if self.size > self.limit:
+            output += "\n[{} more bytes]".format(self.size - self.limit)
+
+        return output
+
+
+def _kill(process):
+    """
+    Kill the process and anything it started
+
+    :param subprocess.Popen process:
+    """
+
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (AttributeError, OSError):
+        process.kill()
+
+    process.wait()
+
+
+class CeleryTaskEngine(TaskEngine):
+    """
+    Send tasks to Celery workers with send_task, so the task field is the
+    name of the Celery task and the Celery code doesn't need to be importable
+    here. The Celery app is loaded from the "app" param, e.g.
+    "workers.celery:app", and the broker connection is taken from its pool.
+
+    The options of each task, e.g. queue, routing_key or priority, are passed
+    on to send_task on top of the "options" param. Tasks run during a tick are
+    published together with one producer when the server flushes the engine,
+    or after "max_delay" seconds if the engine isn't flushed, e.g. with the
+    thread executor. Publishing is I/O bound, so use the inline or thread
+    executor rather than the process one.
+    """
+
+    def __init__(self, params):
+        super(CeleryTaskEngine, self).__init__(params)
+
+        if "app" not in params:
+            raise TaskEngineError("Celery app not defined")
+
+        self.app = None
+        self.pending = []
+        self._timer = None
+        self._lock = Lock()
+
+    def __getstate__(self):
+        # Sent to a process pool, the app and its connections are set up again
+        state = self.__dict__.copy()
+        state["app"] = None
+        state["pending"] = []
+        state["_timer"] = None
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+    def _get_app(self):
+        if self.app is None:
+            app = self.params["app"]
+            self.app = load_from_module(app) if isinstance(app, str) else app
+
+        return self.app
+
+    def run(self, task):
+        """
+        Queue the given task to be published with the rest of the tick
+
+        :param pytasched.tasks.Task task:
+        :return concurrent.futures.Future: For the Celery task ID, finishes
+            once the task is published
+        """
+
+        future = Future()
+
+        with self._lock:
+            self.pending.append((task, future))
+
+            if self._timer is None:
+                self._timer = Timer(self.params.get("max_delay", 0.1), self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+        return future
+
+    def prepare(self, task_names):
+        """
+        Load the Celery app, so a broken "app" param shows up early
+
+        :param iterable task_names: The task field of the tasks
+        :return list: The names of the tasks that can't be run
+        """
+
+        try:
+            self._get_app()
+        except ValueError as e:
+            self.log(ERROR, "Can't load the Celery app: {}".format(e))
+            return sorted(task_names)
+
+        return []
+
+    def flush(self):
+        """
+        Publish all the queued tasks with a single producer
+
+        :return int: Number of tasks published
+        """
+
+        with self._lock:
+            pending, self.pending = self.pending, []
+            timer, self._timer = self._timer, None
+
+        if timer:
+            timer.cancel()
+
+        if not pending:
+            return 0
+
+        self.log(DEBUG, "Publishing {} task(s) to Celery".format(len(pending)))
+
+        app = self._get_app()
+        published = 0
+
+        try:
+            with app.producer_or_acquire() as producer:
+                for task, future in pending:
+                    options = dict(self.params.get("options", {}))
+                    options.update(task.get_options())
+
+                    try:
+                        result = app.send_task(
+                            task.task,
+                            args=task.get_args(),
+                            kwargs=task.get_kwargs(),
+                            producer=producer,
+                            **options
+                        )
+                    except Exception as e:
+                        future.set_exception(
+                            TaskEngineError(
+                                "Could not publish {}: {}".format(task.task, e)
+                            )
+                        )
+                    else:
+                        future.set_result(result.id)
+                        published += 1
+        except Exception as e:
+            # Couldn't get a connection to the broker
+            for task, future in pending:
+                if not future.done():
+                    future.set_exception(
+                        TaskEngineError("Could not publish {}: {}".format(task.task, e))
+                    )
+
+        return published
+
+    def close(self):
+        """
+        Publish anything still queued
+        """
+        self.flush()
@@ -1,4 +1,16 @@
-from settings import LOCKS, MEMCACHED, MONGODB_CONNECTION_STRING, MONGODB_DATABASE
+from __future__ import unicode_literals
+from builtins import object
+from math import ceil
+from time import time
+
+from settings import (
+    LOCKS,
+    LOCK_TTL,
+    MEMCACHED,
+    MONGODB_CONNECTION_STRING,
+    MONGODB_DATABASE,
+)
+from pytasched.connections import get_mongo_client
 
 try:
     import shylock
@@ -17,9 +29,13 @@ except ImportError:
 
 try:
     import pymongo
+    from pymongo.errors import BulkWriteError
 except ImportError:
     pymongo = None
 
+# Duplicate key, someone else is holding the lock
+_MONGO_DUPLICATE_KEY = 11000
+
 
 class Lock(object):
     def __init__(self):
@@ -35,7 +51,7 @@ if LOCKS == "shylock":
         raise ValueError(
             "Cannot use shylock locks, MongoDB connection string is not configured"
         )
-    client = pymongo.MongoClient(MONGODB_CONNECTION_STRING)
+    client = get_mongo_client(MONGODB_CONNECTION_STRING)
     shylock.configure(shylock.ShylockPymongoBackend.create(client, MONGODB_DATABASE))
     Lock = shylock.Lock
 elif LOCKS == "sherlock":
@@ -47,6 +63,179 @@ elif LOCKS == "sherlock":
     sherlock.configure(
         backend=sherlock.backends.MEMCACHED,
         client=pylibmc.Client(MEMCACHED),
-        expire=5 * 60,
+        expire=int(ceil(LOCK_TTL)),
     )
     Lock = sherlock.MCLock
+
+
+class BatchLocks(object):
+    """
+    Locks for a whole batch of tasks, acquired, renewed and released with a
+    single round trip per batch instead of one or more per lock. The locks
+    expire after the TTL unless renewed, so a crashed server doesn't block
+    its tasks forever.
+    """
+
+    def __init__(self, owner, ttl):
+        """
+        :param str owner: Identifier of the server holding the locks
+        :param float ttl: Seconds until the locks expire unless renewed
+        """
+        self.owner = owner
+        self.ttl = ttl
+
+    def acquire_many(self, names):
+        """
+        Try to acquire the locks, without waiting for the ones held by others
+
+        :param list names: Names of the locks
+        :return list: Names of the locks that were acquired
+        """
+        raise NotImplementedError()
+
+    def renew_many(self, names):
+        """
+        Extend the locks we're holding by another TTL
+
+        :param list names: Names of the locks
+        """
+        raise NotImplementedError()
+
+    def release_many(self, names):
+        """
+        Release the locks we're holding
+
+        :param list names: Names of the locks
+        """
+        raise NotImplementedError()
+
+
+class MemcachedBatchLocks(BatchLocks):
+    """
+    Batch locks in memcached, via add_multi which only sets the keys that
+    don't exist yet
+    """
+
+    def __init__(self, owner, ttl, client):
+        """
+        :param str owner: Identifier of the server holding the locks
+        :param float ttl: Seconds until the locks expire unless renewed
+        :param pylibmc.Client client:
+        """
+        super(MemcachedBatchLocks, self).__init__(owner, ttl)
+        self.client = client
+
+    def _get_expire(self):
+        return int(ceil(self.ttl))
+
+    def acquire_many(self, names):
+        if not names:
+            return []
+
+        failed = set(
+            self.client.add_multi(
+                {name: self.owner for name in names}, time=self._get_expire()
+            )
+        )
+
+        return [name for name in names if name not in failed]
+
+    def _get_own(self, names):
+        """
+        Get the locks that are still held by us, not expired and taken by
+        others since. memcached can't make the following write conditional,
+        so this leaves a window of a single round trip.
+
+        :param list names:
+        :return list:
+        """
+        held = self.client.get_multi(list(names))
+        return [name for name in names if held.get(name) == self.owner]
+
+    def renew_many(self, names):
+        names = self._get_own(names) if names else []
+        if names:
+            self.client.set_multi(
+                {name: self.owner for name in names}, time=self._get_expire()
+            )
+
+    def release_many(self, names):
+        names = self._get_own(names) if names else []
+        if names:
+            self.client.delete_multi(names)
+
+
+class MongoBatchLocks(BatchLocks):
+    """
+    Batch locks in MongoDB, via an unordered bulk write of upserts that only
+    match expired locks. The locks held by others fail with a duplicate key
+    error for their _id.
+    """
+
+    def __init__(self, owner, ttl, collection):
+        """
+        :param str owner: Identifier of the server holding the locks
+        :param float ttl: Seconds until the locks expire unless renewed
+        :param pymongo.collection.Collection collection:
+        """
+        super(MongoBatchLocks, self).__init__(owner, ttl)
+        self.collection = collection
+
+    def acquire_many(self, names):
+        if not names:
+            return []
+
+        now = time()
+        requests = [
+            pymongo.UpdateOne(
+                {"_id": name, "expires": {"$lt": now}},
+                {"$set": {"owner": self.owner, "expires": now + self.ttl}},
+                upsert=True,
+            )
+            for name in names
+        ]
+
+        try:
+            self.collection.bulk_write(requests, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details["writeErrors"]
+            if any(error["code"] != _MONGO_DUPLICATE_KEY for error in errors):
+                raise
+
+            failed = {error["index"] for error in errors}
+            return [name for index, name in enumerate(names) if index not in failed]
+
+        return list(names)
+
+    def renew_many(self, names):
+        if names:
+            self.collection.update_many(
+                {"_id": {"$in": list(names)}, "owner": self.owner},
+                {"$set": {"expires": time() + self.ttl}},
+            )
+
+    def release_many(self, names):
+        if names:
+            self.collection.delete_many(
+                {"_id": {"$in": list(names)}, "owner": self.owner}
+            )
+
+
+def get_batch_locks(owner, ttl=LOCK_TTL):
+    """
+    Get the batch locks for the configured LOCKS backend, "sherlock" uses
+    the same memcached servers and "shylock" the same MongoDB database.
+
+    :param str owner: Identifier of the server holding the locks
+    :param float ttl: Seconds until the locks expire unless renewed
+    :return BatchLocks:
+    """
+
+    if LOCKS == "shylock":
+        client = get_mongo_client(MONGODB_CONNECTION_STRING)
+        collection = client[MONGODB_DATABASE]["pytasched_locks"]
+        return MongoBatchLocks(owner, ttl, collection)
+    elif LOCKS == "sherlock":
+        return MemcachedBatchLocks(owner, ttl, pylibmc.Client(MEMCACHED))
+
+    raise NotImplementedError("Trying to use locks but no lock backend configured.")
@@ -1,4 +1,5 @@
 from __future__ import unicode_literals
 from pytasched.server.core import PytaschedServer
+from pytasched.server.aio import AsyncPytaschedServer
 
-__all__ = ["PytaschedServer"]
+__all__ = ["PytaschedServer", "AsyncPytaschedServer"]
@@ -0,0 +1,90 @@
+from __future__ import division
+from __future__ import unicode_literals
+from builtins import object
+
+
+class AdaptiveTick(object):
+    """
+    Adapts the poll interval and batch size to the load. When tasks start
+    later than the target lag or there are more due tasks than fit in a
+    batch, the batch size is doubled and the interval halved, up to the
+    bounds. Idle ticks back off step by step towards the slowest polling and
+    the smallest batches, to not load the storage engine for nothing.
+    """
+
+    # How much to slow down per idle tick
+    BACKOFF = 1.25
+
+    def __init__(
+        self, target_lag, min_seconds, max_seconds, min_batch_size, max_batch_size
+    ):
+        """
+        :param float target_lag: Seconds after their when tasks should start by
+        :param float min_seconds: Shortest interval between polls
+        :param float max_seconds: Longest interval between polls
+        :param int min_batch_size: Smallest number of tasks to get per tick
+        :param int max_batch_size: Largest number of tasks to get per tick
+        """
+        self.target_lag = target_lag
+        self.min_seconds = min_seconds
+        self.max_seconds = max_seconds
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max(min_batch_size, max_batch_size)
+        self.seconds_per_tick = max_seconds
+        self.batch_size = min_batch_size
+        self.on_time = 0
+        self.late = 0
+        self._max_lag = None
+
+    def observe(self, lag):
+        """
+        Record how late a task started
+
+        :param float lag: Seconds after its when the task started
+        :return bool: If the task started within the target lag
+        """
+
+        if self._max_lag is None or lag > self._max_lag:
+            self._max_lag = lag
+
+        if lag > self.target_lag:
+            self.late += 1
+            return False
+
+        self.on_time += 1
+        return True
+
+    def get_slo_ratio(self):
+        """
+        Get the share of tasks started within the target lag so far
+
+        :return float|None: None if no tasks have been started
+        """
+
+        total = self.on_time + self.late
+        return self.on_time / total if total else None
+
+    def update(self, started, backlog):
+        """
+        Adapt to the tick that just finished
+
+        :param int started: Number of tasks started this tick
+        :param bool backlog: If there were more due tasks than fit in the batch
+        :return bool: If the interval or batch size changed
+        """
+
+        lag, self._max_lag = self._max_lag, None
+        previous = (self.seconds_per_tick, self.batch_size)
+
+        if backlog or (lag is not None and lag > self.target_lag):
+            self.seconds_per_tick = max(self.min_seconds, self.seconds_per_tick / 2)
+            self.batch_size = min(self.max_batch_size, self.batch_size * 2)
+        elif not started:
+            self.seconds_per_tick = min(
+                self.max_seconds, self.seconds_per_tick * self.BACKOFF
+            )
+            self.batch_size = max(
+                self.min_batch_size, int(self.batch_size / self.BACKOFF)
+            )
+
+        return (self.seconds_per_tick, self.batch_size) != previous
@@ -0,0 +1,289 @@
+from __future__ import unicode_literals
+import asyncio
+from builtins import object
+from time import time
+from pytasched.engines import get_storage_engine, get_task_engine
+from pytasched.tools import DueTimeWaiter, get_backoff
+from pytasched.autoreload import set_logger, check
+from pytasched.server.core import _earliest, _get_worker_id
+
+
+class AsyncPytaschedServer(object):
+    """
+    asyncio version of the server, runs up to MAX_IN_FLIGHT tasks at the same
+    time in the event loop. Needs async storage and task engines, e.g. the
+    ones in pytasched.aioengines, and always claims tasks from the storage
+    engine instead of using locks.
+    """
+
+    def __init__(self, settings, logger, storage_engine=None, task_engine=None):
+        """
+        :param module settings:
+        :param logging.Logger logger:
+        :param pytasched.aioengines.AsyncStorageEngine storage_engine: Use this
+            engine instead of the one configured in settings
+        :param pytasched.aioengines.AsyncTaskEngine task_engine: Use this
+            engine instead of the one configured in settings
+        """
+        self.settings = settings
+        self.logger = logger
+        self.storage_engine = storage_engine
+        self.task_engine = task_engine
+        self.running = {}
+        self.stopped = False
+        self.batch_full = False
+        self.waiter = DueTimeWaiter(
+            settings.MIN_SECONDS_PER_TICK, settings.SECONDS_PER_TICK
+        )
+        self.wakeup = None
+        self.wake_at = None
+        self.worker_id = settings.WORKER_ID or _get_worker_id()
+        self.next_claim_renewal = None
+
+    def _setup(self):
+        """
+        Setup the server components
+        """
+
+        if not self.storage_engine:
+            self.logger.debug(
+                "Setting up storage engine {engine}".format(
+                    engine=self.settings.STORAGE["engine"]
+                )
+            )
+
+            self.storage_engine = get_storage_engine(self.settings)
+
+        if not self.task_engine:
+            self.logger.debug(
+                "Setting up task engine {engine}".format(
+                    engine=self.settings.TASKS["engine"]
+                )
+            )
+
+            self.task_engine = get_task_engine(self.settings)
+
+        self.storage_engine.set_logger(self.logger)
+        self.task_engine.set_logger(self.logger)
+        self.storage_engine.add_listener(self.notify)
+        self.wakeup = asyncio.Event()
+
+        set_logger(self.logger)
+
+    async def run(self):
+        """
+        Run the monitor
+        """
+
+        self._setup()
+
+        self.logger.info("Waiting for tasks as {}...".format(self.worker_id))
+
+        try:
+            while not self.stopped:
+                if self.settings.AUTORELOAD:
+                    check()
+
+                await self.process_tasks()
+                await self._wait(await self._get_next_when())
+        finally:
+            await self.shutdown()
+
+    def stop(self):
+        """
+        Stop the server after the current tick
+        """
+        self.stopped = True
+        self.wakeup.set()
+
+    def notify(self, when=None):
+        """
+        Wake up the server if something is due before it would otherwise wake
+        up.
+
+        :param float|None when: When the new thing is due, None for now
+        """
+
+        wake_at = self.wake_at
+        if when is None or wake_at is None or when < wake_at:
+            self.wakeup.set()
+
+    async def _wait(self, next_when):
+        """
+        Wait until next_when, or until notified of something earlier.
+
+        :param float|None next_when: None if nothing is known to be due
+        """
+
+        delay = self.waiter.get_delay(next_when)
+        self.wake_at = time() + delay
+
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+        self.wakeup.clear()
+        self.wake_at = None
+
+    async def _get_next_when(self):
+        """
+        Figure out when we should look for tasks next
+
+        :return float|None: None if we should wait as long as possible
+        """
+
+        if len(self.running) >= self.settings.MAX_IN_FLIGHT:
+            # Finishing tasks wake us up
+            when = None
+        elif self.batch_full:
+            # There are likely more tasks waiting
+            return 0
+        else:
+            when = await self.storage_engine.get_next_when()
+
+        if self.running:
+            when = _earliest(when, self.next_claim_renewal)
+
+        return when
+
+    async def shutdown(self):
+        """
+        Wait for the running tasks to finish
+        """
+
+        if self.running:
+            self.logger.info(
+                "Waiting for {} running task(s) to finish".format(len(self.running))
+            )
+            await asyncio.wait(list(self.running))
+
+    async def process_tasks(self):
+        """
+        Claim the tasks that should be run and start running them, as long as
+        there are less than MAX_IN_FLIGHT tasks running.
+
+        :return int: Number of tasks that were started
+        """
+
+        await self._extend_claims()
+
+        limit = min(
+            self.settings.BATCH_SIZE, self.settings.MAX_IN_FLIGHT - len(self.running)
+        )
+        self.batch_full = False
+
+        if limit <= 0:
+            self.logger.debug(
+                "{} tasks in flight, not looking for more".format(len(self.running))
+            )
+            return 0
+
+        tasks = await self.storage_engine.claim_due_tasks(
+            self.worker_id, limit, self.settings.LEASE_SECONDS
+        )
+
+        if tasks:
+            self.logger.debug("Claimed {} task(s) to process".format(len(tasks)))
+
+        for task in tasks:
+            future = asyncio.ensure_future(self._run_task(task))
+            self.running[future] = task
+            future.add_done_callback(self._task_done)
+
+        self.batch_full = len(tasks) >= limit
+
+        return len(tasks)
+
+    def _task_done(self, future):
+        """
+        Forget about a finished task, and wake up to look for more tasks
+        """
+        self.running.pop(future, None)
+        self.notify()
+
+    async def _extend_claims(self):
+        """
+        Keep the claims of long running tasks from expiring, so they aren't
+        run again by others, if it's time to do that
+        """
+
+        now = time()
+        if self.next_claim_renewal is not None and now < self.next_claim_renewal:
+            return
+
+        self.next_claim_renewal = now + self.settings.LEASE_SECONDS / 2.0
+        tasks = list(self.running.values())
+
+        if tasks:
+            self.logger.debug("Extending {} claim(s)".format(len(tasks)))
+            await self.storage_engine.extend_claims(
+                tasks, self.worker_id, self.settings.LEASE_SECONDS
+            )
+
+    async def _run_task(self, task):
+        """
+        Run a single task and remove or reschedule it afterwards. Tasks that
+        fail are retried later, or given up on.
+
+        :param pytasched.tasks.Task task:
+        """
+
+        self.logger.info("Running task {} for {}".format(task.id, task.task))
+
+        try:
+            await self.task_engine.run(task)
+        except Exception as error:
+            await self._fail(task, error)
+            return
+
+        if task.recurring:
+            task.attempts = 0
+            await self.storage_engine.reschedule(task, recur=True)
+        else:
+            await self.storage_engine.remove_task(task.id)
+
+    async def _fail(self, task, error):
+        """
+        Retry a task that failed after a backoff, or move it to the dead
+        letters once it has run out of attempts, see
+        pytasched.server.core.PytaschedServer._fail
+
+        :param pytasched.tasks.Task task:
+        :param Exception error: What running the task raised
+        """
+
+        # The task's own policy over the defaults
+        retry = {
+            "max_attempts": self.settings.MAX_ATTEMPTS,
+            "backoff": self.settings.RETRY_BACKOFF_SECONDS,
+            "max_backoff": self.settings.MAX_RETRY_BACKOFF_SECONDS,
+            "jitter": self.settings.RETRY_JITTER,
+        }
+        retry.update(task.get_retry() or {})
+
+        task.attempts += 1
+
+        if task.attempts >= retry["max_attempts"]:
+            self.logger.error(
+                "Task {} failed {} time(s), moving it to the dead letters".format(
+                    task.id, task.attempts
+                ),
+                exc_info=error,
+            )
+            await self.storage_engine.dead_letter_task(
+                task, "{}: {}".format(type(error).__name__, error)
+            )
+            return
+
+        delay = get_backoff(
+            task.attempts, retry["backoff"], retry["max_backoff"], retry["jitter"]
+        )
+
+        self.logger.warning(
+            "Task {} failed, attempt {} of {}, retrying in {:.1f}s".format(
+                task.id, task.attempts, retry["max_attempts"], delay
+            ),
+            exc_info=error,
+        )
+        await self.storage_engine.reschedule(task, delay=delay)
@@ -0,0 +1,107 @@
+from __future__ import division
+from __future__ import unicode_literals
+from builtins import object
+from heapq import heapify, heappop, heappush
+from itertools import count
+
+
+class TaskCache(object):
+    """
+    Min-heap of the tasks due within the next horizon seconds, so due tasks
+    can be found without asking the storage engine on every tick. The cached
+    tasks may be stale, so they need to be claimed or checked with
+    has_task_changed before running them.
+    """
+
+    def __init__(self, horizon, limit):
+        """
+        :param float horizon: How many seconds ahead to cache tasks for
+        :param int limit: Maximum number of tasks to cache
+        """
+        self.horizon = horizon
+        self.limit = limit
+        self.fetched_until = None
+        self.refresh_at = None
+        self._heap = []
+        self._counter = count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def is_stale(self, now):
+        """
+        Check if the cache should be refreshed
+
+        :param float now:
+        :return bool:
+        """
+        return self.fetched_until is None or now >= self.refresh_at
+
+    def refresh(self, tasks, now):
+        """
+        Replace the cached tasks
+
+        :param list tasks: All the tasks due before now + horizon, or the first
+                           limit of them, sorted by when
+        :param float now: When the tasks were fetched
+        """
+
+        until = now + self.horizon
+
+        if len(tasks) >= self.limit:
+            # Can't know about the tasks after the last one we got
+            until = tasks[-1].when
+
+        self._heap = [(task.when, next(self._counter), task) for task in tasks]
+        heapify(self._heap)
+
+        self.fetched_until = until
+        self.refresh_at = min(now + self.horizon / 2, until)
+
+    def invalidate(self):
+        """
+        Mark the cache to be refreshed before it's used next
+        """
+        self.fetched_until = None
+
+    def add(self, task):
+        """
+        Add a task to the cache, if it's within the cached time range
+
+        :param pytasched.tasks.Task task:
+        """
+
+        if self.fetched_until is not None and task.when < self.fetched_until:
+            heappush(self._heap, (task.when, next(self._counter), task))
+
+    def pop_due(self, now, limit):
+        """
+        Remove and return the tasks that are due
+
+        :param float now:
+        :param int limit: Maximum number of tasks to return
+        :return list:
+        """
+
+        tasks = []
+
+        while self._heap and len(tasks) < limit and self._heap[0][0] < now:
+            tasks.append(heappop(self._heap)[2])
+
+        return tasks
+
+    def get_next_when(self):
+        """
+        Get the time the next cached task is due, or when the cache should be
+        refreshed, whichever is first
+
+        :return float: 0 if the cache should be refreshed right away
+        """
+
+        if self.fetched_until is None:
+            return 0
+
+        if self._heap:
+            return min(self._heap[0][0], self.refresh_at)
+
+        return self.refresh_at
@@ -1,9 +1,22 @@
 from __future__ import unicode_literals
+import os
+import socket
 from builtins import object
-from pytasched.tools import TickManager
+from time import time
+from pytasched.tools import DueTimeWaiter, get_backoff
 from pytasched.engines import get_storage_engine, get_task_engine
 from pytasched.autoreload import set_logger, check, add_reload_hook
-from pytasched.locking import Lock
+from pytasched.locking import get_batch_locks
+from pytasched.server.adaptive import AdaptiveTick
+from pytasched.server.cache import TaskCache
+from pytasched.server.dispatch import LeaderElection
+from pytasched.server.executors import follow_future, get_executor, run_task
+from pytasched.server.metrics import (
+    InstrumentedStorageEngine,
+    MetricsServer,
+    SchedulerMetrics,
+)
+from pytasched.server.sharding import ShardMembership
 
 
 class _TaskChanged(Exception):
@@ -12,51 +25,295 @@ class _TaskChanged(Exception):
     pass
 
 
+def _earliest(*whens):
+    """
+    Get the earliest of the given times
+
+    :param whens: Times, None for not known
+    :return float|None: None if none of them are known
+    """
+    whens = [when for when in whens if when is not None]
+    return min(whens) if whens else None
+
+
+def _get_lock_name(task):
+    """
+    Get the name of the lock for running the task
+
+    :param pytasched.tasks.Task task:
+    :return str:
+    """
+    return "PyTaSched-Task-" + task.id
+
+
+def _get_worker_id():
+    """
+    Get a reasonably unique identifier for this server process
+
+    :return str:
+    """
+    return "{}-{}".format(socket.gethostname(), os.getpid())
+
+
 class PytaschedServer(object):
     """
     Main server process that monitors for tasks to run and runs them
     """
 
-    def __init__(self, settings, logger):
+    def __init__(self, settings, logger, storage_engine=None, task_engine=None):
+        """
+        :param module settings:
+        :param logging.Logger logger:
+        :param pytasched.engines.StorageEngine storage_engine: Use this engine
+            instead of the one configured in settings
+        :param pytasched.engines.TaskEngine task_engine: Use this engine
+            instead of the one configured in settings
+        """
         self.settings = settings
         self.logger = logger
-        self.storage_engine = None
-        self.task_engine = None
-        self.current_lock = None
+        self.storage_engine = storage_engine
+        self.task_engine = task_engine
+        self.executor = None
+        self.running = {}
+        self.batch_size = settings.BATCH_SIZE
+        self.batch_full = False
+        self.waiter = DueTimeWaiter(
+            settings.MIN_SECONDS_PER_TICK, settings.SECONDS_PER_TICK
+        )
+        self.cache = None
+        self.membership = None
+        self.election = None
+        self.dispatch_full = False
+        self.completing = False
+        self.locks = None
+        self.metrics = None
+        self.metrics_server = None
+        self.unlocked = []
+        self.next_lock_renewal = None
+        self.next_claim_renewal = None
+        self.worker_id = settings.WORKER_ID or _get_worker_id()
+
+        if settings.LOOKAHEAD_SECONDS:
+            self.cache = TaskCache(settings.LOOKAHEAD_SECONDS, settings.LOOKAHEAD_LIMIT)
+
+        self.adaptive = None
+        if settings.TARGET_LAG_SECONDS:
+            self.adaptive = AdaptiveTick(
+                settings.TARGET_LAG_SECONDS,
+                settings.MIN_SECONDS_PER_TICK,
+                settings.SECONDS_PER_TICK,
+                settings.BATCH_SIZE,
+                settings.MAX_BATCH_SIZE,
+            )
 
     def _setup(self):
         """
         Setup the server components
         """
 
-        self.logger.debug(
-            "Setting up storage engine {engine}".format(
-                engine=self.settings.STORAGE["engine"]
+        if not self.storage_engine:
+            self.logger.debug(
+                "Setting up storage engine {engine}".format(
+                    engine=self.settings.STORAGE["engine"]
+                )
             )
-        )
 
-        self.storage_engine = get_storage_engine()
+            self.storage_engine = get_storage_engine(self.settings)
+
+        if not self.task_engine:
+            self.logger.debug(
+                "Setting up task engine {engine}".format(
+                    engine=self.settings.TASKS["engine"]
+                )
+            )
+
+            self.task_engine = get_task_engine(self.settings)
 
         self.logger.debug(
-            "Setting up task engine {engine}".format(
-                engine=self.settings.TASKS["engine"]
+            "Setting up {mode} executor for up to {max} task(s)".format(
+                mode=self.settings.EXECUTOR, max=self.settings.MAX_CONCURRENCY
             )
         )
 
-        self.task_engine = get_task_engine()
+        self.executor = get_executor(
+            self.settings.EXECUTOR, self.settings.MAX_CONCURRENCY
+        )
+
+        if self.settings.METRICS_PORT is not None:
+            self._setup_metrics()
 
         self.storage_engine.set_logger(self.logger)
         self.task_engine.set_logger(self.logger)
+        self.storage_engine.add_listener(self.task_scheduled)
+
+        if self.settings.TOPOLOGY == "dispatcher":
+            if not self.storage_engine.supports_work_queue:
+                raise ValueError(
+                    "{} does not support the dispatcher TOPOLOGY".format(
+                        type(self.storage_engine).__name__
+                    )
+                )
+
+            self.storage_engine.setup_work_queue()
+            self.election = LeaderElection(
+                self.storage_engine,
+                self.worker_id,
+                self.settings.LEADER_LEASE_SECONDS,
+            )
+        elif self.settings.TOPOLOGY != "peers":
+            raise ValueError("Unknown TOPOLOGY {}".format(self.settings.TOPOLOGY))
+
+        shards = self.storage_engine.params.get("shards")
+        if shards and self.election:
+            raise ValueError("Shards can't be used with the dispatcher TOPOLOGY")
+
+        if shards:
+            if not self.storage_engine.supports_shards:
+                raise ValueError(
+                    "{} does not support shards".format(
+                        type(self.storage_engine).__name__
+                    )
+                )
+
+            self.membership = ShardMembership(
+                self.storage_engine,
+                self.worker_id,
+                shards,
+                self.settings.SHARD_HEARTBEAT_SECONDS,
+                self.settings.SHARD_MEMBER_TIMEOUT,
+            )
+
+        if self.settings.LOCKS and not self.settings.CLAIM_TASKS and not self.election:
+            self.locks = get_batch_locks(self.worker_id, self.settings.LOCK_TTL)
+
+        if self.storage_engine.watch():
+            self.logger.info("Watching for new tasks from the storage engine")
+
+        if self.settings.PREPARE_TASKS:
+            self._prepare_tasks()
 
         set_logger(self.logger)
         add_reload_hook(self.release_locks)
+        add_reload_hook(self.task_engine.clear_cache)
+
+    def _setup_metrics(self):
+        """
+        Start collecting metrics and serving them over HTTP
+        """
+
+        self.metrics = SchedulerMetrics()
+        self.storage_engine = InstrumentedStorageEngine(
+            self.storage_engine, self.metrics.storage_latency
+        )
+
+        self.metrics_server = MetricsServer(
+            self.metrics, self.settings.METRICS_HOST, self.settings.METRICS_PORT
+        )
+        self.metrics_server.start()
+        self._report_tick()
+
+        self.logger.info(
+            "Serving metrics on http://{}:{}/metrics".format(
+                *self.metrics_server.server_address[:2]
+            )
+        )
+
+    def _prepare_tasks(self):
+        """
+        Let the task engine get ready for all the scheduled tasks, e.g. load
+        the functions, so broken tasks are found now instead of when they're
+        due
+        """
+
+        names = self.storage_engine.get_task_names()
+        failed = self.task_engine.prepare(names)
+
+        if failed:
+            self.logger.error(
+                "{} of {} scheduled task name(s) can't be run: {}".format(
+                    len(failed), len(names), ", ".join(failed)
+                )
+            )
+        else:
+            self.logger.info("Prepared {} task name(s)".format(len(names)))
+
+    def task_scheduled(self, when):
+        """
+        Listener for the storage engine, called when a task is added or
+        rescheduled.
+
+        :param float|None when: When the task is scheduled for, None for now
+        """
+
+        # Our own reschedules are added to the cache as they're completed
+        cache = self.cache
+        if cache is not None and not self.completing and when is not None:
+            if cache.fetched_until is not None and when < cache.fetched_until:
+                cache.invalidate()
+
+        self.waiter.notify(when)
 
     def release_locks(self):
         """
         Release any lock being held
         """
-        if self.current_lock:
-            self.current_lock.unlock()
+        self.unlocked.extend(lock for task, lock in self.running.values() if lock)
+        self._release_unlocked()
+
+    def _release_unlocked(self):
+        """
+        Release the locks of the tasks that were completed or skipped, all
+        in one go
+        """
+
+        if self.unlocked:
+            unlocked, self.unlocked = self.unlocked, []
+            self.locks.release_many(unlocked)
+
+    def _renew_locks(self):
+        """
+        Keep the locks of long running tasks from expiring, if it's time to
+        do that
+        """
+
+        now = time()
+        if self.next_lock_renewal is not None and now < self.next_lock_renewal:
+            return
+
+        self.next_lock_renewal = now + self.settings.LOCK_TTL / 2.0
+        locked = [lock for task, lock in self.running.values() if lock]
+
+        if locked:
+            self.logger.debug("Renewing {} lock(s)".format(len(locked)))
+            self.locks.renew_many(locked)
+
+    def _uses_claims(self):
+        """
+        Check if the tasks we run are claimed from the storage engine, with
+        a lease, instead of locked
+
+        :return bool:
+        """
+        return bool(self.election or self.settings.CLAIM_TASKS)
+
+    def _extend_claims(self):
+        """
+        Keep the claims of long running tasks from expiring, so they aren't
+        run again by others, if it's time to do that
+        """
+
+        now = time()
+        if self.next_claim_renewal is not None and now < self.next_claim_renewal:
+            return
+
+        self.next_claim_renewal = now + self.settings.LEASE_SECONDS / 2.0
+        tasks = [task for task, lock in self.running.values()]
+
+        if tasks:
+            self.logger.debug("Extending {} claim(s)".format(len(tasks)))
+            self.storage_engine.extend_claims(
+                tasks, self.worker_id, self.settings.LEASE_SECONDS
+            )
 
     def run(self):
         """
@@ -65,50 +322,612 @@ class PytaschedServer(object):
 
         self._setup()
 
-        tm = TickManager(self.settings.SECONDS_PER_TICK)
+        self.logger.info("Waiting for tasks as {}...".format(self.worker_id))
+
+        try:
+            while self.waiter.running:
+                if self.settings.AUTORELOAD:
+                    check()
+
+                self.process_tasks()
+                self.waiter.wait(self._get_next_when())
+        finally:
+            self.shutdown()
+
+    def stop(self):
+        """
+        Stop the server after the current tick
+        """
+        self.waiter.stop()
+
+    def _get_next_when(self):
+        """
+        Figure out when we should look for tasks next
+
+        :return float|None: None if we should wait as long as possible
+        """
+
+        when = self._get_next_task_when()
+
+        if self.election:
+            when = _earliest(when, self._get_next_dispatch_when())
+
+        if self.membership:
+            # Heartbeats need to be sent on time, even when idle
+            when = _earliest(when, self.membership.next_heartbeat)
+
+        if self.locks and self.running:
+            when = _earliest(when, self.next_lock_renewal)
+
+        if self._uses_claims() and self.running:
+            when = _earliest(when, self.next_claim_renewal)
+
+        return when
+
+    def _get_next_task_when(self):
+        """
+        Figure out when we could have tasks to run next
+
+        :return float|None: None if we should wait as long as possible
+        """
+
+        if not self._get_free_slots():
+            # Finishing tasks wake us up
+            return None
+
+        if self.batch_full:
+            # There are likely more tasks waiting
+            return 0
+
+        if self.election:
+            # We don't know when tasks are queued for us, unless the storage
+            # engine notifies us
+            return None
+
+        if self.cache is not None:
+            return self.cache.get_next_when()
+
+        return self.storage_engine.get_next_when(**self._get_shard_filter())
+
+    def _get_next_dispatch_when(self):
+        """
+        Figure out when we should dispatch tasks or check the leadership next
+
+        :return float|None: None if we should wait as long as possible
+        """
+
+        if not self.election.is_leader:
+            return self.election.next_renewal
+
+        if self.dispatch_full:
+            return 0
+
+        return _earliest(
+            self.storage_engine.get_next_when(), self.election.next_renewal
+        )
+
+    def shutdown(self):
+        """
+        Wait for the running tasks to finish and complete them
+        """
+
+        if self.running:
+            self.logger.info(
+                "Waiting for {} running task(s) to finish".format(len(self.running))
+            )
+
+        self.storage_engine.unwatch()
+        self.executor.shutdown(wait=True)
+        self.task_engine.flush()
+
+        if self.membership:
+            self.membership.leave()
+
+        if self.election:
+            self.election.resign()
+
+        for future in list(self.running):
+            try:
+                self._complete(future)
+            except Exception:
+                self.logger.exception("Task failed while shutting down")
+
+        self.task_engine.close()
+
+        if self.locks:
+            self._release_unlocked()
+
+        if self.metrics_server:
+            self.metrics_server.stop()
+
+    def process_tasks(self):
+        """
+        Complete the tasks that have finished running, then find the tasks
+        that should be run and start running them, as long as there is room
+        in the executor.
+
+        :return int: Number of tasks that were started
+        """
+
+        try:
+            self.complete_finished()
+            self._update_shards()
+            self._dispatch_tasks()
+
+            limit = self._get_free_slots()
+            self.batch_full = False
+
+            if not limit:
+                self.logger.debug(
+                    "All {} slots are in use, not looking for tasks".format(
+                        len(self.running)
+                    )
+                )
+                return 0
+
+            if self.election:
+                started = self._process_queued_tasks(limit)
+            elif self.settings.CLAIM_TASKS:
+                started = self._process_claimed_tasks(limit)
+            else:
+                started = self._process_locked_tasks(limit)
+
+            self.batch_full = started >= limit
+            self._adapt(started)
+
+            return started
+        finally:
+            # Anything the task engine batched up this tick
+            self.task_engine.flush()
+
+            if self.locks:
+                # One round trip for all the locks no longer needed this tick
+                self._release_unlocked()
+                self._renew_locks()
+
+            if self._uses_claims():
+                self._extend_claims()
+
+    def _adapt(self, started):
+        """
+        Adapt the poll interval and batch size to how the tick went, if
+        enabled
+
+        :param int started: Number of tasks started this tick
+        """
+
+        backlog = self.batch_full or self.dispatch_full
 
-        self.logger.info("Waiting for tasks...")
+        if self.adaptive is None or not self.adaptive.update(started, backlog):
+            return
 
-        no_locks = not self.settings.LOCKS
-        lock = None
+        self.batch_size = self.adaptive.batch_size
+        self.waiter.max_wait = self.adaptive.seconds_per_tick
 
-        while tm.tick():
-            if self.settings.AUTORELOAD:
-                check()
+        slo = self.adaptive.get_slo_ratio()
+        self.logger.debug(
+            "Polling every {:.3f}s for up to {} task(s), {} on time".format(
+                self.adaptive.seconds_per_tick,
+                self.batch_size,
+                "n/a" if slo is None else "{:.1%}".format(slo),
+            )
+        )
+
+        self._report_tick()
+
+    def _report_tick(self):
+        """
+        Update the metrics for the poll interval and batch size
+        """
+
+        if self.metrics is not None:
+            self.metrics.seconds_per_tick.set(self.waiter.max_wait)
+            self.metrics.batch_size.set(self.batch_size)
+
+    def complete_finished(self):
+        """
+        Remove or reschedule the tasks that have finished running
+
+        :return int: Number of tasks completed
+        """
+
+        finished = [future for future in self.running if future.done()]
+
+        for future in finished:
+            self._complete(future)
+
+        return len(finished)
+
+    def _dispatch_tasks(self):
+        """
+        If we're the leader, claim the due tasks and put them in the work
+        queue for all the servers to take.
+
+        :return int: Number of tasks dispatched
+        """
+
+        if not self.election:
+            return 0
+
+        if self.election.update(time()):
+            if self.election.is_leader:
+                self.logger.info("Became the leader, dispatching tasks")
+            else:
+                self.logger.info("No longer the leader")
+
+        self.dispatch_full = False
+
+        if not self.election.is_leader:
+            return 0
+
+        tasks = self.storage_engine.claim_due_tasks(
+            self.worker_id, self.batch_size, self.settings.LEASE_SECONDS
+        )
+        queued = self.storage_engine.queue_tasks(tasks)
+
+        if queued:
+            self.logger.debug("Dispatched {} task(s)".format(queued))
+
+            if self.metrics is not None:
+                self.metrics.tasks_queued.inc(queued)
+
+        self.dispatch_full = len(tasks) >= self.batch_size
+
+        return queued
+
+    def _update_shards(self):
+        """
+        Keep our membership in the shards up to date, if shards are used
+        """
+
+        if not self.membership or not self.membership.update(time()):
+            return
+
+        self.logger.info(
+            "Now owning {} of {} shards, shared with {} server(s)".format(
+                len(self.membership.owned),
+                self.membership.shards,
+                len(self.membership.members),
+            )
+        )
+
+        if self.cache is not None:
+            self.cache.invalidate()
+
+    def _get_shard_filter(self):
+        """
+        Get the arguments for limiting storage engine queries to our shards
+
+        :return dict:
+        """
+
+        if self.membership:
+            return {"shards": self.membership.owned}
+
+        return {}
+
+    def _get_free_slots(self):
+        """
+        Get the number of tasks we can start running now
+
+        :return int:
+        """
+
+        if self.settings.EXECUTOR == "inline":
+            # Only task engines running tasks in the background leave any
+            # running here
+            return max(0, self.batch_size - len(self.running))
+
+        free = self.settings.MAX_CONCURRENCY - len(self.running)
+        return max(0, min(self.batch_size, free))
+
+    def _process_claimed_tasks(self, limit):
+        """
+        Claim due tasks from the storage engine and run them. The claim is
+        atomic in the storage engine so no separate locks are needed.
+
+        :param int limit: Maximum number of tasks to claim
+        :return int: Number of tasks that were started
+        """
+
+        if self.cache is not None:
+            tasks = self._claim_cached_tasks(limit)
+        else:
+            tasks = self.storage_engine.claim_due_tasks(
+                self.worker_id,
+                limit,
+                self.settings.LEASE_SECONDS,
+                **self._get_shard_filter()
+            )
+
+        if tasks:
+            self.logger.debug("Claimed {} task(s) to process".format(len(tasks)))
+
+            if self.metrics is not None:
+                self.metrics.tasks_due.inc(len(tasks))
+
+        for task in tasks:
+            self._run_task(task)
+
+        return len(tasks)
+
+    def _process_queued_tasks(self, limit):
+        """
+        Take tasks dispatched by the leader from the work queue and run them
+
+        :param int limit: Maximum number of tasks to take
+        :return int: Number of tasks that were started
+        """
+
+        tasks = self.storage_engine.take_queued_tasks(
+            self.worker_id, limit, self.settings.LEASE_SECONDS
+        )
+
+        if tasks:
+            self.logger.debug("Took {} task(s) to process".format(len(tasks)))
+
+            if self.metrics is not None:
+                self.metrics.tasks_due.inc(len(tasks))
+
+        for task in tasks:
+            self._run_task(task)
+
+        return len(tasks)
+
+    def _process_locked_tasks(self, limit):
+        """
+        Find due tasks from the storage engine and run the ones we can get a
+        lock for and that have not changed since they were loaded. The locks
+        for the whole page of tasks are acquired in one go.
 
-            tasks = self.storage_engine.get_task_list()
+        :param int limit: Maximum number of tasks to load
+        :return int: Number of tasks that were started
+        """
+
+        count = 0
 
-            if tasks:
-                self.logger.debug("Found {} task(s) to process".format(len(tasks)))
+        if self.cache is not None:
+            tasks = self._get_cached_tasks(limit)
+        else:
+            tasks = self.storage_engine.get_task_list(limit, **self._get_shard_filter())
 
-            for task in tasks:
-                name = "PyTaSched-Task-" + task.id
+        # Tasks still running from an earlier tick stay due until completed
+        running = set(task.id for task, lock in self.running.values())
+        tasks = [task for task in tasks if task.id not in running]
 
-                if not no_locks:
-                    lock = Lock(name)
+        if tasks:
+            self.logger.debug("Found {} task(s) to process".format(len(tasks)))
 
-                if no_locks or lock.acquire(False):
-                    try:
-                        if self.storage_engine.has_task_changed(task):
-                            raise _TaskChanged()
+            if self.metrics is not None:
+                self.metrics.tasks_due.inc(len(tasks))
 
-                        self.logger.info(
-                            "Running task {} for {}".format(task.id, task.task)
-                        )
+        acquired = None
+        if self.locks and tasks:
+            acquired = set(
+                self.locks.acquire_many([_get_lock_name(task) for task in tasks])
+            )
 
-                        self.task_engine.run(task)
+        for task in tasks:
+            lock = None
 
-                        if task.recurring:
-                            self.storage_engine.reschedule(task, recur=True)
-                        else:
-                            self.storage_engine.remove_task(task.id)
-                    except _TaskChanged:
-                        self.logger.debug(
-                            "Seems like task {} was changed, "
-                            "skipping for now".format(task.id)
-                        )
-                    finally:
-                        if not no_locks:
-                            lock.release()
-                else:
+            if acquired is not None:
+                lock = _get_lock_name(task)
+
+                if lock not in acquired:
                     self.logger.debug("Someone else is running task {}".format(task.id))
+
+                    if self.metrics is not None:
+                        self.metrics.lock_misses.inc()
+                    continue
+
+            try:
+                if self.storage_engine.has_task_changed(task):
+                    raise _TaskChanged()
+            except _TaskChanged:
+                self.logger.debug(
+                    "Seems like task {} was changed, "
+                    "skipping for now".format(task.id)
+                )
+                if self.metrics is not None:
+                    self.metrics.tasks_changed.inc()
+                if lock:
+                    self.unlocked.append(lock)
+                continue
+
+            # The lock is released once the task is completed
+            self._run_task(task, lock)
+            count += 1
+
+        return count
+
+    def _get_cached_tasks(self, limit):
+        """
+        Get the due tasks from the cache, refreshing it from the storage
+        engine first if needed. The tasks might have changed since.
+
+        :param int limit: Maximum number of tasks to get
+        :return list:
+        """
+
+        now = time()
+
+        if self.cache.is_stale(now):
+            tasks = self.storage_engine.get_task_list(
+                self.cache.limit,
+                until=now + self.cache.horizon,
+                **self._get_shard_filter()
+            )
+            self.cache.refresh(tasks, now)
+
+            self.logger.debug(
+                "Cached {} task(s) due in the next {}s".format(
+                    len(tasks), self.cache.horizon
+                )
+            )
+
+        return self.cache.pop_due(now, limit)
+
+    def _claim_cached_tasks(self, limit):
+        """
+        Claim the due tasks from the cache that have not changed since they
+        were cached.
+
+        :param int limit: Maximum number of tasks to claim
+        :return list: The claimed tasks
+        """
+
+        tasks = []
+
+        for task in self._get_cached_tasks(limit):
+            if self.storage_engine.claim_task(
+                task, self.worker_id, self.settings.LEASE_SECONDS
+            ):
+                tasks.append(task)
+            else:
+                self.logger.debug(
+                    "Seems like task {} was changed, skipping".format(task.id)
+                )
+
+                if self.metrics is not None:
+                    self.metrics.tasks_changed.inc()
+
+        return tasks
+
+    def _run_task(self, task, lock=None):
+        """
+        Start running a single task in the executor, it's completed once it
+        has finished running.
+
+        :param pytasched.tasks.Task task:
+        :param str lock: Name of the lock held for the task, if any
+        """
+
+        self.logger.info("Running task {} for {}".format(task.id, task.task))
+
+        start = time()
+        future = follow_future(self.executor.submit(run_task, self.task_engine, task))
+        self.running[future] = (task, lock)
+
+        if self.metrics is not None:
+            self._observe_task(task, future, start)
+
+        if self.adaptive is not None:
+            on_time = self.adaptive.observe(max(0.0, start - task.when))
+
+            if not on_time and self.metrics is not None:
+                self.metrics.tasks_late.inc()
+
+        if future.done():
+            self._complete(future)
+        else:
+            future.add_done_callback(lambda f: self.waiter.notify())
+
+    def _observe_task(self, task, future, start):
+        """
+        Record the metrics for a task that was started
+
+        :param pytasched.tasks.Task task:
+        :param concurrent.futures.Future future:
+        :param float start: When the task was started
+        """
+
+        self.metrics.tasks_dispatched.inc()
+        self.metrics.dispatch_lag.observe(max(0.0, start - task.when))
+
+        # Called right away if the task has already finished
+        future.add_done_callback(
+            lambda f: self.metrics.task_duration.observe(time() - start, task=task.task)
+        )
+
+    def _complete(self, future):
+        """
+        Remove or reschedule a task that has finished running. Tasks that
+        failed are retried later, or given up on.
+
+        :param concurrent.futures.Future future:
+        """
+
+        task, lock = self.running.pop(future)
+
+        try:
+            error = future.exception()
+
+            if error is not None:
+                self._fail(task, error)
+            elif task.recurring:
+                task.attempts = 0
+                self._reschedule(task, recur=True)
+            else:
+                self.storage_engine.remove_task(task.id)
+        finally:
+            if lock:
+                # Released at the end of the tick with the others
+                self.unlocked.append(lock)
+
+    def _fail(self, task, error):
+        """
+        Retry a task that failed after a backoff, or move it to the dead
+        letters once it has run out of attempts, so a broken task can't keep
+        the servers busy.
+
+        :param pytasched.tasks.Task task:
+        :param Exception error: What running the task raised
+        """
+
+        # The task's own policy over the defaults
+        retry = {
+            "max_attempts": self.settings.MAX_ATTEMPTS,
+            "backoff": self.settings.RETRY_BACKOFF_SECONDS,
+            "max_backoff": self.settings.MAX_RETRY_BACKOFF_SECONDS,
+            "jitter": self.settings.RETRY_JITTER,
+        }
+        retry.update(task.get_retry() or {})
+
+        task.attempts += 1
+
+        if self.metrics is not None:
+            self.metrics.tasks_failed.inc()
+
+        if task.attempts >= retry["max_attempts"]:
+            self.logger.error(
+                "Task {} failed {} time(s), moving it to the dead letters".format(
+                    task.id, task.attempts
+                ),
+                exc_info=error,
+            )
+            self.storage_engine.dead_letter_task(
+                task, "{}: {}".format(type(error).__name__, error)
+            )
+
+            if self.metrics is not None:
+                self.metrics.tasks_dead_lettered.inc()
+            return
+
+        delay = get_backoff(
+            task.attempts, retry["backoff"], retry["max_backoff"], retry["jitter"]
+        )
+
+        self.logger.warning(
+            "Task {} failed, attempt {} of {}, retrying in {:.1f}s".format(
+                task.id, task.attempts, retry["max_attempts"], delay
+            ),
+            exc_info=error,
+        )
+        self._reschedule(task, delay=delay)
+
+    def _reschedule(self, task, **kwargs):
+        """
+        Reschedule a task we've run, keeping it in the cache if there is one
+
+        :param pytasched.tasks.Task task:
+        :param kwargs: For the storage engine's reschedule
+        """
+
+        self.completing = True
+        try:
+            self.storage_engine.reschedule(task, **kwargs)
+        finally:
+            self.completing = False
+
+        if self.cache is not None:
+            self.cache.add(task)
@@ -0,0 +1,56 @@
+from __future__ import division
+from __future__ import unicode_literals
+from builtins import object
+
+
+class LeaderElection(object):
+    """
+    Keeps track of whether this server is the leader that dispatches due
+    tasks to the work queue. The leadership is a lease in the storage engine,
+    renewed a few times per lease so it does not expire while we're alive.
+    """
+
+    def __init__(self, storage_engine, worker_id, lease_seconds):
+        """
+        :param pytasched.engines.StorageEngine storage_engine:
+        :param str worker_id: Identifier of this server
+        :param float lease_seconds: How long the leadership lasts if the
+                                    leader stops renewing it
+        """
+        self.storage_engine = storage_engine
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.is_leader = False
+        self.next_renewal = None
+
+    def update(self, now):
+        """
+        Try to become or stay the leader, if it's time to do that.
+
+        :param float now:
+        :return bool: If the leadership changed
+        """
+
+        if self.next_renewal is not None and now < self.next_renewal:
+            return False
+
+        # Renew well before the lease expires
+        self.next_renewal = now + self.lease_seconds / 3
+
+        was_leader = self.is_leader
+        self.is_leader = self.storage_engine.acquire_leadership(
+            self.worker_id, self.lease_seconds
+        )
+
+        return self.is_leader != was_leader
+
+    def resign(self):
+        """
+        Let someone else become the leader
+        """
+
+        if self.is_leader:
+            self.storage_engine.release_leadership(self.worker_id)
+
+        self.is_leader = False
+        self.next_renewal = None
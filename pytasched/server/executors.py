@@ -0,0 +1,95 @@
+from __future__ import unicode_literals
+from builtins import object
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+EXECUTORS = ("inline", "thread", "process")
+
+
+class InlineExecutor(object):
+    """
+    Executor that runs everything immediately in the calling thread, for when
+    tasks should not run concurrently.
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Run the function and return an already finished future
+
+        :return concurrent.futures.Future:
+        """
+
+        future = Future()
+
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+
+        return future
+
+    def shutdown(self, wait=True):
+        """
+        Nothing to clean up
+        """
+        pass
+
+
+def get_executor(mode, max_concurrency):
+    """
+    Get an executor for running tasks
+
+    :param str mode: One of EXECUTORS
+    :param int max_concurrency: Maximum number of tasks to run at once
+    :raises ValueError: In case the mode is not supported
+    :return concurrent.futures.Executor:
+    """
+
+    if mode == "inline":
+        return InlineExecutor()
+    elif mode == "thread":
+        return ThreadPoolExecutor(max_workers=max_concurrency)
+    elif mode == "process":
+        return ProcessPoolExecutor(max_workers=max_concurrency)
+
+    raise ValueError('Executor "{}" is not supported'.format(mode))
+
+
+def run_task(task_engine, task):
+    """
+    Run the task with the task engine, a plain function so it can be sent to
+    process pools.
+
+    :param pytasched.engines.TaskEngine task_engine:
+    :param pytasched.tasks.Task task:
+    :return: What the task engine returned, which can be a future if the task
+             engine runs the task in the background
+    """
+    return task_engine.run(task)
+
+
+def follow_future(future):
+    """
+    Get a future that finishes when the task has finished. If the task
+    engine returned a future of its own, that's followed too.
+
+    :param concurrent.futures.Future future: From submitting run_task
+    :return concurrent.futures.Future:
+    """
+
+    followed = Future()
+
+    def _done(f):
+        try:
+            result = f.result()
+        except Exception as e:
+            followed.set_exception(e)
+            return
+
+        if isinstance(result, Future):
+            result.add_done_callback(_done)
+        else:
+            followed.set_result(result)
+
+    future.add_done_callback(_done)
+
+    return followed
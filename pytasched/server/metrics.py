@@ -0,0 +1,412 @@
+from __future__ import unicode_literals
+from builtins import object
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from threading import Lock, Thread
+from time import time
+
+# Seconds, for storage engine calls
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# Seconds, for how late tasks start and how long they run
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_value(value):
+    """
+    Format a sample value in the Prometheus text format
+
+    :param float value:
+    :return str:
+    """
+
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value))
+
+
+def _format_labels(names, values):
+    """
+    Format the labels of a sample in the Prometheus text format
+
+    :param tuple names:
+    :param tuple values:
+    :return str: Empty if there are no labels
+    """
+
+    if not names:
+        return ""
+
+    def escape(value):
+        value = "{}".format(value)
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{{{}}}".format(
+        ",".join(
+            '{}="{}"'.format(name, escape(value)) for name, value in zip(names, values)
+        )
+    )
+
+
+class Metric(object):
+    """
+    A metric with a value for each combination of label values
+    """
+
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        """
+        :param str name: Name of the metric
+        :param str help: Description of the metric
+        :param tuple labels: Names of the labels
+        """
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = Lock()
+
+    def _get_key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(
+                "{} needs labels {}, got {}".format(
+                    self.name, ", ".join(self.labels), ", ".join(sorted(labels))
+                )
+            )
+
+        return tuple(labels[name] for name in self.labels)
+
+    def render(self):
+        """
+        Render the metric in the Prometheus text format
+
+        :return list: Lines
+        """
+
+        lines = [
+            "# HELP {} {}".format(self.name, self.help),
+            "# TYPE {} {}".format(self.name, self.type),
+        ]
+
+        with self._lock:
+            values = sorted(self._values.items())
+
+        for key, value in values:
+            lines.extend(self._render_value(key, value))
+
+        return lines
+
+    def _render_value(self, key, value):
+        yield "{}{} {}".format(
+            self.name, _format_labels(self.labels, key), _format_value(value)
+        )
+
+
+class Counter(Metric):
+    """
+    A count of things that have happened
+    """
+
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        """
+        Count things that happened
+
+        :param float amount:
+        :param labels: Values for the labels
+        """
+
+        key = self._get_key(labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        """
+        :param labels: Values for the labels
+        :return float: The current count
+        """
+        return self._values.get(self._get_key(labels), 0)
+
+
+class Gauge(Metric):
+    """
+    A value that can go up and down
+    """
+
+    type = "gauge"
+
+    def set(self, value, **labels):
+        """
+        :param float value:
+        :param labels: Values for the labels
+        """
+
+        key = self._get_key(labels)
+
+        with self._lock:
+            self._values[key] = value
+
+    def get(self, **labels):
+        """
+        :param labels: Values for the labels
+        :return float|None: The current value, None if not set
+        """
+        return self._values.get(self._get_key(labels))
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values in cumulative buckets
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        """
+        :param str name: Name of the metric
+        :param str help: Description of the metric
+        :param tuple labels: Names of the labels
+        :param tuple buckets: Upper bounds of the buckets
+        """
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        """
+        Record an observed value
+
+        :param float value:
+        :param labels: Values for the labels
+        """
+
+        key = self._get_key(labels)
+
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+
+            self._values[key] = (counts, total + value)
+
+    def get_count(self, **labels):
+        """
+        :param labels: Values for the labels
+        :return int: Number of observed values
+        """
+
+        value = self._values.get(self._get_key(labels))
+        return value[0][-1] if value else 0
+
+    def _render_value(self, key, value):
+        counts, total = value
+        bucket_labels = self.labels + ("le",)
+
+        for bound, count in zip(self.buckets, counts):
+            yield "{}_bucket{} {}".format(
+                self.name,
+                _format_labels(bucket_labels, key + (_format_value(bound),)),
+                _format_value(count),
+            )
+
+        labels = _format_labels(self.labels, key)
+        yield "{}_sum{} {}".format(self.name, labels, _format_value(total))
+        yield "{}_count{} {}".format(self.name, labels, _format_value(counts[-1]))
+
+
+class Registry(object):
+    """
+    Collection of metrics to expose together
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help, labels=()):
+        """
+        Add a counter
+
+        :return Counter:
+        """
+
+        metric = Counter(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help, labels=()):
+        """
+        Add a gauge
+
+        :return Gauge:
+        """
+
+        metric = Gauge(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        """
+        Add a histogram
+
+        :return Histogram:
+        """
+
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        Render all the metrics in the Prometheus text format
+
+        :return str:
+        """
+
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+
+        return "\n".join(lines) + "\n"
+
+
+class SchedulerMetrics(Registry):
+    """
+    The metrics of the server internals
+    """
+
+    def __init__(self):
+        super(SchedulerMetrics, self).__init__()
+
+        self.tasks_due = self.counter(
+            "pytasched_tasks_due_total", "Due tasks found, claimed or taken"
+        )
+        self.tasks_dispatched = self.counter(
+            "pytasched_tasks_dispatched_total", "Tasks started running"
+        )
+        self.tasks_queued = self.counter(
+            "pytasched_tasks_queued_total", "Tasks put in the work queue as leader"
+        )
+        self.tasks_changed = self.counter(
+            "pytasched_tasks_changed_total",
+            "Tasks skipped because they changed since they were loaded",
+        )
+        self.lock_misses = self.counter(
+            "pytasched_lock_misses_total", "Tasks skipped because of a held lock"
+        )
+        self.tasks_failed = self.counter(
+            "pytasched_tasks_failed_total", "Task runs that raised an error"
+        )
+        self.tasks_dead_lettered = self.counter(
+            "pytasched_tasks_dead_lettered_total",
+            "Tasks moved to the dead letters after running out of attempts",
+        )
+        self.tasks_late = self.counter(
+            "pytasched_tasks_late_total",
+            "Tasks started later than TARGET_LAG_SECONDS after they were due",
+        )
+        self.seconds_per_tick = self.gauge(
+            "pytasched_seconds_per_tick", "Longest interval between polls"
+        )
+        self.batch_size = self.gauge(
+            "pytasched_batch_size", "Largest number of tasks to get per tick"
+        )
+        self.dispatch_lag = self.histogram(
+            "pytasched_dispatch_lag_seconds",
+            "How late tasks started compared to when they were due",
+            buckets=DURATION_BUCKETS,
+        )
+        self.task_duration = self.histogram(
+            "pytasched_task_run_seconds",
+            "How long tasks took to run",
+            labels=("task",),
+            buckets=DURATION_BUCKETS,
+        )
+        self.storage_latency = self.histogram(
+            "pytasched_storage_call_seconds",
+            "Latency of storage engine calls",
+            labels=("method",),
+        )
+
+
+class InstrumentedStorageEngine(object):
+    """
+    Storage engine proxy that measures the latency of the public methods
+    """
+
+    def __init__(self, engine, histogram):
+        """
+        :param pytasched.engines.StorageEngine engine:
+        :param Histogram histogram: Histogram with a "method" label
+        """
+        self.engine = engine
+        self.histogram = histogram
+
+    def __getattr__(self, item):
+        attr = getattr(self.engine, item)
+
+        if item.startswith("_") or not callable(attr):
+            return attr
+
+        def _call(*args, **kwargs):
+            start = time()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                self.histogram.observe(time() - start, method=item)
+
+        return _call
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = self.server.registry.render().encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", "{}".format(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes would flood the logs
+        pass
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    """
+    HTTP server for scraping the metrics, on any path
+    """
+
+    daemon_threads = True
+
+    def __init__(self, registry, host, port):
+        """
+        :param Registry registry:
+        :param str host: Address to listen on
+        :param int port: Port to listen on, 0 for any free port
+        """
+        HTTPServer.__init__(self, (host, port), _MetricsHandler)
+        self.registry = registry
+
+    def start(self):
+        """
+        Start serving in a background thread
+        """
+
+        thread = Thread(target=self.serve_forever, name="pytasched-metrics")
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        """
+        Stop serving and close the socket
+        """
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,90 @@
+from __future__ import unicode_literals
+from builtins import object
+from hashlib import md5
+
+
+def get_owned_shards(worker_id, members, shards):
+    """
+    Figure out which shards the worker owns with rendezvous hashing, each
+    shard is owned by the member with the highest hash for it. When a member
+    joins or leaves only the shards it gains or loses move.
+
+    :param str worker_id: Identifier of the worker
+    :param list members: Identifiers of all the workers sharing the shards
+    :param int shards: Number of shards
+    :return list: The shards owned by the worker
+    """
+
+    def weight(member, shard):
+        key = "{}:{}".format(member, shard).encode("utf-8")
+        return md5(key).hexdigest()
+
+    return [
+        shard
+        for shard in range(shards)
+        if max(members, key=lambda member: weight(member, shard)) == worker_id
+    ]
+
+
+class ShardMembership(object):
+    """
+    Keeps track of the servers sharing the shards via heartbeats in the
+    storage engine, and the shards this server owns. Ownership changes as
+    servers join and leave, for a moment two servers may think they own the
+    same shard, but claiming the tasks is still atomic.
+    """
+
+    def __init__(self, storage_engine, worker_id, shards, interval, timeout):
+        """
+        :param pytasched.engines.StorageEngine storage_engine:
+        :param str worker_id: Identifier of this server
+        :param int shards: Number of shards
+        :param float interval: Seconds between heartbeats
+        :param float timeout: Seconds without a heartbeat until a server is
+                              considered gone
+        """
+        self.storage_engine = storage_engine
+        self.worker_id = worker_id
+        self.shards = shards
+        self.interval = interval
+        self.timeout = timeout
+        self.members = []
+        self.owned = []
+        self.next_heartbeat = None
+
+    def update(self, now):
+        """
+        Send a heartbeat and check for servers joining and leaving, if it's
+        time to do that.
+
+        :param float now:
+        :return bool: If the owned shards changed
+        """
+
+        if self.next_heartbeat is not None and now < self.next_heartbeat:
+            return False
+
+        self.storage_engine.heartbeat(self.worker_id, self.timeout)
+        self.next_heartbeat = now + self.interval
+
+        members = sorted(set(self.storage_engine.get_members()) | {self.worker_id})
+
+        if members == self.members:
+            return False
+
+        self.members = members
+        owned = get_owned_shards(self.worker_id, members, self.shards)
+
+        changed = owned != self.owned
+        self.owned = owned
+
+        return changed
+
+    def leave(self):
+        """
+        Let the others take over our shards
+        """
+        self.storage_engine.leave(self.worker_id)
+        self.members = []
+        self.owned = []
+        self.next_heartbeat = None
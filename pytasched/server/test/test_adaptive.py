@@ -0,0 +1,61 @@
+from __future__ import unicode_literals
+
+from unittest import TestCase
+
+from pytasched.server.adaptive import AdaptiveTick
+
+
+class TestAdaptiveTick(TestCase):
+    def setUp(self):
+        self.tick = AdaptiveTick(1.0, 0.05, 1.0, 10, 100)
+
+    def test_speed_up_when_behind(self):
+        self.assertEqual(self.tick.seconds_per_tick, 1.0)
+        self.assertEqual(self.tick.batch_size, 10)
+
+        # More due tasks than fit in the batch
+        self.assertTrue(self.tick.update(10, True))
+        self.assertEqual(self.tick.seconds_per_tick, 0.5)
+        self.assertEqual(self.tick.batch_size, 20)
+
+        # Tasks starting late
+        self.assertFalse(self.tick.observe(2.0))
+        self.assertTrue(self.tick.update(1, False))
+        self.assertEqual(self.tick.seconds_per_tick, 0.25)
+        self.assertEqual(self.tick.batch_size, 40)
+
+        # Up to the bounds
+        for _ in range(10):
+            self.tick.update(40, True)
+
+        self.assertEqual(self.tick.seconds_per_tick, 0.05)
+        self.assertEqual(self.tick.batch_size, 100)
+        self.assertFalse(self.tick.update(100, True))
+
+    def test_back_off_when_idle(self):
+        for _ in range(10):
+            self.tick.update(40, True)
+
+        # Keeping up, nothing changes
+        self.assertTrue(self.tick.observe(0.5))
+        self.assertFalse(self.tick.update(5, False))
+
+        self.assertTrue(self.tick.update(0, False))
+        self.assertEqual(self.tick.seconds_per_tick, 0.0625)
+        self.assertEqual(self.tick.batch_size, 80)
+
+        for _ in range(50):
+            self.tick.update(0, False)
+
+        self.assertEqual(self.tick.seconds_per_tick, 1.0)
+        self.assertEqual(self.tick.batch_size, 10)
+
+    def test_slo_ratio(self):
+        self.assertIsNone(self.tick.get_slo_ratio())
+
+        self.tick.observe(0.1)
+        self.tick.observe(0.2)
+        self.tick.observe(0.3)
+        self.tick.observe(3.0)
+
+        self.assertEqual(self.tick.get_slo_ratio(), 0.75)
@@ -0,0 +1,162 @@
+from __future__ import unicode_literals
+
+import asyncio
+import logging
+from builtins import object
+from time import time
+from unittest import TestCase
+
+from pytasched.aioengines import AsyncMemoryStorageEngine, AsyncTaskEngine
+from pytasched.server import AsyncPytaschedServer
+from pytasched.tasks import Task
+
+
+class _Settings(object):
+    LEASE_SECONDS = 300.0
+    BATCH_SIZE = 100
+    MAX_IN_FLIGHT = 2
+    WORKER_ID = "test-worker"
+    AUTORELOAD = False
+    SECONDS_PER_TICK = 1.0
+    MIN_SECONDS_PER_TICK = 0.05
+    MAX_ATTEMPTS = 3
+    RETRY_BACKOFF_SECONDS = 0.0
+    MAX_RETRY_BACKOFF_SECONDS = 0.0
+    RETRY_JITTER = 0.0
+
+
+class _BlockingTaskEngine(AsyncTaskEngine):
+    def __init__(self):
+        super(_BlockingTaskEngine, self).__init__({})
+        self.event = asyncio.Event()
+        self.started = []
+
+    async def run(self, task):
+        self.started.append(task.task)
+        await self.event.wait()
+
+
+class _FailingTaskEngine(AsyncTaskEngine):
+    def __init__(self):
+        super(_FailingTaskEngine, self).__init__({})
+        self.runs = 0
+
+    async def run(self, task):
+        self.runs += 1
+        raise ValueError("broken")
+
+
+class TestAsyncPytaschedServer(TestCase):
+    def test_process_tasks(self):
+        async def _test():
+            storage_engine = AsyncMemoryStorageEngine({})
+            task_engine = _BlockingTaskEngine()
+
+            for i in range(3):
+                await storage_engine.add_task(Task(str(i), when=time() - 1))
+
+            server = AsyncPytaschedServer(
+                _Settings(),
+                logging.getLogger(__name__),
+                storage_engine=storage_engine,
+                task_engine=task_engine,
+            )
+            server._setup()
+
+            # Only MAX_IN_FLIGHT tasks are claimed at a time
+            self.assertEqual(await server.process_tasks(), 2)
+            await asyncio.sleep(0)
+            self.assertEqual(task_engine.started, ["0", "1"])
+            self.assertEqual(await server.process_tasks(), 0)
+
+            task_engine.event.set()
+            await server.shutdown()
+            await asyncio.sleep(0)
+
+            self.assertEqual(len(server.running), 0)
+            self.assertEqual(await server.process_tasks(), 1)
+            await server.shutdown()
+            self.assertEqual(await storage_engine.get_task_list(), [])
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(_test())
+        finally:
+            loop.close()
+
+    def test_extend_claims(self):
+        async def _test():
+            storage_engine = AsyncMemoryStorageEngine({})
+            task_engine = _BlockingTaskEngine()
+
+            await storage_engine.add_task(Task("slow", when=time() - 1))
+
+            settings = _Settings()
+            settings.LEASE_SECONDS = 0.2
+
+            server = AsyncPytaschedServer(
+                settings,
+                logging.getLogger(__name__),
+                storage_engine=storage_engine,
+                task_engine=task_engine,
+            )
+            server._setup()
+
+            self.assertEqual(await server.process_tasks(), 1)
+            self.assertLessEqual(
+                await server._get_next_when(), server.next_claim_renewal
+            )
+
+            # Renewed every half lease, so it's never claimed again
+            for i in range(3):
+                await asyncio.sleep(0.15)
+                self.assertEqual(await server.process_tasks(), 0)
+
+            self.assertEqual(task_engine.started, ["slow"])
+
+            task_engine.event.set()
+            await server.shutdown()
+            self.assertEqual(await storage_engine.get_task_list(), [])
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(_test())
+        finally:
+            loop.close()
+
+    def test_failing_task(self):
+        async def _test():
+            storage_engine = AsyncMemoryStorageEngine({})
+            task_engine = _FailingTaskEngine()
+
+            id = await storage_engine.add_task(Task("broken", when=time() - 1))
+
+            server = AsyncPytaschedServer(
+                _Settings(),
+                logging.getLogger(__name__),
+                storage_engine=storage_engine,
+                task_engine=task_engine,
+            )
+            server._setup()
+
+            # Retried right away with no backoff, until out of attempts
+            for attempts in range(1, 4):
+                self.assertEqual(await server.process_tasks(), 1)
+                await server.shutdown()
+                self.assertEqual(task_engine.runs, attempts)
+                await asyncio.sleep(0.01)
+
+            self.assertEqual(await server.process_tasks(), 0)
+            self.assertEqual(await storage_engine.get_task_list(), [])
+
+            letters = await storage_engine.get_dead_letters()
+            self.assertEqual(len(letters), 1)
+            self.assertEqual(letters[0].task.id, id)
+            self.assertEqual(letters[0].task.attempts, 3)
+            self.assertEqual(letters[0].error, "ValueError: broken")
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(_test())
+        finally:
+            loop.close()
@@ -0,0 +1,38 @@
+from __future__ import unicode_literals
+from unittest import TestCase
+
+from pytasched.server.cache import TaskCache
+from pytasched.tasks import Task
+
+
+class TestTaskCache(TestCase):
+    def test_cache(self):
+        cache = TaskCache(60, 100)
+        self.assertTrue(cache.is_stale(1000))
+        self.assertEqual(cache.get_next_when(), 0)
+
+        cache.refresh([Task("a", when=1010), Task("b", when=1020)], 1000)
+        self.assertFalse(cache.is_stale(1000))
+        self.assertTrue(cache.is_stale(1030))
+        self.assertEqual(cache.fetched_until, 1060)
+        self.assertEqual(cache.get_next_when(), 1010)
+
+        # Out of range tasks are not cached
+        cache.add(Task("c", when=1005))
+        cache.add(Task("late", when=1070))
+        self.assertEqual(len(cache), 3)
+
+        self.assertEqual([t.task for t in cache.pop_due(1015, 10)], ["c", "a"])
+        self.assertEqual(cache.pop_due(1015, 10), [])
+        self.assertEqual(cache.get_next_when(), 1020)
+
+        cache.invalidate()
+        self.assertTrue(cache.is_stale(1015))
+
+    def test_limit(self):
+        cache = TaskCache(60, 2)
+        cache.refresh([Task("a", when=1010), Task("b", when=1020)], 1000)
+
+        # There might be more tasks after the last one we got
+        self.assertEqual(cache.fetched_until, 1020)
+        self.assertEqual(cache.refresh_at, 1020)
@@ -1,6 +1,559 @@
 from __future__ import unicode_literals
+
+import logging
+import threading
+from builtins import object
+from concurrent.futures import Future
+from time import sleep, time
+from unittest import TestCase
+
+import mongomock
+from mock import Mock, patch
+
+from pytasched.engines import (
+    MemoryStorageEngine,
+    MongoDBStorageEngine,
+    ShellTaskEngine,
+    TaskEngine,
+)
+from pytasched.errors import TaskEngineError
+from pytasched.locking import MongoBatchLocks
 from pytasched.server import PytaschedServer
+from pytasched.tasks import Task
+
+
+class _Settings(object):
+    CLAIM_TASKS = True
+    LEASE_SECONDS = 300.0
+    BATCH_SIZE = 100
+    WORKER_ID = "test-worker"
+    EXECUTOR = "inline"
+    MAX_CONCURRENCY = 4
+    LOCKS = False
+    LOCK_TTL = 300.0
+    METRICS_PORT = None
+    METRICS_HOST = "127.0.0.1"
+    TARGET_LAG_SECONDS = None
+    MAX_BATCH_SIZE = 1000
+    PREPARE_TASKS = False
+    MAX_ATTEMPTS = 5
+    RETRY_BACKOFF_SECONDS = 10.0
+    MAX_RETRY_BACKOFF_SECONDS = 3600.0
+    RETRY_JITTER = 0.5
+    AUTORELOAD = False
+    SECONDS_PER_TICK = 1.0
+    MIN_SECONDS_PER_TICK = 0.05
+    LOOKAHEAD_SECONDS = None
+    LOOKAHEAD_LIMIT = 10000
+    SHARD_HEARTBEAT_SECONDS = 5.0
+    SHARD_MEMBER_TIMEOUT = 20.0
+    TOPOLOGY = "peers"
+    LEADER_LEASE_SECONDS = 15.0
+
+
+class _BatchingTaskEngine(TaskEngine):
+    """
+    Finishes the tasks when flushed, like CeleryTaskEngine
+    """
+
+    def __init__(self):
+        super(_BatchingTaskEngine, self).__init__({})
+        self.pending = []
+        self.batches = []
+
+    def run(self, task):
+        future = Future()
+        self.pending.append((task, future))
+        return future
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        if pending:
+            self.batches.append([task.task for task, _ in pending])
+
+        for task, future in pending:
+            future.set_result(task.task)
 
 
 def test_PytaschedServer():
     assert PytaschedServer is not None
+
+
+class TestPytaschedServer(TestCase):
+    def setUp(self):
+        client = mongomock.MongoClient()
+        self.storage_engine = MongoDBStorageEngine(
+            {"collection": "tasks"}, db=client.blidz
+        )
+        self.task_engine = Mock()
+        self.settings = _Settings()
+
+    def _get_server(self):
+        server = PytaschedServer(
+            self.settings,
+            logging.getLogger(__name__),
+            storage_engine=self.storage_engine,
+            task_engine=self.task_engine,
+        )
+        server._setup()
+        return server
+
+    def test_process_claimed_tasks(self):
+        now = time()
+        self.storage_engine.add_task(Task("once", when=now - 1))
+        recurring_id = self.storage_engine.add_task(
+            Task("recurring", when=now - 1, seconds=60, recurring=True)
+        )
+        self.storage_engine.add_task(Task("later", seconds=60))
+
+        server = self._get_server()
+        self.assertEqual(server.process_tasks(), 2)
+        self.assertEqual(self.task_engine.run.call_count, 2)
+
+        # The one-off task is gone and the recurring one got rescheduled
+        self.assertEqual(self.storage_engine._get_collection().count_documents({}), 2)
+        self.assertEqual(self.storage_engine.get_task(recurring_id).when, now + 59)
+
+        self.assertEqual(server.process_tasks(), 0)
+
+    def test_extend_claims(self):
+        self.settings.EXECUTOR = "thread"
+        self.settings.LEASE_SECONDS = 60.0
+        task_id = self.storage_engine.add_task(Task("slow", when=time() - 1))
+
+        proceed = threading.Event()
+        self.task_engine.run = Mock(side_effect=lambda task: proceed.wait(5))
+
+        server = self._get_server()
+        self.assertEqual(server.process_tasks(), 1)
+
+        # Still running when the lease is about to expire
+        now = time()
+        self.storage_engine._get_now = Mock(return_value=now + 50)
+        server.next_claim_renewal = None
+        server.process_tasks()
+        self.assertEqual(self.storage_engine.get_task(task_id).when, now + 110)
+
+        self.storage_engine._get_now = Mock(return_value=now + 70)
+        self.assertEqual(self.storage_engine.claim_due_tasks("other", 1, 60), [])
+
+        proceed.set()
+        server.shutdown()
+        self.assertEqual(self.task_engine.run.call_count, 1)
+
+    def test_process_locked_tasks(self):
+        self.settings.CLAIM_TASKS = False
+        self.storage_engine.add_task(Task("once", when=1))
+
+        server = self._get_server()
+        self.assertEqual(server.process_tasks(), 1)
+        self.assertEqual(self.task_engine.run.call_count, 1)
+        self.assertEqual(server.process_tasks(), 0)
+
+    def test_process_running_locked_tasks(self):
+        self.settings.CLAIM_TASKS = False
+        self.settings.EXECUTOR = "thread"
+        self.storage_engine.add_task(Task("slow", when=1))
+
+        proceed = threading.Event()
+        self.task_engine.run = Mock(side_effect=lambda task: proceed.wait(5))
+
+        # The task stays due while it runs, but isn't started again
+        server = self._get_server()
+        self.assertEqual(server.process_tasks(), 1)
+        for _ in range(3):
+            self.assertEqual(server.process_tasks(), 0)
+
+        proceed.set()
+        server.shutdown()
+        self.assertEqual(self.task_engine.run.call_count, 1)
+
+    def test_process_batch_locked_tasks(self):
+        self.settings.CLAIM_TASKS = False
+        self.settings.LOCKS = "shylock"
+        self.settings.EXECUTOR = "thread"
+        collection = mongomock.MongoClient().pytasched.pytasched_locks
+
+        for i in range(3):
+            self.storage_engine.add_task(Task("task-{}".format(i), when=time() - 1))
+
+        proceed = threading.Event()
+        self.task_engine.run = Mock(side_effect=lambda task: proceed.wait(5))
+
+        def _get_batch_locks(owner, ttl):
+            locks = MongoBatchLocks(owner, ttl, collection)
+            locks.acquire_many = Mock(side_effect=locks.acquire_many)
+            locks.release_many = Mock(side_effect=locks.release_many)
+            return locks
+
+        with patch("pytasched.server.core.get_batch_locks", _get_batch_locks):
+            server = self._get_server()
+            self.settings.WORKER_ID = "other-worker"
+            other = self._get_server()
+
+        self.assertEqual(server.process_tasks(), 3)
+        self.assertEqual(server.locks.acquire_many.call_count, 1)
+        self.assertEqual(collection.count_documents({"owner": "test-worker"}), 3)
+
+        # The tasks are still due, but locked by the first server
+        self.assertEqual(other.process_tasks(), 0)
+        self.assertEqual(self.task_engine.run.call_count, 3)
+
+        proceed.set()
+        server.shutdown()
+
+        # All the locks are released in one go
+        self.assertEqual(server.locks.release_many.call_count, 1)
+        self.assertEqual(collection.count_documents({}), 0)
+
+    def test_metrics(self):
+        self.settings.METRICS_PORT = 0
+        self.storage_engine.add_task(Task("once", when=time() - 10))
+        self.storage_engine.add_task(Task("later", seconds=60))
+
+        server = self._get_server()
+        self.assertEqual(server.process_tasks(), 1)
+        server.shutdown()
+
+        metrics = server.metrics
+        self.assertEqual(metrics.tasks_due.get(), 1)
+        self.assertEqual(metrics.tasks_dispatched.get(), 1)
+        self.assertEqual(metrics.task_duration.get_count(task="once"), 1)
+        self.assertEqual(metrics.storage_latency.get_count(method="remove_task"), 1)
+
+        # The task was 10 seconds late
+        self.assertIn(
+            'pytasched_dispatch_lag_seconds_bucket{le="5.0"} 0.0', metrics.render()
+        )
+        self.assertIn(
+            'pytasched_dispatch_lag_seconds_bucket{le="30.0"} 1.0', metrics.render()
+        )
+
+    def test_adaptive_tick(self):
+        self.settings.TARGET_LAG_SECONDS = 1.0
+        self.settings.BATCH_SIZE = 2
+        self.settings.METRICS_PORT = 0
+
+        for i in range(10):
+            self.storage_engine.add_task(Task("task-{}".format(i), when=time() - 0.5))
+
+        server = self._get_server()
+
+        # Behind, so the batches grow and polling speeds up
+        self.assertEqual(server.process_tasks(), 2)
+        self.assertEqual(server.batch_size, 4)
+        self.assertEqual(server.waiter.max_wait, 0.5)
+        self.assertEqual(server.process_tasks(), 4)
+        self.assertEqual(server.process_tasks(), 4)
+        self.assertEqual(server.adaptive.get_slo_ratio(), 1.0)
+
+        # Idle, so backing off again
+        for _ in range(20):
+            self.assertEqual(server.process_tasks(), 0)
+
+        self.assertEqual(server.batch_size, 2)
+        self.assertEqual(server.waiter.max_wait, 1.0)
+        self.assertEqual(server.metrics.batch_size.get(), 2)
+        server.shutdown()
+
+    def test_prepare_tasks(self):
+        self.settings.PREPARE_TASKS = True
+        self.storage_engine.add_task(Task("a", seconds=60))
+        self.storage_engine.add_task(Task("b", seconds=60))
+        self.task_engine.prepare.return_value = []
+
+        self._get_server()
+
+        self.task_engine.prepare.assert_called_once_with({"a", "b"})
+
+    def test_background_task_engine(self):
+        self.settings.BATCH_SIZE = 3
+        self.task_engine = ShellTaskEngine({"style": "pool", "max_workers": 2})
+        self.storage_engine.add_task(Task("sleep 0.2", when=time() - 1))
+        self.storage_engine.add_task(Task("false", when=time() - 1))
+
+        server = self._get_server()
+
+        # The inline executor isn't blocked while the commands run
+        self.assertEqual(server.process_tasks(), 2)
+        self.assertEqual(len(server.running), 2)
+        self.assertEqual(server._get_free_slots(), 1)
+
+        for future in list(server.running):
+            try:
+                future.result(5)
+            except TaskEngineError:
+                pass
+
+        self.assertEqual(server.complete_finished(), 2)
+        self.assertEqual(server.running, {})
+
+        # The failed command is retried later
+        self.assertEqual(
+            [task.task for task in self.storage_engine.get_task_list(until=1e12)],
+            ["false"],
+        )
+
+    def test_batching_task_engine(self):
+        self.task_engine = _BatchingTaskEngine()
+        self.storage_engine.add_task(Task("first", when=time() - 2))
+        self.storage_engine.add_task(Task("second", when=time() - 1))
+
+        server = self._get_server()
+
+        # Flushed once at the end of the tick
+        self.assertEqual(server.process_tasks(), 2)
+        self.assertEqual(self.task_engine.batches, [["first", "second"]])
+
+        server.complete_finished()
+        self.assertEqual(server.running, {})
+        self.assertEqual(server.process_tasks(), 0)
+        self.assertEqual(len(self.task_engine.batches), 1)
+
+    def test_thread_pool(self):
+        self.settings.EXECUTOR = "thread"
+        self.settings.MAX_CONCURRENCY = 2
+
+        for i in range(3):
+            self.storage_engine.add_task(Task("task-{}".format(i), when=time() - 1))
+
+        started = threading.Semaphore(0)
+        proceed = threading.Event()
+
+        def _run(task):
+            started.release()
+            proceed.wait(5)
+
+        self.task_engine.run = Mock(side_effect=_run)
+
+        server = self._get_server()
+
+        # Only as many tasks are claimed as there are free slots
+        self.assertEqual(server.process_tasks(), 2)
+        started.acquire()
+        started.acquire()
+        self.assertEqual(server.process_tasks(), 0)
+        self.assertEqual(len(server.running), 2)
+
+        proceed.set()
+        server.shutdown()
+
+        self.assertEqual(server.running, {})
+        self.assertEqual(self.storage_engine._get_collection().count_documents({}), 1)
+
+    def test_task_error(self):
+        self.settings.RETRY_JITTER = 0.0
+        self.settings.METRICS_PORT = 0
+        task_id = self.storage_engine.add_task(
+            Task("broken", when=time() - 1, max_attempts=3, backoff=20)
+        )
+        self.task_engine.run = Mock(side_effect=ValueError("broken"))
+
+        server = self._get_server()
+
+        try:
+            # Retried with exponential backoff
+            for attempt, delay in ((1, 20), (2, 40)):
+                start = time()
+                self.assertEqual(server.process_tasks(), 1)
+                self.assertEqual(server.running, {})
+
+                task = self.storage_engine.get_task(task_id)
+                self.assertEqual(task.attempts, attempt)
+                self.assertAlmostEqual(task.when - start, delay, delta=1)
+
+                self.storage_engine.reschedule(task, delay=-1)
+
+            # Given up on after the last attempt
+            self.assertEqual(server.process_tasks(), 1)
+            self.assertIsNone(self.storage_engine.get_task(task_id))
+            self.assertEqual(server.metrics.tasks_failed.get(), 3)
+            self.assertEqual(server.metrics.tasks_dead_lettered.get(), 1)
+        finally:
+            server.shutdown()
+
+        letters = self.storage_engine.get_dead_letters()
+        self.assertEqual([letter.task.id for letter in letters], [task_id])
+        self.assertEqual(letters[0].task.attempts, 3)
+        self.assertEqual(letters[0].task.max_attempts, 3)
+        self.assertEqual(letters[0].error, "ValueError: broken")
+
+    def test_recurring_task_error(self):
+        self.storage_engine.add_task(
+            Task("flaky", when=time() - 1, seconds=60, recurring=True)
+        )
+        self.task_engine.run = Mock(side_effect=[ValueError("flaky"), None])
+
+        server = self._get_server()
+        self.assertEqual(server.process_tasks(), 1)
+
+        task = self.storage_engine.get_task_list(until=1e12)[0]
+        self.assertEqual(task.attempts, 1)
+        self.assertLess(task.when, time() + 11)
+
+        # Succeeding resets the attempts, and it's back on its schedule
+        self.storage_engine.reschedule(task, delay=-1)
+        self.assertEqual(server.process_tasks(), 1)
+
+        task = self.storage_engine.get_task_list(until=1e12)[0]
+        self.assertEqual(task.attempts, 0)
+        self.assertGreater(task.when, time() + 50)
+
+    def test_run_wakes_up_for_new_tasks(self):
+        self.settings.SECONDS_PER_TICK = 60.0
+        ran = threading.Event()
+        self.task_engine.run = Mock(side_effect=lambda task: ran.set())
+
+        server = self._get_server()
+        thread = threading.Thread(target=server.run)
+        thread.start()
+
+        try:
+            while server.waiter.wake_at is None:
+                ran.wait(0.01)
+
+            start = time()
+            self.storage_engine.add_task(Task("now", when=time()))
+            self.assertTrue(ran.wait(5))
+            self.assertLess(time() - start, 1)
+        finally:
+            server.stop()
+            thread.join(5)
+
+        self.assertFalse(thread.is_alive())
+
+    def test_lookahead_cache(self):
+        self.settings.LOOKAHEAD_SECONDS = 60.0
+
+        now = time()
+        first = self.storage_engine.add_task(Task("first", when=now - 1))
+        self.storage_engine.add_task(Task("soon", when=now + 0.1))
+        self.storage_engine.add_task(
+            Task("recurring", when=now - 1, seconds=1.25, recurring=True)
+        )
+
+        server = self._get_server()
+        get_task_list = Mock(wraps=self.storage_engine.get_task_list)
+        self.storage_engine.get_task_list = get_task_list
+
+        self.assertEqual(server.process_tasks(), 2)
+        self.assertEqual(get_task_list.call_count, 1)
+        self.assertIsNone(self.storage_engine.get_task(first))
+
+        # The rest are run from the cache
+        sleep(0.3)
+        self.assertEqual(server.process_tasks(), 2)
+        self.assertEqual(get_task_list.call_count, 1)
+        self.assertEqual(
+            [c[0][0].task for c in self.task_engine.run.call_args_list],
+            ["first", "recurring", "soon", "recurring"],
+        )
+
+    def test_lookahead_cache_changed_tasks(self):
+        self.settings.LOOKAHEAD_SECONDS = 60.0
+        task_id = self.storage_engine.add_task(Task("task", when=time() + 0.1))
+
+        server = self._get_server()
+        self.assertEqual(server.process_tasks(), 0)
+
+        # Someone else claims the task, it should not run
+        self.storage_engine.claim_due_tasks("other", 1, 60)
+        sleep(0.2)
+        self.storage_engine.claim_due_tasks("other", 1, 60)
+        self.assertEqual(server.process_tasks(), 0)
+        self.assertIsNotNone(self.storage_engine.get_task(task_id))
+
+    def test_shards(self):
+        storage_engine = MemoryStorageEngine({"shards": 8})
+        storage_engine.add_tasks([Task(str(i), when=1) for i in range(100)])
+
+        servers = []
+        for worker_id in ("a", "b"):
+            self.settings.WORKER_ID = worker_id
+            self.storage_engine = storage_engine
+            servers.append(self._get_server())
+
+        # The first server owns all the shards until it sees the second one
+        servers[0]._update_shards()
+        servers[1]._update_shards()
+        servers[0].membership.next_heartbeat = None
+        servers[0]._update_shards()
+
+        owned = [set(server.membership.owned) for server in servers]
+        self.assertFalse(owned[0] & owned[1])
+        self.assertEqual(owned[0] | owned[1], set(range(8)))
+
+        ran = [[], []]
+        for i, server in enumerate(servers):
+            server.task_engine = Mock(run=lambda task, i=i: ran[i].append(task.shard))
+            server.process_tasks()
+
+        self.assertEqual(len(ran[0]) + len(ran[1]), 100)
+        self.assertTrue(set(ran[0]) <= owned[0])
+        self.assertTrue(set(ran[1]) <= owned[1])
+
+        # Leaving hands the shards over to the others
+        servers[1].shutdown()
+        servers[0].membership.next_heartbeat = None
+        servers[0]._update_shards()
+        self.assertEqual(servers[0].membership.owned, list(range(8)))
+
+    def test_shards_enabled_later(self):
+        task_id = self.storage_engine.add_task(Task("task", when=1))
+
+        self.storage_engine = MongoDBStorageEngine(
+            {"collection": "tasks", "shards": 8}, db=self.storage_engine._db
+        )
+        server = self._get_server()
+        server._update_shards()
+
+        self.assertEqual(server.process_tasks(), 1)
+        self.assertEqual(self.task_engine.run.call_count, 1)
+        self.assertIsNone(self.storage_engine.get_task(task_id))
+
+    def test_dispatcher(self):
+        self.settings.TOPOLOGY = "dispatcher"
+        self.settings.BATCH_SIZE = 4
+        self.storage_engine = MemoryStorageEngine({})
+        self.storage_engine.add_tasks([Task(str(i), when=1) for i in range(10)])
+
+        ran = {}
+        servers = []
+        for worker_id in ("a", "b"):
+            self.settings.WORKER_ID = worker_id
+            self.task_engine = Mock(
+                run=lambda task, worker_id=worker_id: ran.setdefault(task.id, worker_id)
+            )
+            servers.append(self._get_server())
+
+        # The first one becomes the leader and dispatches the tasks
+        self.assertEqual(servers[0]._dispatch_tasks(), 4)
+        self.assertTrue(servers[0].election.is_leader)
+        self.assertEqual(servers[0]._get_next_when(), 0)
+
+        # Others take them from the work queue without looking for due tasks
+        self.assertEqual(servers[1].process_tasks(), 4)
+        self.assertFalse(servers[1].election.is_leader)
+        self.assertEqual(servers[1]._dispatch_tasks(), 0)
+
+        self.assertEqual(servers[0].process_tasks(), 4)
+        self.assertEqual(servers[0].process_tasks(), 2)
+        self.assertEqual(servers[1].process_tasks(), 0)
+        self.assertEqual(len(ran), 10)
+        self.assertEqual(sorted(ran.values()).count("b"), 4)
+
+        # Leadership moves over once the leader leaves
+        servers[0].shutdown()
+        servers[1].election.next_renewal = None
+        servers[1].process_tasks()
+        self.assertTrue(servers[1].election.is_leader)
+
+    def test_shards_not_supported(self):
+        self.storage_engine = Mock(supports_shards=False, params={"shards": 8})
+        self.assertRaises(ValueError, self._get_server)
+
+    def test_work_queue_not_supported(self):
+        self.settings.TOPOLOGY = "dispatcher"
+        self.storage_engine = Mock(supports_work_queue=False, params={})
+        self.assertRaises(ValueError, self._get_server)
+        self.storage_engine.setup_work_queue.assert_not_called()
@@ -0,0 +1,37 @@
+from __future__ import unicode_literals
+
+from unittest import TestCase
+
+from mock import Mock
+
+from pytasched.engines import MemoryStorageEngine
+from pytasched.server.dispatch import LeaderElection
+
+
+class TestLeaderElection(TestCase):
+    def test_update(self):
+        engine = MemoryStorageEngine({})
+        engine._get_now = Mock(return_value=1000)
+
+        a = LeaderElection(engine, "a", 15)
+        b = LeaderElection(engine, "b", 15)
+
+        self.assertTrue(a.update(1000))
+        self.assertTrue(a.is_leader)
+        self.assertEqual(a.next_renewal, 1005)
+        self.assertFalse(b.update(1000))
+        self.assertFalse(b.is_leader)
+
+        # Nothing happens before the next renewal
+        self.assertFalse(a.update(1001))
+
+        # The leader renews the leadership before it expires
+        engine._get_now = Mock(return_value=1010)
+        self.assertFalse(a.update(1010))
+        self.assertFalse(b.update(1010))
+        self.assertTrue(a.is_leader)
+
+        a.resign()
+        self.assertFalse(a.is_leader)
+        self.assertTrue(b.update(1015))
+        self.assertTrue(b.is_leader)
@@ -0,0 +1,86 @@
+from __future__ import unicode_literals
+
+from unittest import TestCase
+from urllib.request import urlopen
+
+from mock import Mock
+
+from pytasched.server.metrics import (
+    InstrumentedStorageEngine,
+    MetricsServer,
+    Registry,
+)
+
+
+class TestMetrics(TestCase):
+    def test_counter(self):
+        registry = Registry()
+        counter = registry.counter("tasks_total", "Tasks", labels=("task",))
+
+        counter.inc(task="a")
+        counter.inc(2, task='say "hi"')
+
+        self.assertEqual(counter.get(task="a"), 1)
+        self.assertRaises(ValueError, counter.inc, other="a")
+        self.assertEqual(
+            registry.render(),
+            "# HELP tasks_total Tasks\n"
+            "# TYPE tasks_total counter\n"
+            'tasks_total{task="a"} 1.0\n'
+            'tasks_total{task="say \\"hi\\""} 2.0\n',
+        )
+
+    def test_histogram(self):
+        registry = Registry()
+        histogram = registry.histogram("lag_seconds", "Lag", buckets=(1.0, 0.1))
+
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        self.assertEqual(histogram.get_count(), 3)
+        self.assertEqual(
+            registry.render(),
+            "# HELP lag_seconds Lag\n"
+            "# TYPE lag_seconds histogram\n"
+            'lag_seconds_bucket{le="0.1"} 1.0\n'
+            'lag_seconds_bucket{le="1.0"} 2.0\n'
+            'lag_seconds_bucket{le="+Inf"} 3.0\n'
+            "lag_seconds_sum 5.55\n"
+            "lag_seconds_count 3.0\n",
+        )
+
+    def test_instrumented_storage_engine(self):
+        histogram = Registry().histogram("calls", "Calls", labels=("method",))
+        engine = Mock()
+        engine.params = {"shards": 4}
+        engine.get_task_list.return_value = []
+
+        instrumented = InstrumentedStorageEngine(engine, histogram)
+
+        self.assertEqual(instrumented.params, {"shards": 4})
+        self.assertEqual(instrumented.get_task_list(10), [])
+        engine.get_task_list.assert_called_once_with(10)
+
+        engine.remove_task.side_effect = KeyError()
+        self.assertRaises(KeyError, instrumented.remove_task, "id")
+
+        self.assertEqual(histogram.get_count(method="get_task_list"), 1)
+        self.assertEqual(histogram.get_count(method="remove_task"), 1)
+
+    def test_server(self):
+        registry = Registry()
+        registry.counter("tasks_total", "Tasks").inc()
+
+        server = MetricsServer(registry, "127.0.0.1", 0)
+        server.start()
+
+        try:
+            url = "http://{}:{}/metrics".format(*server.server_address)
+            response = urlopen(url, timeout=5)
+            body = response.read().decode("utf-8")
+        finally:
+            server.stop()
+
+        self.assertTrue(response.headers["Content-Type"].startswith("text/plain"))
+        self.assertIn("tasks_total 1.0\n", body)
@@ -0,0 +1,59 @@
+from __future__ import unicode_literals
+
+from unittest import TestCase
+
+from mock import Mock
+
+from pytasched.engines import MemoryStorageEngine
+from pytasched.server.sharding import ShardMembership, get_owned_shards
+
+
+class TestGetOwnedShards(TestCase):
+    def test_all_shards_owned_once(self):
+        members = ["a", "b", "c"]
+        owned = [get_owned_shards(member, members, 64) for member in members]
+
+        self.assertEqual(sorted(sum(owned, [])), list(range(64)))
+        for shards in owned:
+            self.assertTrue(shards)
+
+    def test_minimal_movement(self):
+        before = get_owned_shards("a", ["a", "b"], 64)
+        after = get_owned_shards("a", ["a", "b", "c"], 64)
+
+        # Adding a member only takes shards away, never moves them between
+        # the existing ones
+        self.assertTrue(set(after) <= set(before))
+        self.assertEqual(get_owned_shards("a", ["a"], 4), [0, 1, 2, 3])
+
+
+class TestShardMembership(TestCase):
+    def test_update(self):
+        engine = MemoryStorageEngine({})
+        engine._get_now = Mock(return_value=1000)
+
+        a = ShardMembership(engine, "a", 16, 5, 20)
+        b = ShardMembership(engine, "b", 16, 5, 20)
+
+        self.assertTrue(a.update(1000))
+        self.assertEqual(a.owned, list(range(16)))
+        self.assertEqual(a.next_heartbeat, 1005)
+
+        self.assertTrue(b.update(1000))
+        self.assertEqual(b.members, ["a", "b"])
+
+        # Nothing happens before the next heartbeat
+        self.assertFalse(a.update(1001))
+        self.assertEqual(a.owned, list(range(16)))
+
+        self.assertTrue(a.update(1005))
+        self.assertEqual(sorted(a.owned + b.owned), list(range(16)))
+
+        # Servers that stop sending heartbeats are dropped
+        engine._get_now = Mock(return_value=1030)
+        self.assertTrue(a.update(1030))
+        self.assertEqual(a.members, ["a"])
+        self.assertEqual(a.owned, list(range(16)))
+
+        a.leave()
+        self.assertEqual(engine.get_members(), [])
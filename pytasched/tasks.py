@@ -7,6 +7,9 @@ from datetime import datetime
 import pytasched
 from pytasched.tools import get_duration
 
+# Fields of the retry policy of a task, defaults come from the settings
+RETRY_FIELDS = ("max_attempts", "backoff", "max_backoff", "jitter")
+
 
 class Task(object):
     """
@@ -27,6 +30,13 @@ class Task(object):
         seconds=0,
         millis=0,
         when=None,
+        shard=None,
+        options=None,
+        max_attempts=None,
+        backoff=None,
+        max_backoff=None,
+        jitter=None,
+        attempts=0,
     ):
         """
         Create a new task. Should be used with the configured task engine in
@@ -43,6 +53,17 @@ class Task(object):
         :param float minutes: Define duration in minutes
         :param float seconds: Define duration in seconds
         :param float millis: Define duration in milliseconds
+        :param int shard: Shard the task belongs to, assigned by the storage
+                          engine if it's configured with "shards"
+        :param dict options: Options for the task engine on how to run the
+                             task, e.g. the queue or routing_key for Celery
+        :param int max_attempts: How many times to run the task before giving
+                                 up on it, None for the server's default
+        :param float backoff: Seconds to wait before the first retry, doubled
+                              for every retry after it
+        :param float max_backoff: Longest time to wait between retries
+        :param float jitter: Share of the wait to randomize, from 0 to 1
+        :param int attempts: How many times the task has failed in a row
         :return:
         """
         self.task = task
@@ -51,6 +72,13 @@ class Task(object):
         self.id = id
         self.recurring = recurring
         self.when = when
+        self.shard = shard
+        self.options = options
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.attempts = attempts or 0
 
         if wait:
             self.wait = wait
@@ -71,6 +99,25 @@ class Task(object):
         """
         return self.kwargs if self.kwargs else {}
 
+    def get_options(self):
+        """
+        Get the options for the task engine
+        :return dict:
+        """
+        return self.options if self.options else {}
+
+    def get_retry(self):
+        """
+        Get the retry policy set for the task, e.g. for storing it
+        :return dict|None: None if the defaults are used
+        """
+        retry = {
+            name: getattr(self, name)
+            for name in RETRY_FIELDS
+            if getattr(self, name) is not None
+        }
+        return retry or None
+
     def get_readable_when(self):
         """
         Get a human readable ISO-8601 timestamp in UTC for when the task is
@@ -81,23 +128,51 @@ class Task(object):
         dt = datetime.utcfromtimestamp(self.when)
         return dt.strftime("%Y-%m-%d %H:%M:%S")
 
-    def add(self):
+    def add(self, engine=None):
         """
         Add this Task to the default storage engine and return it's ID
+
+        :param pytasched.engines.StorageEngine engine: Use this engine instead
         :return str: ID
         """
 
-        engine = pytasched.get_storage_engine()
+        if not engine:
+            engine = pytasched.get_storage_engine()
+
         self.id = engine.add_task(self)
         return self.id
 
-    def remove(self):
+    @staticmethod
+    def add_many(tasks, engine=None):
+        """
+        Add many Tasks to the default storage engine at once and return their
+        IDs
+
+        :param list tasks: List of Task
+        :param pytasched.engines.StorageEngine engine: Use this engine instead
+        :return list: IDs in the same order as the tasks
+        """
+
+        if not engine:
+            engine = pytasched.get_storage_engine()
+
+        ids = engine.add_tasks(tasks)
+        for task, id in zip(tasks, ids):
+            task.id = id
+
+        return ids
+
+    def remove(self, engine=None):
         """
         Remove this Task from the default storage engine
+
+        :param pytasched.engines.StorageEngine engine: Use this engine instead
         :return bool:
         """
 
-        engine = pytasched.get_storage_engine()
+        if not engine:
+            engine = pytasched.get_storage_engine()
+
         return engine.remove_task(self.id)
 
     def __str__(self):
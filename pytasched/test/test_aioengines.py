@@ -0,0 +1,97 @@
+from __future__ import unicode_literals
+
+import asyncio
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from pytasched.aioengines import (
+    AsyncFunctionTaskEngine,
+    AsyncMemoryStorageEngine,
+    MotorStorageEngine,
+)
+from pytasched.engines import _mongo_indexed
+from pytasched.tasks import Task
+
+calls = []
+
+
+async def async_task(value):
+    calls.append(("async", value))
+
+
+def sync_task(value):
+    calls.append(("sync", value))
+
+
+def _run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+async def _return(value=None):
+    return value
+
+
+class TestAsyncMemoryStorageEngine(TestCase):
+    def setUp(self):
+        self.engine = AsyncMemoryStorageEngine({})
+        self.engine.engine._get_now = Mock(return_value=1000)
+
+    def test_tasks(self):
+        async def _test():
+            second = await self.engine.add_task(Task("second", when=950))
+            first = await self.engine.add_task(Task("first", when=900))
+            await self.engine.add_task(Task("later", when=2000))
+
+            tasks = await self.engine.get_task_list()
+            self.assertEqual([t.id for t in tasks], [first, second])
+
+            loaded = await self.engine.get_task(first)
+            self.assertFalse(await self.engine.has_task_changed(loaded))
+
+            claimed = await self.engine.claim_due_tasks("worker", 10, 60)
+            self.assertEqual([t.id for t in claimed], [first, second])
+            self.assertEqual(claimed[0].when, 900)
+            self.assertEqual(await self.engine.claim_due_tasks("worker", 10, 60), [])
+            self.assertTrue(await self.engine.has_task_changed(loaded))
+
+            self.assertTrue(await self.engine.remove_task(first))
+            self.assertIsNone(await self.engine.get_task(first))
+
+        _run(_test())
+
+
+class TestMotorStorageEngine(TestCase):
+    def test_setup(self):
+        collection = Mock(full_name="db.tasks")
+        collection.create_index = Mock(side_effect=lambda *args: _return())
+        key = (id(collection.database.client), collection.full_name)
+        self.addCleanup(_mongo_indexed.discard, key)
+
+        engines = []
+        with patch("pytasched.aioengines.AsyncIOMotorClient", Mock()):
+            for _ in range(2):
+                engine = MotorStorageEngine({"indices": {}}, db=Mock())
+                engine._get_collection = Mock(side_effect=lambda: _return(collection))
+                engines.append(engine)
+
+        # Indexes are only ensured once per process
+        for engine in engines:
+            _run(engine.setup())
+
+        collection.create_index.assert_called_once_with([("when", 1)])
+
+
+class TestAsyncFunctionTaskEngine(TestCase):
+    def test_run(self):
+        del calls[:]
+        engine = AsyncFunctionTaskEngine({})
+
+        _run(engine.run(Task(__name__ + ":async_task", args=[1])))
+        _run(engine.run(Task(__name__ + ":sync_task", kwargs={"value": 2})))
+
+        self.assertEqual(calls, [("async", 1), ("sync", 2)])
@@ -0,0 +1,25 @@
+from __future__ import unicode_literals
+
+from unittest import TestCase, skipIf
+
+from pytasched.connections import get_mongo_client, get_redis_client, redis
+
+
+class TestConnections(TestCase):
+    def test_get_mongo_client(self):
+        client = get_mongo_client("mongodb://localhost:27017", connect=False)
+
+        self.assertIs(
+            get_mongo_client("mongodb://localhost:27017", connect=False), client
+        )
+        self.assertIsNot(
+            get_mongo_client("mongodb://localhost:27018", connect=False), client
+        )
+        self.assertEqual(client.max_pool_size, 100)
+
+    @skipIf(redis is None, "Needs redis")
+    def test_get_redis_client(self):
+        client = get_redis_client("redis://localhost:6379/0")
+
+        self.assertIs(get_redis_client("redis://localhost:6379/0"), client)
+        self.assertIsNot(get_redis_client("redis://localhost:6379/1"), client)
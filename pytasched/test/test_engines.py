@@ -1,29 +1,83 @@
 from __future__ import unicode_literals
 
 import mongomock
-from mock import Mock
-from unittest import TestCase
+import os
+import pickle
+import shutil
+import sqlite3
+import sys
+import tempfile
+from builtins import object
+from concurrent.futures import ProcessPoolExecutor
+from mock import Mock, patch
+from pymongo.errors import OperationFailure
+from shlex import quote
+from threading import Thread
+from time import sleep, time
+from unittest import TestCase, skipIf, skipUnless
 
-from pytasched.engines import MongoDBStorageEngine
+from pytasched.engines import (
+    CeleryTaskEngine,
+    FunctionTaskEngine,
+    MemoryStorageEngine,
+    MongoDBStorageEngine,
+    PostgresStorageEngine,
+    RedisStorageEngine,
+    SQLiteStorageEngine,
+    ShellTaskEngine,
+    _get_mongo_index_plan,
+    clear_engines,
+    get_storage_engine,
+    get_task_engine,
+)
+from pytasched.errors import TaskEngineError
+from pytasched.server.executors import run_task
 from pytasched.tasks import Task
 
+try:
+    import fakeredis
+    import lupa
+except ImportError:
+    fakeredis = None
+
+try:
+    from celery import Celery
+except ImportError:
+    Celery = None
+
+
+class _Settings(object):
+    STORAGE = {"engine": "pytasched.engines:MongoDBStorageEngine", "params": {}}
+    TASKS = {
+        "engine": "pytasched.engines:ShellTaskEngine",
+        "params": {"style": "system"},
+    }
+
 
 class TestFuncs(TestCase):
     def test_setup_engine(self):
         pass
 
     def test_get_storage_engine(self):
-        pass
+        settings = _Settings()
 
-    def test_get_task_engine(self):
-        pass
+        engine = get_storage_engine(settings)
+        self.assertIsInstance(engine, MongoDBStorageEngine)
+        self.assertIs(get_storage_engine(settings), engine)
+        self.assertIsNot(get_storage_engine(settings, shared=False), engine)
+        self.assertIsNot(get_storage_engine(_Settings()), engine)
 
-    def test_mongo_item_to_task(self):
-        pass
+        clear_engines()
+        self.assertIsNot(get_storage_engine(settings), engine)
+
+    def test_get_task_engine(self):
+        settings = _Settings()
 
+        engine = get_task_engine(settings)
+        self.assertIsInstance(engine, ShellTaskEngine)
+        self.assertIs(get_task_engine(settings), engine)
 
-class Test_MongoDBCursorWrapper(TestCase):
-    def test_list(self):
+    def test_mongo_item_to_task(self):
         pass
 
 
@@ -48,7 +102,75 @@ class TestMongoDBStorageEngine(TestCase):
         pass
 
     def test_setup(self):
-        pass
+        self.engine.params["indices"] = {}
+        collection = self.engine._get_collection()
+        collection.create_index = Mock(wraps=collection.create_index)
+        self.engine._get_collection = Mock(return_value=collection)
+
+        self.engine.check_indexes = Mock(return_value=[])
+        self.engine.setup()
+        collection.create_index.assert_called_once_with([("when", 1)])
+        self.engine.check_indexes.assert_called_once_with()
+
+        # Indexes are only ensured once per process
+        engine = MongoDBStorageEngine({"indices": {}}, db=collection.database)
+        engine._get_collection = Mock(return_value=collection)
+        engine.setup()
+        self.assertEqual(collection.create_index.call_count, 1)
+
+    def test_index_plan(self):
+        plan = _get_mongo_index_plan({"indices": {}})
+        self.assertEqual(plan, [([("when", 1)], {})])
+
+        options = {"partialFilterExpression": {"status": "pending"}}
+        plan = _get_mongo_index_plan(
+            {"indices": {"when": {"background": True}, ("status", "when"): options}}
+        )
+        self.assertEqual(
+            plan,
+            [
+                ([("when", 1)], {"background": True}),
+                ([("status", 1), ("when", 1)], options),
+            ],
+        )
+
+    def test_check_indexes(self):
+        index_scan = {
+            "queryPlanner": {
+                "winningPlan": {
+                    "stage": "LIMIT",
+                    "inputStage": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}},
+                }
+            }
+        }
+        collection_scan = {
+            "queryPlanner": {
+                "winningPlan": {
+                    "stage": "SHARD_MERGE",
+                    "shards": [{"winningPlan": {"stage": "COLLSCAN"}}],
+                }
+            }
+        }
+
+        cursor = Mock()
+        cursor.sort.return_value = cursor
+        cursor.limit.return_value = cursor
+        collection = Mock(full_name="db.tasks")
+        collection.find.return_value = cursor
+        self.engine._get_collection = Mock(return_value=collection)
+
+        cursor.explain.return_value = index_scan
+        self.assertEqual(self.engine.check_indexes(), [])
+
+        cursor.explain.return_value = collection_scan
+        self.assertEqual(self.engine.check_indexes(), ["due tasks", "next due time"])
+
+    def test_get_task_names(self):
+        self.engine.add_tasks(
+            [Task("a", seconds=5), Task("b", seconds=86400), Task("a", seconds=1)]
+        )
+
+        self.assertEqual(self.engine.get_task_names(), {"a", "b"})
 
     def test_add_task(self):
         pass
@@ -56,8 +178,51 @@ class TestMongoDBStorageEngine(TestCase):
     def test_get_task(self):
         pass
 
+    def test_bulk(self):
+        self.engine._get_now = Mock(return_value=1000)
+        listener = Mock()
+        self.engine.add_listener(listener)
+
+        tasks = [
+            Task("a", seconds=10),
+            Task("b", when=900, seconds=3),
+            Task("c", seconds=5),
+        ]
+        ids = self.engine.add_tasks(tasks)
+
+        self.assertEqual(len(ids), 3)
+        self.assertEqual([self.engine.get_task(i).task for i in ids], ["a", "b", "c"])
+        self.assertEqual(self.engine.get_task(ids[0]).when, 1010)
+        listener.assert_called_once_with(900)
+
+        loaded = [self.engine.get_task(id) for id in ids[:2]]
+        self.assertEqual(self.engine.reschedule_many(loaded, recur=True), 2)
+        self.assertEqual(self.engine.get_task(ids[0]).when, 1020)
+        self.assertEqual(self.engine.get_task(ids[1]).when, 903)
+
+        self.assertEqual(self.engine.remove_tasks(ids[1:]), 2)
+        self.assertEqual(self.engine.get_task_list(until=2000)[0].id, ids[0])
+        self.assertEqual(len(self.engine.get_task_list(until=2000)), 1)
+        self.assertEqual(self.engine.add_tasks([]), [])
+
     def test_get_task_list(self):
-        pass
+        self.engine._get_now = Mock(return_value=1000)
+        second = self.engine.add_task(Task("second", when=950))
+        first = self.engine.add_task(Task("first", when=900))
+        third = self.engine.add_task(Task("third", when=999))
+        self.engine.add_task(Task("later", when=2000))
+
+        tasks = self.engine.get_task_list()
+        self.assertIsInstance(tasks, list)
+        self.assertEqual([t.id for t in tasks], [first, second, third])
+
+        tasks = self.engine.get_task_list(limit=2)
+        self.assertEqual([t.id for t in tasks], [first, second])
+
+        tasks = self.engine.get_task_list(until=3000)
+        self.assertEqual(len(tasks), 4)
+        self.assertEqual(tasks[0].task, "first")
+        self.assertEqual(tasks[0].when, 900)
 
     def test_reschedule(self):
         pass
@@ -65,6 +230,47 @@ class TestMongoDBStorageEngine(TestCase):
     def test_remove_task(self):
         pass
 
+    def test_retry(self):
+        self.engine._get_now = Mock(return_value=1000)
+        task_id = self.engine.add_task(Task("foo", when=900, backoff=5))
+
+        task = self.engine.get_task(task_id)
+        task.attempts = 2
+        self.assertTrue(self.engine.reschedule(task, delay=30))
+
+        task = self.engine.get_task(task_id)
+        self.assertEqual((task.when, task.attempts, task.backoff), (1030, 2, 5))
+
+    def test_dead_letters(self):
+        self.engine._get_now = Mock(return_value=1000)
+        first = self.engine.add_task(
+            Task("first", when=900, max_attempts=3, options={"a": 1})
+        )
+        second = self.engine.add_task(Task("second", when=950))
+
+        task = self.engine.get_task(first)
+        task.attempts = 3
+        self.assertTrue(self.engine.dead_letter_task(task, "ValueError: oops"))
+        self.assertIsNone(self.engine.get_task(first))
+
+        self.engine._get_now = Mock(return_value=1001)
+        self.engine.dead_letter_task(self.engine.get_task(second), "later")
+
+        letters = self.engine.get_dead_letters()
+        self.assertEqual([letter.task.id for letter in letters], [second, first])
+        self.assertEqual(letters[1].error, "ValueError: oops")
+        self.assertEqual(letters[1].failed_at, 1000)
+        self.assertEqual(letters[1].task.attempts, 3)
+        self.assertEqual(letters[1].task.max_attempts, 3)
+        self.assertEqual(letters[1].task.options, {"a": 1})
+        self.assertEqual(len(self.engine.get_dead_letters(1)), 1)
+
+        self.assertTrue(self.engine.remove_dead_letter(first))
+        self.assertFalse(self.engine.remove_dead_letter(first))
+        self.assertEqual(
+            [letter.task.id for letter in self.engine.get_dead_letters()], [second]
+        )
+
     def test_has_task_changed(self):
         original = Task("foo", seconds=5)
 
@@ -89,20 +295,1210 @@ class TestMongoDBStorageEngine(TestCase):
 
         self.assertTrue(self.engine.has_task_changed(loaded))
 
+    def test_get_next_when(self):
+        self.assertIsNone(self.engine.get_next_when())
+
+        self.engine.add_task(Task("second", when=950))
+        self.engine.add_task(Task("first", when=900))
+        self.assertEqual(self.engine.get_next_when(), 900)
+
+    def test_listeners(self):
+        listener = Mock()
+        self.engine.add_listener(listener)
+
+        task_id = self.engine.add_task(Task("foo", when=900))
+        listener.assert_called_once_with(900)
+
+        self.engine._get_now = Mock(return_value=1000)
+        self.engine.reschedule(self.engine.get_task(task_id))
+        listener.assert_called_with(1000)
+
+    def test_watch(self):
+        # Not enabled
+        self.assertFalse(self.engine.watch())
+
+        self.engine.params["watch"] = True
+        collection = Mock()
+        self.engine._get_collection = Mock(return_value=collection)
+
+        # Not supported by the server
+        collection.watch.side_effect = OperationFailure("not a replica set")
+        self.assertFalse(self.engine.watch())
+
+        listener = Mock()
+        self.engine.add_listener(listener)
+
+        collection.watch.side_effect = None
+        collection.watch.return_value = [
+            {"operationType": "insert", "fullDocument": {"when": 900}},
+            {
+                "operationType": "update",
+                "updateDescription": {"updatedFields": {"when": 950}},
+            },
+        ]
+        self.assertTrue(self.engine.watch())
+
+        for _ in range(100):
+            if listener.call_count == 2:
+                break
+            sleep(0.01)
+
+        self.assertEqual([c[0][0] for c in listener.call_args_list], [900, 950])
+
+    def test_claim_due_tasks(self):
+        self.engine._get_now = Mock(return_value=1000)
+        first = self.engine.add_task(Task("first", when=900))
+        second = self.engine.add_task(Task("second", when=950))
+        self.engine.add_task(Task("later", when=2000))
+
+        claimed = self.engine.claim_due_tasks("worker-1", 10, 60)
+        self.assertEqual([t.id for t in claimed], [first, second])
+
+        # Claimed tasks keep their original schedule, but are leased in storage
+        self.assertEqual(claimed[0].when, 900)
+        self.assertEqual(self.engine.get_task(first).when, 1060)
+
+        # Nobody else gets them while the lease is valid
+        self.assertEqual(self.engine.claim_due_tasks("worker-2", 10, 60), [])
+
+        # Once the lease expires they can be claimed again
+        self.engine._get_now = Mock(return_value=1061)
+        claimed = self.engine.claim_due_tasks("worker-2", 1, 60)
+        self.assertEqual([t.id for t in claimed], [first])
+
+    def test_claim_task(self):
+        self.engine._get_now = Mock(return_value=1000)
+        task_id = self.engine.add_task(Task("task", when=1010))
+        task = self.engine.get_task(task_id)
+        stale = self.engine.get_task(task_id)
+
+        self.assertTrue(self.engine.claim_task(task, "worker-1", 60))
+        self.assertEqual(self.engine.get_task(task_id).when, 1060)
+
+        # Can't claim it with outdated information
+        self.assertFalse(self.engine.claim_task(stale, "worker-2", 60))
+
+    def test_extend_claims(self):
+        self.engine._get_now = Mock(return_value=1000)
+        first = self.engine.add_task(Task("first", when=900))
+        second = self.engine.add_task(Task("second", when=950, seconds=100))
+        claimed = self.engine.claim_due_tasks("worker-1", 10, 60)
+
+        # Still running when the leases are about to expire
+        self.engine._get_now = Mock(return_value=1050)
+        self.assertEqual(self.engine.extend_claims(claimed, "worker-1", 60), 2)
+        self.assertEqual(self.engine.get_task(first).when, 1110)
+        self.assertEqual(self.engine.extend_claims(claimed, "worker-2", 60), 0)
+
+        # Completed tasks are left alone
+        self.engine.reschedule(claimed[1])
+        self.assertEqual(self.engine.extend_claims(claimed, "worker-1", 60), 1)
+        self.assertEqual(self.engine.get_task(second).when, 1150)
+
+    def test_shards(self):
+        self.engine._get_now = Mock(return_value=1000)
+        self.engine.params["shards"] = 4
+
+        self.assertEqual(
+            _get_mongo_index_plan(self.engine.params),
+            [([("when", 1)], {}), ([("shard", 1), ("when", 1)], {})],
+        )
+
+        ids = self.engine.add_tasks([Task("a", when=900), Task("b", when=950)])
+        first = self.engine.get_task(ids[0])
+        self.assertIn(first.shard, range(4))
+
+        second = self.engine.add_task(Task("c", when=800, shard=3))
+        self.assertEqual(self.engine.get_task(second).shard, 3)
+
+        self.assertEqual(self.engine.get_next_when(shards=[3]), 800)
+        tasks = self.engine.get_task_list(shards=[first.shard])
+        self.assertIn(first.id, [t.id for t in tasks])
+        self.assertEqual(set(t.shard for t in tasks), {first.shard})
+
+        claimed = self.engine.claim_due_tasks("worker-1", 10, 60, shards=[3])
+        self.assertIn(second, [t.id for t in claimed])
+        self.assertEqual(self.engine.claim_due_tasks("worker-1", 10, 60, []), [])
+
+    def test_shards_enabled_later(self):
+        self.engine._get_now = Mock(return_value=1000)
+        ids = self.engine.add_tasks([Task("a", when=900), Task("b", when=950)])
+        self.assertIsNone(self.engine.get_task(ids[0]).shard)
+
+        # Tasks without a shard are left to the owner of shard 0
+        self.engine.params["shards"] = 4
+        self.assertEqual(self.engine.get_next_when(shards=[0]), 900)
+        self.assertEqual(self.engine.get_next_when(shards=[1, 2, 3]), None)
+        claimed = self.engine.claim_due_tasks("worker-1", 10, 60, shards=[0])
+        self.assertEqual(sorted(t.id for t in claimed), sorted(ids))
+
+        # ...until setup spreads them over the shards
+        self.assertEqual(self.engine.assign_missing_shards(), 2)
+        for task_id in ids:
+            self.assertIn(self.engine.get_task(task_id).shard, range(4))
+        self.assertEqual(self.engine.assign_missing_shards(), 0)
+
+    def test_leadership(self):
+        self.engine._get_now = Mock(return_value=1000)
+        self.assertTrue(self.engine.acquire_leadership("a", 15))
+        self.assertTrue(self.engine.acquire_leadership("a", 15))
+        self.assertFalse(self.engine.acquire_leadership("b", 15))
+
+        # The leadership can be taken over once it expires
+        self.engine._get_now = Mock(return_value=1016)
+        self.assertTrue(self.engine.acquire_leadership("b", 15))
+        self.assertFalse(self.engine.acquire_leadership("a", 15))
+
+        self.engine.release_leadership("a")
+        self.assertFalse(self.engine.acquire_leadership("a", 15))
+        self.engine.release_leadership("b")
+        self.assertTrue(self.engine.acquire_leadership("a", 15))
+
+    def test_work_queue(self):
+        self.engine._get_now = Mock(return_value=1000)
+        self.engine.setup_work_queue()
+        first = self.engine.add_task(Task("first", when=900))
+        second = self.engine.add_task(Task("second", when=950, seconds=10))
+
+        tasks = self.engine.claim_due_tasks("leader", 10, 60)
+        self.assertEqual(self.engine.queue_tasks(tasks), 2)
+        self.assertEqual(self.engine.claim_due_tasks("leader", 10, 60), [])
+
+        taken = self.engine.take_queued_tasks("worker-1", 1, 30)
+        self.assertEqual([t.id for t in taken], [first])
+        self.assertEqual(taken[0].when, 900)
+        self.assertEqual(self.engine.get_task(first).when, 1030)
+
+        taken = self.engine.take_queued_tasks("worker-2", 10, 30)
+        self.assertEqual([t.id for t in taken], [second])
+        self.assertEqual(self.engine.take_queued_tasks("worker-2", 10, 30), [])
+
+        self.engine.reschedule(taken[0], recur=True)
+        item = self.engine._get_collection().find_one({"task": "second"})
+        self.assertEqual(item["when"], 960)
+        self.assertEqual(item["status"], "pending")
+        self.assertNotIn("queued_at", item)
+        self.assertNotIn("scheduled", item)
+
+    def test_requeue_expired(self):
+        self.engine._get_now = Mock(return_value=1000)
+        task_id = self.engine.add_task(Task("recurring", when=900, seconds=500))
+
+        tasks = self.engine.claim_due_tasks("leader", 10, 60)
+        self.engine.queue_tasks(tasks)
+        self.engine.take_queued_tasks("worker-1", 10, 30)
+
+        # The worker died, so the leader claims and queues it again
+        self.engine._get_now = Mock(return_value=1031)
+        tasks = self.engine.claim_due_tasks("leader", 10, 60)
+        self.assertEqual(tasks[0].when, 1030)
+        self.assertEqual(self.engine.queue_tasks(tasks), 1)
+
+        taken = self.engine.take_queued_tasks("worker-2", 10, 30)
+        self.assertEqual([(t.id, t.when) for t in taken], [(task_id, 900)])
+        self.engine.reschedule(taken[0], recur=True)
+        self.assertEqual(self.engine.get_task(task_id).when, 1400)
+
+    def test_members(self):
+        self.engine._get_now = Mock(return_value=1000)
+        self.engine.heartbeat("a", 20)
+        self.engine.heartbeat("b", 5)
+        self.assertEqual(self.engine.get_members(), ["a", "b"])
+
+        self.engine._get_now = Mock(return_value=1010)
+        self.assertEqual(self.engine.get_members(), ["a"])
+
+        self.engine.leave("a")
+        self.assertEqual(self.engine.get_members(), [])
+
+    def test_claimed_task_reschedule(self):
+        self.engine._get_now = Mock(return_value=1000)
+        task_id = self.engine.add_task(Task("recurring", when=900, seconds=500))
+
+        task = self.engine.claim_due_tasks("worker-1", 10, 60)[0]
+        self.engine.reschedule(task, recur=True)
+
+        self.assertEqual(self.engine.get_task(task_id).when, 1400)
+        item = self.engine._get_collection().find_one({"task": "recurring"})
+        self.assertEqual(item["status"], "pending")
+        self.assertNotIn("owner", item)
+
+
+class TestMemoryStorageEngine(TestCase):
+    def setUp(self):
+        self.engine = MemoryStorageEngine({})
+        self.engine._get_now = Mock(return_value=1000)
+
+    def test_get_task_names(self):
+        self.engine.add_tasks(
+            [Task("a", seconds=5), Task("b", seconds=86400), Task("a", seconds=1)]
+        )
+
+        self.assertEqual(self.engine.get_task_names(), {"a", "b"})
+
+    def test_add_task(self):
+        listener = Mock()
+        self.engine.add_listener(listener)
+
+        task = Task("foo", seconds=5)
+        task_id = self.engine.add_task(task)
+
+        listener.assert_called_once_with(1005)
+        loaded = self.engine.get_task(task_id)
+        self.assertEqual(loaded.task, "foo")
+        self.assertEqual(loaded.when, 1005)
+
+        # Changing the loaded task doesn't change the stored one
+        loaded.when = 1
+        self.assertEqual(self.engine.get_task(task_id).when, 1005)
+        self.assertIsNone(self.engine.get_task("missing"))
+
+    def test_get_task_list(self):
+        second = self.engine.add_task(Task("second", when=950))
+        first = self.engine.add_task(Task("first", when=900))
+        third = self.engine.add_task(Task("third", when=999))
+        self.engine.add_task(Task("later", when=2000))
+
+        tasks = self.engine.get_task_list()
+        self.assertEqual([t.id for t in tasks], [first, second, third])
+
+        tasks = self.engine.get_task_list(limit=2)
+        self.assertEqual([t.id for t in tasks], [first, second])
+
+        self.assertEqual(len(self.engine.get_task_list(until=3000)), 4)
+        self.assertEqual(self.engine.get_next_when(), 900)
+
+    def test_reschedule(self):
+        task_id = self.engine.add_task(Task("foo", when=900, seconds=500))
+        task = self.engine.get_task(task_id)
+
+        self.assertTrue(self.engine.reschedule(task, recur=True))
+        self.assertEqual(self.engine.get_task(task_id).when, 1400)
+        self.assertTrue(self.engine.has_task_changed(Task("foo", when=900, id=task_id)))
+
+        # Outdated heap entries are not returned
+        self.assertEqual(self.engine.get_task_list(), [])
+        self.assertEqual(len(self.engine.get_task_list(until=2000)), 1)
+        self.assertEqual(self.engine.get_next_when(), 1400)
+
+        # Moving back to the same time doesn't duplicate the task
+        task.when = 900
+        self.engine.reschedule(task, recur=True)
+        self.engine.reschedule(Task("foo", when=900, seconds=500, id=task_id), True)
+        self.assertEqual(len(self.engine.get_task_list(until=2000)), 1)
+
+    def test_remove_task(self):
+        task_id = self.engine.add_task(Task("foo", when=900))
+
+        self.assertTrue(self.engine.remove_task(task_id))
+        self.assertFalse(self.engine.remove_task(task_id))
+        self.assertTrue(self.engine.has_task_changed(Task("foo", when=900, id=task_id)))
+        self.assertEqual(self.engine.get_task_list(), [])
+        self.assertIsNone(self.engine.get_next_when())
+
+    def test_retry(self):
+        task_id = self.engine.add_task(Task("foo", when=900, backoff=5))
+
+        task = self.engine.get_task(task_id)
+        task.attempts = 2
+        self.assertTrue(self.engine.reschedule(task, delay=30))
+
+        task = self.engine.get_task(task_id)
+        self.assertEqual((task.when, task.attempts, task.backoff), (1030, 2, 5))
+
+    def test_dead_letters(self):
+        first = self.engine.add_task(
+            Task("first", when=900, max_attempts=3, options={"a": 1})
+        )
+        second = self.engine.add_task(Task("second", when=950))
+
+        task = self.engine.get_task(first)
+        task.attempts = 3
+        self.assertTrue(self.engine.dead_letter_task(task, "ValueError: oops"))
+        self.assertIsNone(self.engine.get_task(first))
+
+        self.engine._get_now = Mock(return_value=1001)
+        self.engine.dead_letter_task(self.engine.get_task(second), "later")
+
+        letters = self.engine.get_dead_letters()
+        self.assertEqual([letter.task.id for letter in letters], [second, first])
+        self.assertEqual(letters[1].error, "ValueError: oops")
+        self.assertEqual(letters[1].failed_at, 1000)
+        self.assertEqual(letters[1].task.attempts, 3)
+        self.assertEqual(letters[1].task.max_attempts, 3)
+        self.assertEqual(letters[1].task.options, {"a": 1})
+        self.assertEqual(len(self.engine.get_dead_letters(1)), 1)
+
+        self.assertTrue(self.engine.remove_dead_letter(first))
+        self.assertFalse(self.engine.remove_dead_letter(first))
+        self.assertEqual(
+            [letter.task.id for letter in self.engine.get_dead_letters()], [second]
+        )
+
+    def test_bulk(self):
+        ids = self.engine.add_tasks([Task("a", when=900), Task("b", when=950)])
+        tasks = [self.engine.get_task(id) for id in ids]
+
+        self.assertEqual(self.engine.reschedule_many(tasks), 2)
+        self.assertEqual(self.engine.get_task_list(), [])
+        self.assertEqual(self.engine.remove_tasks(ids), 2)
+        self.assertIsNone(self.engine.get_next_when())
+
+    def test_claim_due_tasks(self):
+        first = self.engine.add_task(Task("first", when=900))
+        second = self.engine.add_task(Task("second", when=950))
+        self.engine.add_task(Task("later", when=2000))
+
+        claimed = self.engine.claim_due_tasks("worker-1", 10, 60)
+        self.assertEqual([t.id for t in claimed], [first, second])
+        self.assertEqual(claimed[0].when, 900)
+        self.assertEqual(self.engine.get_task(first).when, 1060)
+        self.assertEqual(self.engine.claim_due_tasks("worker-2", 10, 60), [])
+
+        self.engine._get_now = Mock(return_value=1061)
+        claimed = self.engine.claim_due_tasks("worker-2", 1, 60)
+        self.assertEqual([t.id for t in claimed], [first])
+
+    def test_claim_task(self):
+        task_id = self.engine.add_task(Task("task", when=1010))
+        task = self.engine.get_task(task_id)
+        stale = self.engine.get_task(task_id)
+
+        self.assertTrue(self.engine.claim_task(task, "worker-1", 60))
+        self.assertEqual(self.engine.get_task(task_id).when, 1060)
+        self.assertFalse(self.engine.claim_task(stale, "worker-2", 60))
+
+    def test_extend_claims(self):
+        first = self.engine.add_task(Task("first", when=900))
+        second = self.engine.add_task(Task("second", when=950, seconds=100))
+        claimed = self.engine.claim_due_tasks("worker-1", 10, 60)
+
+        # Still running when the leases are about to expire
+        self.engine._get_now = Mock(return_value=1050)
+        self.assertEqual(self.engine.extend_claims(claimed, "worker-1", 60), 2)
+        self.assertEqual(self.engine.get_task(first).when, 1110)
+        self.assertEqual(self.engine.extend_claims(claimed, "worker-2", 60), 0)
+
+        # Completed tasks are left alone
+        self.engine.reschedule(claimed[1])
+        self.assertEqual(self.engine.extend_claims(claimed, "worker-1", 60), 1)
+        self.assertEqual(self.engine.get_task(second).when, 1150)
+
+    def test_work_queue(self):
+        first = self.engine.add_task(Task("first", when=900))
+        second = self.engine.add_task(Task("second", when=950))
+        self.assertTrue(self.engine.acquire_leadership("leader", 15))
+        self.assertFalse(self.engine.acquire_leadership("other", 15))
+
+        tasks = self.engine.claim_due_tasks("leader", 10, 60)
+        self.assertEqual(self.engine.queue_tasks(tasks), 2)
+
+        taken = self.engine.take_queued_tasks("worker-1", 1, 30)
+        self.assertEqual([(t.id, t.when) for t in taken], [(first, 900)])
+        self.assertEqual(self.engine.get_task(first).when, 1030)
+
+        # Removed tasks are dropped from the queue
+        self.engine.remove_task(second)
+        self.assertEqual(self.engine.take_queued_tasks("worker-1", 10, 30), [])
+
+    def test_requeue_expired(self):
+        task_id = self.engine.add_task(Task("recurring", when=900, seconds=500))
+
+        tasks = self.engine.claim_due_tasks("leader", 10, 60)
+        self.engine.queue_tasks(tasks)
+        self.engine.take_queued_tasks("worker-1", 10, 30)
+
+        # The worker died, so the leader claims and queues it again
+        self.engine._get_now = Mock(return_value=1031)
+        tasks = self.engine.claim_due_tasks("leader", 10, 60)
+        self.assertEqual(tasks[0].when, 1030)
+        self.assertEqual(self.engine.queue_tasks(tasks), 1)
+
+        taken = self.engine.take_queued_tasks("worker-2", 10, 30)
+        self.assertEqual([(t.id, t.when) for t in taken], [(task_id, 900)])
+        self.engine.reschedule(taken[0], recur=True)
+        self.assertEqual(self.engine.get_task(task_id).when, 1400)
+
+
+class TestSQLiteStorageEngine(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.params = {"path": os.path.join(self.dir, "tasks.sqlite3")}
+        self.engine = SQLiteStorageEngine(self.params)
+        self.engine._get_now = Mock(return_value=1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_setup(self):
+        connection = self.engine._get_connection()
+        self.assertEqual(connection.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+
+        plan = connection.execute(
+            'EXPLAIN QUERY PLAN SELECT id FROM tasks WHERE "when" < ? '
+            'ORDER BY "when" LIMIT ?',
+            (1000, 10),
+        ).fetchall()
+        self.assertIn("tasks_when", " ".join(row[-1] for row in plan))
+
+    def test_setup_existing_table(self):
+        path = os.path.join(self.dir, "old.sqlite3")
+        connection = sqlite3.connect(path)
+        connection.execute(
+            "CREATE TABLE tasks (id INTEGER PRIMARY KEY AUTOINCREMENT, task TEXT "
+            "NOT NULL, args TEXT, kwargs TEXT, wait REAL NOT NULL, recurring "
+            'INTEGER NOT NULL, "when" REAL NOT NULL, status TEXT NOT NULL '
+            "DEFAULT 'pending', owner TEXT, claimed_when REAL)"
+        )
+        connection.execute(
+            'INSERT INTO tasks (task, wait, recurring, "when") '
+            "VALUES ('old', 0, 0, 900)"
+        )
+        connection.commit()
+        connection.close()
+
+        engine = SQLiteStorageEngine({"path": path})
+        engine._get_now = Mock(return_value=1000)
+        engine.add_task(Task("new", when=950, options={"queue": "high"}))
+
+        tasks = engine.get_task_list()
+        self.assertEqual([t.task for t in tasks], ["old", "new"])
+        self.assertEqual([t.options for t in tasks], [None, {"queue": "high"}])
+
+    def test_get_task_names(self):
+        self.engine.add_tasks(
+            [Task("a", seconds=5), Task("b", seconds=86400), Task("a", seconds=1)]
+        )
+
+        self.assertEqual(self.engine.get_task_names(), {"a", "b"})
+
+    def test_add_task(self):
+        listener = Mock()
+        self.engine.add_listener(listener)
+
+        task_id = self.engine.add_task(
+            Task(
+                "foo",
+                args=[1],
+                kwargs={"a": "b"},
+                seconds=5,
+                recurring=True,
+                options={"queue": "high"},
+            )
+        )
+        listener.assert_called_once_with(1005)
+
+        task = self.engine.get_task(task_id)
+        self.assertEqual(task.id, task_id)
+        self.assertEqual(task.task, "foo")
+        self.assertEqual(task.args, [1])
+        self.assertEqual(task.kwargs, {"a": "b"})
+        self.assertEqual(task.wait, 5)
+        self.assertTrue(task.recurring)
+        self.assertEqual(task.when, 1005)
+        self.assertEqual(task.options, {"queue": "high"})
+        self.assertIsNone(self.engine.get_task("12345"))
+
+    def test_get_task_list(self):
+        second = self.engine.add_task(Task("second", when=950))
+        first = self.engine.add_task(Task("first", when=900))
+        third = self.engine.add_task(Task("third", when=999))
+        self.engine.add_task(Task("later", when=2000))
+
+        tasks = self.engine.get_task_list()
+        self.assertEqual([t.id for t in tasks], [first, second, third])
+
+        tasks = self.engine.get_task_list(limit=2)
+        self.assertEqual([t.id for t in tasks], [first, second])
+
+        self.assertEqual(len(self.engine.get_task_list(until=3000)), 4)
+        self.assertEqual(self.engine.get_next_when(), 900)
+
+    def test_reschedule(self):
+        task_id = self.engine.add_task(Task("foo", when=900, seconds=500))
+        task = self.engine.get_task(task_id)
+
+        self.assertTrue(self.engine.reschedule(task, recur=True))
+        self.assertEqual(self.engine.get_task(task_id).when, 1400)
+        self.assertTrue(self.engine.has_task_changed(Task("foo", when=900, id=task_id)))
+        self.assertFalse(self.engine.has_task_changed(task))
+
+        self.assertTrue(self.engine.reschedule(task))
+        self.assertEqual(self.engine.get_task(task_id).when, 1500)
+
+    def test_remove_task(self):
+        task_id = self.engine.add_task(Task("foo", when=900))
+
+        self.assertTrue(self.engine.remove_task(task_id))
+        self.assertFalse(self.engine.remove_task(task_id))
+        self.assertTrue(self.engine.has_task_changed(Task("foo", when=900, id=task_id)))
+        self.assertIsNone(self.engine.get_next_when())
+
+    def test_retry(self):
+        task_id = self.engine.add_task(Task("foo", when=900, backoff=5))
+
+        task = self.engine.get_task(task_id)
+        task.attempts = 2
+        self.assertTrue(self.engine.reschedule(task, delay=30))
+
+        task = self.engine.get_task(task_id)
+        self.assertEqual((task.when, task.attempts, task.backoff), (1030, 2, 5))
+
+    def test_dead_letters(self):
+        first = self.engine.add_task(
+            Task("first", when=900, max_attempts=3, options={"a": 1})
+        )
+        second = self.engine.add_task(Task("second", when=950))
+
+        task = self.engine.get_task(first)
+        task.attempts = 3
+        self.assertTrue(self.engine.dead_letter_task(task, "ValueError: oops"))
+        self.assertIsNone(self.engine.get_task(first))
+
+        self.engine._get_now = Mock(return_value=1001)
+        self.engine.dead_letter_task(self.engine.get_task(second), "later")
+
+        letters = self.engine.get_dead_letters()
+        self.assertEqual([letter.task.id for letter in letters], [second, first])
+        self.assertEqual(letters[1].error, "ValueError: oops")
+        self.assertEqual(letters[1].failed_at, 1000)
+        self.assertEqual(letters[1].task.attempts, 3)
+        self.assertEqual(letters[1].task.max_attempts, 3)
+        self.assertEqual(letters[1].task.options, {"a": 1})
+        self.assertEqual(len(self.engine.get_dead_letters(1)), 1)
+
+        self.assertTrue(self.engine.remove_dead_letter(first))
+        self.assertFalse(self.engine.remove_dead_letter(first))
+        self.assertEqual(
+            [letter.task.id for letter in self.engine.get_dead_letters()], [second]
+        )
+
+    def test_bulk(self):
+        listener = Mock()
+        self.engine.add_listener(listener)
+
+        ids = self.engine.add_tasks([Task("a", seconds=10), Task("b", when=900)])
+        self.assertEqual([self.engine.get_task(id).task for id in ids], ["a", "b"])
+        listener.assert_called_once_with(900)
+
+        tasks = [self.engine.get_task(id) for id in ids]
+        self.assertEqual(self.engine.reschedule_many(tasks), 2)
+        self.assertEqual(self.engine.get_task_list(), [])
+        self.assertEqual(self.engine.remove_tasks(ids + ["12345"]), 2)
+        self.assertIsNone(self.engine.get_next_when())
+        self.assertEqual(self.engine.add_tasks([]), [])
+
+    def test_claim_due_tasks(self):
+        first = self.engine.add_task(Task("first", when=900))
+        second = self.engine.add_task(Task("second", when=950))
+        self.engine.add_task(Task("later", when=2000))
+
+        claimed = self.engine.claim_due_tasks("worker-1", 10, 60)
+        self.assertEqual([t.id for t in claimed], [first, second])
+
+        # Claimed tasks keep their original schedule, but are leased in storage
+        self.assertEqual(claimed[0].when, 900)
+        self.assertEqual(self.engine.get_task(first).when, 1060)
+        self.assertEqual(self.engine.claim_due_tasks("worker-2", 10, 60), [])
+
+        self.engine._get_now = Mock(return_value=1061)
+        claimed = self.engine.claim_due_tasks("worker-2", 1, 60)
+        self.assertEqual([t.id for t in claimed], [first])
+
+        row = (
+            self.engine._get_connection()
+            .execute("SELECT status, owner FROM tasks WHERE id = ?", (int(first),))
+            .fetchone()
+        )
+        self.assertEqual(row, ("leased", "worker-2"))
+
+        self.engine.reschedule(claimed[0], recur=True)
+        row = (
+            self.engine._get_connection()
+            .execute("SELECT status, owner FROM tasks WHERE id = ?", (int(first),))
+            .fetchone()
+        )
+        self.assertEqual(row, ("pending", None))
+
+    def test_claim_due_tasks_without_returning(self):
+        with patch("pytasched.engines._SQLITE_RETURNING", False):
+            self.test_claim_due_tasks()
+
+    def test_claim_task(self):
+        task_id = self.engine.add_task(Task("task", when=1010))
+        task = self.engine.get_task(task_id)
+        stale = self.engine.get_task(task_id)
+
+        self.assertTrue(self.engine.claim_task(task, "worker-1", 60))
+        self.assertEqual(self.engine.get_task(task_id).when, 1060)
+        self.assertFalse(self.engine.claim_task(stale, "worker-2", 60))
+
+    def test_extend_claims(self):
+        first = self.engine.add_task(Task("first", when=900))
+        second = self.engine.add_task(Task("second", when=950, seconds=100))
+        claimed = self.engine.claim_due_tasks("worker-1", 10, 60)
+
+        # Still running when the leases are about to expire
+        self.engine._get_now = Mock(return_value=1050)
+        self.assertEqual(self.engine.extend_claims(claimed, "worker-1", 60), 2)
+        self.assertEqual(self.engine.get_task(first).when, 1110)
+        self.assertEqual(self.engine.extend_claims(claimed, "worker-2", 60), 0)
+
+        # Completed tasks are left alone
+        self.engine.reschedule(claimed[1])
+        self.assertEqual(self.engine.extend_claims(claimed, "worker-1", 60), 1)
+        self.assertEqual(self.engine.get_task(second).when, 1150)
+
+    def test_concurrent_claims(self):
+        self.engine.add_tasks([Task(str(i), when=i) for i in range(200)])
+        claimed = []
+
+        def claim(worker_id):
+            # Each thread uses its own connection to the database
+            engine = SQLiteStorageEngine(self.params)
+            while True:
+                tasks = engine.claim_due_tasks(worker_id, 7, 60)
+                if not tasks:
+                    return
+                claimed.extend(task.id for task in tasks)
+
+        threads = [Thread(target=claim, args=(str(i),)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(claimed), 200)
+        self.assertEqual(len(set(claimed)), 200)
+
+
+@skipIf(fakeredis is None, "Needs fakeredis and lupa")
+class TestRedisStorageEngine(TestCase):
+    def setUp(self):
+        self.client = fakeredis.FakeStrictRedis(decode_responses=True)
+        self.engine = RedisStorageEngine({"prefix": "test"}, client=self.client)
+        self.engine._get_now = Mock(return_value=1000)
+
+    def tearDown(self):
+        self.client.flushall()
+
+    def test_get_task_names(self):
+        self.engine.add_tasks(
+            [Task("a", seconds=5), Task("b", seconds=86400), Task("a", seconds=1)]
+        )
+
+        self.assertEqual(self.engine.get_task_names(), {"a", "b"})
+
+    def test_add_task(self):
+        listener = Mock()
+        self.engine.add_listener(listener)
+
+        task_id = self.engine.add_task(
+            Task(
+                "foo",
+                args=[1],
+                kwargs={"a": "b"},
+                seconds=5,
+                recurring=True,
+                options={"queue": "high"},
+            )
+        )
+        listener.assert_called_once_with(1005)
+        self.assertEqual(self.client.zscore("test:schedule", task_id), 1005)
+
+        task = self.engine.get_task(task_id)
+        self.assertEqual(task.id, task_id)
+        self.assertEqual(task.task, "foo")
+        self.assertEqual(task.args, [1])
+        self.assertEqual(task.kwargs, {"a": "b"})
+        self.assertEqual(task.wait, 5)
+        self.assertTrue(task.recurring)
+        self.assertEqual(task.when, 1005)
+        self.assertEqual(task.options, {"queue": "high"})
+        self.assertIsNone(self.engine.get_task("12345"))
+
+    def test_get_task_list(self):
+        second = self.engine.add_task(Task("second", when=950))
+        first = self.engine.add_task(Task("first", when=900))
+        third = self.engine.add_task(Task("third", when=999))
+        self.engine.add_task(Task("later", when=2000))
+
+        tasks = self.engine.get_task_list()
+        self.assertEqual([t.id for t in tasks], [first, second, third])
+
+        tasks = self.engine.get_task_list(limit=2)
+        self.assertEqual([t.id for t in tasks], [first, second])
+
+        self.assertEqual(len(self.engine.get_task_list(until=3000)), 4)
+        self.assertEqual(self.engine.get_next_when(), 900)
+
+    def test_reschedule(self):
+        task_id = self.engine.add_task(Task("foo", when=900, seconds=500))
+        task = self.engine.get_task(task_id)
+
+        self.assertTrue(self.engine.reschedule(task, recur=True))
+        self.assertEqual(self.engine.get_task(task_id).when, 1400)
+        self.assertEqual(self.engine.get_next_when(), 1400)
+        self.assertTrue(self.engine.has_task_changed(Task("foo", when=900, id=task_id)))
+        self.assertFalse(self.engine.has_task_changed(task))
+
+        self.engine.remove_task(task_id)
+        self.assertFalse(self.engine.reschedule(task))
+        self.assertIsNone(self.engine.get_next_when())
+
+    def test_remove_task(self):
+        task_id = self.engine.add_task(Task("foo", when=900))
+
+        self.assertTrue(self.engine.remove_task(task_id))
+        self.assertFalse(self.engine.remove_task(task_id))
+        self.assertTrue(self.engine.has_task_changed(Task("foo", when=900, id=task_id)))
+        self.assertEqual(self.client.keys("test:task:*"), [])
+
+    def test_retry(self):
+        task_id = self.engine.add_task(Task("foo", when=900, backoff=5))
+
+        task = self.engine.get_task(task_id)
+        task.attempts = 2
+        self.assertTrue(self.engine.reschedule(task, delay=30))
+
+        task = self.engine.get_task(task_id)
+        self.assertEqual((task.when, task.attempts, task.backoff), (1030, 2, 5))
+
+    def test_dead_letters(self):
+        first = self.engine.add_task(
+            Task("first", when=900, max_attempts=3, options={"a": 1})
+        )
+        second = self.engine.add_task(Task("second", when=950))
+
+        task = self.engine.get_task(first)
+        task.attempts = 3
+        self.assertTrue(self.engine.dead_letter_task(task, "ValueError: oops"))
+        self.assertIsNone(self.engine.get_task(first))
+
+        self.engine._get_now = Mock(return_value=1001)
+        self.engine.dead_letter_task(self.engine.get_task(second), "later")
+
+        letters = self.engine.get_dead_letters()
+        self.assertEqual([letter.task.id for letter in letters], [second, first])
+        self.assertEqual(letters[1].error, "ValueError: oops")
+        self.assertEqual(letters[1].failed_at, 1000)
+        self.assertEqual(letters[1].task.attempts, 3)
+        self.assertEqual(letters[1].task.max_attempts, 3)
+        self.assertEqual(letters[1].task.options, {"a": 1})
+        self.assertEqual(len(self.engine.get_dead_letters(1)), 1)
+
+        self.assertTrue(self.engine.remove_dead_letter(first))
+        self.assertFalse(self.engine.remove_dead_letter(first))
+        self.assertEqual(
+            [letter.task.id for letter in self.engine.get_dead_letters()], [second]
+        )
+
+    def test_bulk(self):
+        listener = Mock()
+        self.engine.add_listener(listener)
+
+        ids = self.engine.add_tasks([Task("a", seconds=10), Task("b", when=900)])
+        self.assertEqual([self.engine.get_task(id).task for id in ids], ["a", "b"])
+        listener.assert_called_once_with(900)
+
+        tasks = [self.engine.get_task(id) for id in ids]
+        self.assertEqual(self.engine.reschedule_many(tasks), 2)
+        self.assertEqual(self.engine.get_task_list(), [])
+        self.assertEqual(self.engine.remove_tasks(ids + ["12345"]), 2)
+        self.assertIsNone(self.engine.get_next_when())
+        self.assertEqual(self.engine.add_tasks([]), [])
+
+    def test_claim_due_tasks(self):
+        first = self.engine.add_task(Task("first", when=900))
+        second = self.engine.add_task(Task("second", when=950, options={"a": 1}))
+        self.engine.add_task(Task("later", when=2000))
+
+        claimed = self.engine.claim_due_tasks("worker-1", 10, 60)
+        self.assertEqual([t.id for t in claimed], [first, second])
+        self.assertEqual([t.options for t in claimed], [None, {"a": 1}])
+
+        # Claimed tasks keep their original schedule, but are leased in storage
+        self.assertEqual(claimed[0].when, 900)
+        self.assertEqual(self.engine.get_task(first).when, 1060)
+        self.assertEqual(self.engine.claim_due_tasks("worker-2", 10, 60), [])
+
+        self.engine._get_now = Mock(return_value=1061)
+        claimed = self.engine.claim_due_tasks("worker-2", 1, 60)
+        self.assertEqual([t.id for t in claimed], [first])
+
+        key = "test:task:" + first
+        self.assertEqual(
+            self.client.hmget(key, "status", "owner"), ["leased", "worker-2"]
+        )
+
+        self.engine.reschedule(claimed[0], recur=True)
+        self.assertEqual(self.client.hmget(key, "status", "owner"), ["pending", None])
+
+    def test_claim_task(self):
+        task_id = self.engine.add_task(Task("task", when=1010))
+        task = self.engine.get_task(task_id)
+        stale = self.engine.get_task(task_id)
+
+        self.assertTrue(self.engine.claim_task(task, "worker-1", 60))
+        self.assertEqual(self.engine.get_task(task_id).when, 1060)
+        self.assertFalse(self.engine.claim_task(stale, "worker-2", 60))
+
+    def test_extend_claims(self):
+        first = self.engine.add_task(Task("first", when=900))
+        second = self.engine.add_task(Task("second", when=950, seconds=100))
+        claimed = self.engine.claim_due_tasks("worker-1", 10, 60)
+
+        # Still running when the leases are about to expire
+        self.engine._get_now = Mock(return_value=1050)
+        self.assertEqual(self.engine.extend_claims(claimed, "worker-1", 60), 2)
+        self.assertEqual(self.engine.get_task(first).when, 1110)
+        self.assertEqual(self.engine.extend_claims(claimed, "worker-2", 60), 0)
+
+        # Completed tasks are left alone
+        self.engine.reschedule(claimed[1])
+        self.assertEqual(self.engine.extend_claims(claimed, "worker-1", 60), 1)
+        self.assertEqual(self.engine.get_task(second).when, 1150)
+
+
+@skipUnless(
+    os.environ.get("PYTASCHED_TEST_POSTGRES"),
+    "Set PYTASCHED_TEST_POSTGRES to a DSN to test against PostgreSQL",
+)
+class TestPostgresStorageEngine(TestCase):
+    def setUp(self):
+        self.params = {
+            "dsn": os.environ.get("PYTASCHED_TEST_POSTGRES"),
+            "table": "pytasched_test_tasks",
+            "watch": True,
+        }
+        self.engine = PostgresStorageEngine(self.params)
+        self.engine._get_now = Mock(return_value=1000)
+
+    def tearDown(self):
+        self.engine.unwatch()
+        with self.engine._cursor() as cursor:
+            cursor.execute("DROP TABLE pytasched_test_tasks")
+
+    def test_get_task_names(self):
+        self.engine.add_tasks(
+            [Task("a", seconds=5), Task("b", seconds=86400), Task("a", seconds=1)]
+        )
+
+        self.assertEqual(self.engine.get_task_names(), {"a", "b"})
+
+    def test_add_task(self):
+        task_id = self.engine.add_task(
+            Task(
+                "foo",
+                args=[1],
+                kwargs={"a": "b"},
+                seconds=5,
+                recurring=True,
+                options={"queue": "high"},
+            )
+        )
+
+        task = self.engine.get_task(task_id)
+        self.assertEqual(task.id, task_id)
+        self.assertEqual(task.task, "foo")
+        self.assertEqual(task.args, [1])
+        self.assertEqual(task.kwargs, {"a": "b"})
+        self.assertEqual(task.wait, 5)
+        self.assertTrue(task.recurring)
+        self.assertEqual(task.when, 1005)
+        self.assertEqual(task.options, {"queue": "high"})
+        self.assertIsNone(self.engine.get_task("12345"))
+
+    def test_get_task_list(self):
+        second = self.engine.add_task(Task("second", when=950))
+        first = self.engine.add_task(Task("first", when=900))
+        third = self.engine.add_task(Task("third", when=999))
+        self.engine.add_task(Task("later", when=2000))
+
+        tasks = self.engine.get_task_list()
+        self.assertEqual([t.id for t in tasks], [first, second, third])
+
+        tasks = self.engine.get_task_list(limit=2)
+        self.assertEqual([t.id for t in tasks], [first, second])
+
+        self.assertEqual(len(self.engine.get_task_list(until=3000)), 4)
+        self.assertEqual(self.engine.get_next_when(), 900)
+
+    def test_reschedule(self):
+        task_id = self.engine.add_task(Task("foo", when=900, seconds=500))
+        task = self.engine.get_task(task_id)
+
+        self.assertTrue(self.engine.reschedule(task, recur=True))
+        self.assertEqual(self.engine.get_task(task_id).when, 1400)
+        self.assertTrue(self.engine.has_task_changed(Task("foo", when=900, id=task_id)))
+        self.assertFalse(self.engine.has_task_changed(task))
+
+    def test_retry(self):
+        task_id = self.engine.add_task(Task("foo", when=900, backoff=5))
+
+        task = self.engine.get_task(task_id)
+        task.attempts = 2
+        self.assertTrue(self.engine.reschedule(task, delay=30))
+
+        task = self.engine.get_task(task_id)
+        self.assertEqual((task.when, task.attempts, task.backoff), (1030, 2, 5))
+
+    def test_dead_letters(self):
+        first = self.engine.add_task(
+            Task("first", when=900, max_attempts=3, options={"a": 1})
+        )
+        second = self.engine.add_task(Task("second", when=950))
+
+        task = self.engine.get_task(first)
+        task.attempts = 3
+        self.assertTrue(self.engine.dead_letter_task(task, "ValueError: oops"))
+        self.assertIsNone(self.engine.get_task(first))
+
+        self.engine._get_now = Mock(return_value=1001)
+        self.engine.dead_letter_task(self.engine.get_task(second), "later")
+
+        letters = self.engine.get_dead_letters()
+        self.assertEqual([letter.task.id for letter in letters], [second, first])
+        self.assertEqual(letters[1].error, "ValueError: oops")
+        self.assertEqual(letters[1].failed_at, 1000)
+        self.assertEqual(letters[1].task.attempts, 3)
+        self.assertEqual(letters[1].task.max_attempts, 3)
+        self.assertEqual(letters[1].task.options, {"a": 1})
+        self.assertEqual(len(self.engine.get_dead_letters(1)), 1)
+
+        self.assertTrue(self.engine.remove_dead_letter(first))
+        self.assertFalse(self.engine.remove_dead_letter(first))
+        self.assertEqual(
+            [letter.task.id for letter in self.engine.get_dead_letters()], [second]
+        )
+
+    def test_bulk(self):
+        ids = self.engine.add_tasks([Task("a", seconds=10), Task("b", when=900)])
+        self.assertEqual([self.engine.get_task(id).task for id in ids], ["a", "b"])
+
+        tasks = [self.engine.get_task(id) for id in ids]
+        self.assertEqual(self.engine.reschedule_many(tasks), 2)
+        self.assertEqual(self.engine.get_task_list(), [])
+        self.assertEqual(self.engine.remove_tasks(ids + ["12345"]), 2)
+        self.assertFalse(self.engine.remove_task(ids[0]))
+        self.assertIsNone(self.engine.get_next_when())
+
+    def test_claim_due_tasks(self):
+        first = self.engine.add_task(Task("first", when=900))
+        second = self.engine.add_task(Task("second", when=950))
+        self.engine.add_task(Task("later", when=2000))
+
+        claimed = self.engine.claim_due_tasks("worker-1", 10, 60)
+        self.assertEqual([t.id for t in claimed], [first, second])
+        self.assertEqual(claimed[0].when, 900)
+        self.assertEqual(self.engine.get_task(first).when, 1060)
+        self.assertEqual(self.engine.claim_due_tasks("worker-2", 10, 60), [])
+
+        self.engine._get_now = Mock(return_value=1061)
+        claimed = self.engine.claim_due_tasks("worker-2", 1, 60)
+        self.assertEqual([t.id for t in claimed], [first])
+
+    def test_claim_task(self):
+        task_id = self.engine.add_task(Task("task", when=1010))
+        task = self.engine.get_task(task_id)
+        stale = self.engine.get_task(task_id)
+
+        self.assertTrue(self.engine.claim_task(task, "worker-1", 60))
+        self.assertEqual(self.engine.get_task(task_id).when, 1060)
+        self.assertFalse(self.engine.claim_task(stale, "worker-2", 60))
+
+    def test_extend_claims(self):
+        first = self.engine.add_task(Task("first", when=900))
+        second = self.engine.add_task(Task("second", when=950, seconds=100))
+        claimed = self.engine.claim_due_tasks("worker-1", 10, 60)
+
+        # Still running when the leases are about to expire
+        self.engine._get_now = Mock(return_value=1050)
+        self.assertEqual(self.engine.extend_claims(claimed, "worker-1", 60), 2)
+        self.assertEqual(self.engine.get_task(first).when, 1110)
+        self.assertEqual(self.engine.extend_claims(claimed, "worker-2", 60), 0)
+
+        # Completed tasks are left alone
+        self.engine.reschedule(claimed[1])
+        self.assertEqual(self.engine.extend_claims(claimed, "worker-1", 60), 1)
+        self.assertEqual(self.engine.get_task(second).when, 1150)
+
+    def test_watch(self):
+        listener = Mock()
+        self.engine.add_listener(listener)
+        self.assertTrue(self.engine.watch())
+
+        # Another engine adding a task wakes us up
+        other = PostgresStorageEngine(self.params)
+        other.add_task(Task("foo", when=1234.5))
+
+        for _ in range(50):
+            if listener.call_count:
+                break
+            sleep(0.1)
+
+        listener.assert_called_with(1234.5)
+
 
 class TestTaskEngine(TestCase):
     def test_not_implemented(self):
         pass
 
 
+def _add(a, b=0):
+    _added.append(a + b)
+
+
+_added = []
+
+
 class TestFunctionTaskEngine(TestCase):
+    def setUp(self):
+        del _added[:]
+
     def test_run(self):
-        pass
+        engine = FunctionTaskEngine({"cache_size": 1})
+
+        engine.run(Task("pytasched.test.test_engines:_add", args=[1], kwargs={"b": 2}))
+        engine.run(Task("pytasched.test.test_engines:_add", args=[3]))
+        self.assertEqual(_added, [3, 3])
+        self.assertEqual(len(engine.callables), 1)
+
+        engine.clear_cache()
+        self.assertEqual(len(engine.callables), 0)
+
+        self.assertRaises(ValueError, engine.run, Task("pytasched.test.nope:_add"))
+
+    def test_prepare(self):
+        engine = FunctionTaskEngine({})
+
+        failed = engine.prepare(
+            {"pytasched.test.test_engines:_add", "pytasched.test.test_engines:nope"}
+        )
+
+        self.assertEqual(failed, ["pytasched.test.test_engines:nope"])
+        self.assertEqual(len(engine.callables), 1)
 
 
 class TestShellTaskEngine(TestCase):
     def test_styles(self):
-        pass
+        self.assertRaises(TaskEngineError, ShellTaskEngine, {})
+        self.assertRaises(TaskEngineError, ShellTaskEngine, {"style": "nope"})
+
+        for style in ShellTaskEngine.STYLES:
+            engine = pickle.loads(pickle.dumps(ShellTaskEngine({"style": style})))
+            self.assertEqual(engine.params["style"], style)
 
     def test_run(self):
-        pass
+        engine = ShellTaskEngine({"style": "subprocess"})
+
+        result = engine.run(Task("echo {} '{name}'", args=[1], kwargs={"name": "a b"}))
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(result.stdout, "1 a b\n")
+
+        self.assertRaises(TaskEngineError, engine.run, Task("false"))
+        self.assertRaises(
+            TaskEngineError, engine.run, Task("pytasched-no-such-command")
+        )
+
+    def test_timeout(self):
+        engine = ShellTaskEngine({"style": "subprocess", "timeout": 0.1})
+
+        start = time()
+        self.assertRaises(TaskEngineError, engine.run, Task("sleep 10"))
+        self.assertLess(time() - start, 5)
+
+    def test_max_output(self):
+        engine = ShellTaskEngine({"style": "subprocess", "max_output": 10})
+        script = "import sys; sys.stdout.write('x' * 100000)"
+
+        result = engine.run(Task("{} -c {}".format(sys.executable, quote(script))))
+        self.assertEqual(result.stdout, "x" * 10 + "\n[99990 more bytes]")
+
+    def test_pool(self):
+        engine = ShellTaskEngine({"style": "pool", "max_workers": 2})
+
+        start = time()
+        futures = [engine.run(Task("sleep 0.3")) for _ in range(2)]
+        failed = engine.run(Task("false"))
+
+        for future in futures:
+            self.assertEqual(future.result(5).returncode, 0)
+
+        self.assertRaises(TaskEngineError, failed.result, 5)
+
+        # The sleeps ran at the same time
+        self.assertLess(time() - start, 0.6)
+
+    def test_pool_in_process_executor(self):
+        engine = ShellTaskEngine({"style": "pool"})
+
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            result = executor.submit(run_task, engine, Task("echo hi")).result(10)
+            self.assertEqual(result.stdout, "hi\n")
+
+            failed = executor.submit(run_task, engine, Task("false"))
+            self.assertRaises(TaskEngineError, failed.result, 10)
+
+        self.assertIsNone(engine.pool)
+
+
+def _get_message(app, queue):
+    """
+    Get the next message published to the queue on the in-memory broker
+
+    :return tuple: Task name, args, kwargs
+    """
+
+    with app.connection() as connection:
+        message = connection.SimpleQueue(queue).get(timeout=1)
+        message.ack()
+
+    if "task" in message.headers:
+        args, kwargs = message.payload[:2]
+        return message.headers["task"], args, kwargs
+
+    payload = message.payload
+    return payload["task"], payload["args"], payload["kwargs"]
+
+
+@skipIf(Celery is None, "Needs celery")
+class TestCeleryTaskEngine(TestCase):
+    def setUp(self):
+        self.app = Celery("pytasched-test", broker="memory://")
+        self.engine = CeleryTaskEngine({"app": self.app, "max_delay": 60})
+
+        with self.app.connection() as connection:
+            for queue in ("celery", "high"):
+                connection.SimpleQueue(queue).clear()
+
+    def test_params(self):
+        self.assertRaises(TaskEngineError, CeleryTaskEngine, {})
+
+        engine = pickle.loads(pickle.dumps(CeleryTaskEngine({"app": "nope:app"})))
+        self.assertEqual(engine.prepare({"a"}), ["a"])
+
+    def test_flush(self):
+        futures = [
+            self.engine.run(Task("workers.add", args=[1, 2])),
+            self.engine.run(
+                Task("workers.add", kwargs={"a": 3}, options={"queue": "high"})
+            ),
+        ]
+
+        self.assertFalse(any(future.done() for future in futures))
+        self.assertEqual(self.engine.flush(), 2)
+        self.assertEqual(self.engine.flush(), 0)
+
+        for future in futures:
+            self.assertTrue(future.result(0))
+
+        self.assertEqual(_get_message(self.app, "celery"), ("workers.add", [1, 2], {}))
+        self.assertEqual(_get_message(self.app, "high"), ("workers.add", [], {"a": 3}))
+
+    def test_max_delay(self):
+        engine = CeleryTaskEngine({"app": self.app, "max_delay": 0.01})
+
+        future = engine.run(Task("workers.add", args=[1, 2]))
+        self.assertTrue(future.result(5))
+        self.assertEqual(_get_message(self.app, "celery"), ("workers.add", [1, 2], {}))
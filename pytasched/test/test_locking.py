@@ -0,0 +1,86 @@
+from __future__ import unicode_literals
+
+from unittest import TestCase
+
+import mongomock
+from mock import Mock
+
+from pytasched.locking import MemcachedBatchLocks, MongoBatchLocks
+
+
+class TestMongoBatchLocks(TestCase):
+    def setUp(self):
+        self.collection = mongomock.MongoClient().pytasched.pytasched_locks
+
+    def test_acquire_many(self):
+        first = MongoBatchLocks("first", 60.0, self.collection)
+        second = MongoBatchLocks("second", 60.0, self.collection)
+
+        self.assertEqual(first.acquire_many(["a", "b"]), ["a", "b"])
+        self.assertEqual(second.acquire_many(["b", "c", "a"]), ["c"])
+        self.assertEqual(first.acquire_many([]), [])
+
+        # Only our own locks are released
+        second.release_many(["a", "b", "c"])
+        self.assertEqual(first.acquire_many(["c"]), ["c"])
+        self.assertEqual(second.acquire_many(["a", "b"]), [])
+
+        first.release_many(["a", "b", "c"])
+        self.assertEqual(self.collection.count_documents({}), 0)
+
+    def test_expire(self):
+        first = MongoBatchLocks("first", -1.0, self.collection)
+        second = MongoBatchLocks("second", 60.0, self.collection)
+
+        self.assertEqual(first.acquire_many(["a", "b"]), ["a", "b"])
+        self.assertEqual(second.acquire_many(["a"]), ["a"])
+
+        # Renewing doesn't take back the locks we've lost
+        first.ttl = 60.0
+        first.renew_many(["a", "b"])
+        self.assertEqual(self.collection.find_one({"_id": "a"})["owner"], "second")
+        self.assertEqual(second.acquire_many(["a", "b"]), [])
+
+
+class TestMemcachedBatchLocks(TestCase):
+    def test_batch_calls(self):
+        client = Mock()
+        client.add_multi.return_value = ["b"]
+        locks = MemcachedBatchLocks("first", 9.5, client)
+
+        self.assertEqual(locks.acquire_many(["a", "b", "c"]), ["a", "c"])
+        client.add_multi.assert_called_once_with(
+            {"a": "first", "b": "first", "c": "first"}, time=10
+        )
+
+        client.get_multi.return_value = {"a": "first", "c": "first"}
+        locks.renew_many(["a", "c"])
+        client.get_multi.assert_called_once_with(["a", "c"])
+        client.set_multi.assert_called_once_with({"a": "first", "c": "first"}, time=10)
+
+        locks.release_many(["a", "c"])
+        client.delete_multi.assert_called_once_with(["a", "c"])
+
+        locks.release_many([])
+        self.assertEqual(client.delete_multi.call_count, 1)
+        self.assertEqual(client.get_multi.call_count, 2)
+
+    def test_other_owner(self):
+        client = Mock()
+        locks = MemcachedBatchLocks("first", 9.5, client)
+
+        # "a" expired and was taken by someone else, "b" expired
+        client.get_multi.return_value = {"a": "second", "c": "first"}
+
+        locks.renew_many(["a", "b", "c"])
+        client.set_multi.assert_called_once_with({"c": "first"}, time=10)
+
+        locks.release_many(["a", "b", "c"])
+        client.delete_multi.assert_called_once_with(["c"])
+
+        # Nothing left to write
+        client.get_multi.return_value = {"a": "second"}
+        locks.renew_many(["a"])
+        locks.release_many(["a"])
+        self.assertEqual(client.set_multi.call_count, 1)
+        self.assertEqual(client.delete_multi.call_count, 1)
@@ -2,6 +2,8 @@ from __future__ import unicode_literals
 
 from unittest import TestCase
 
+from mock import Mock
+
 from pytasched.tasks import Task
 
 
@@ -36,3 +38,12 @@ class TestTask(TestCase):
 
         t = Task("test", id="abc123")
         self.assertEqual(t.id, "abc123")
+
+    def test_add_many(self):
+        engine = Mock()
+        engine.add_tasks.return_value = ["id1", "id2"]
+
+        tasks = [Task("a"), Task("b")]
+        self.assertEqual(Task.add_many(tasks, engine=engine), ["id1", "id2"])
+        self.assertEqual([t.id for t in tasks], ["id1", "id2"])
+        engine.add_tasks.assert_called_once_with(tasks)
@@ -1,6 +1,16 @@
 from __future__ import unicode_literals
+import pickle
+from threading import Timer
+from time import time
 from unittest import TestCase
-from pytasched.tools import get_duration, load_from_module, TickManager
+from pytasched.tools import (
+    CallableCache,
+    get_backoff,
+    get_duration,
+    load_from_module,
+    DueTimeWaiter,
+    TickManager,
+)
 
 
 class TestTools(TestCase):
@@ -19,13 +29,64 @@ class TestTools(TestCase):
 
         self.assertEqual(combined, expected)
 
+    def test_get_backoff(self):
+        self.assertEqual(get_backoff(1, 10, 3600), 10)
+        self.assertEqual(get_backoff(3, 10, 3600), 40)
+        self.assertEqual(get_backoff(100, 10, 3600), 3600)
+        self.assertEqual(get_backoff(10000, 10, 3600), 3600)
+
+        for _ in range(100):
+            self.assertTrue(5 <= get_backoff(2, 10, 3600, jitter=0.75) <= 20)
+
     def test_load_from_module(self):
         tc = load_from_module("unittest:TestCase")
         self.assertEqual(tc, TestCase)
 
+    def test_CallableCache(self):
+        cache = CallableCache(2)
+
+        self.assertIs(cache.get("unittest:TestCase"), TestCase)
+        self.assertIs(cache.get("unittest:TestCase"), TestCase)
+        self.assertEqual(len(cache), 1)
+
+        # The least recently used one is dropped
+        cache.get("threading:Timer")
+        cache.get("unittest:TestCase")
+        cache.get("time:time")
+        self.assertEqual(list(cache._callables), ["unittest:TestCase", "time:time"])
+
+        self.assertRaises(ValueError, cache.get, "unittest:Nope")
+        self.assertEqual(len(cache), 2)
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+        cache.get("time:time")
+        copied = pickle.loads(pickle.dumps(cache))
+        self.assertEqual(copied.size, 2)
+        self.assertEqual(len(copied), 0)
+
     def test_TickManager(self):
         tm = TickManager(0.0001)
         self.assertTrue(tm.tick())
         self.assertTrue(tm.tick())
         tm.stop()
         self.assertFalse(tm.tick())
+
+    def test_DueTimeWaiter(self):
+        waiter = DueTimeWaiter(0.5, 10)
+        self.assertEqual(waiter.get_delay(None), 10)
+        self.assertEqual(waiter.get_delay(0), 0.5)
+        self.assertEqual(waiter.get_delay(time() + 3600), 10)
+        self.assertAlmostEqual(waiter.get_delay(time() + 2), 2, places=1)
+
+        # Notifications about things due later than the wait don't wake us up
+        waiter = DueTimeWaiter(0, 10)
+        Timer(0.05, waiter.notify, [time() + 60]).start()
+        Timer(0.1, waiter.notify, [time()]).start()
+        start = time()
+        self.assertTrue(waiter.wait(None))
+        self.assertLess(time() - start, 1)
+
+        waiter.stop()
+        self.assertFalse(waiter.wait(None))
@@ -0,0 +1,92 @@
+from __future__ import unicode_literals
+
+import os
+from unittest import TestCase
+
+from pytasched.engines import FunctionTaskEngine
+from pytasched.errors import TaskEngineError
+from pytasched.tasks import Task
+from pytasched.workers import WorkerPool
+
+
+def _add(a, b=0):
+    return a + b
+
+
+def _get_pid():
+    return os.getpid()
+
+
+def _fail(message):
+    raise ValueError(message)
+
+
+def _die():
+    os._exit(1)
+
+
+class TestWorkerPool(TestCase):
+    def setUp(self):
+        self.pool = WorkerPool(2, max_tasks=3)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_submit(self):
+        future = self.pool.submit("pytasched.test.test_workers:_add", [1], {"b": 2})
+        self.assertEqual(future.result(5), 3)
+
+        pids = {
+            self.pool.submit("pytasched.test.test_workers:_get_pid", [], {}).result(5)
+            for _ in range(2)
+        }
+        self.assertNotIn(os.getpid(), pids)
+
+    def test_errors(self):
+        future = self.pool.submit("pytasched.test.test_workers:_fail", ["oops"], {})
+        self.assertRaisesRegex(TaskEngineError, "ValueError: oops", future.result, 5)
+
+        future = self.pool.submit("pytasched.test.test_workers:_nope", [], {})
+        self.assertRaisesRegex(TaskEngineError, "not valid", future.result, 5)
+
+        # A dead worker is replaced
+        future = self.pool.submit("pytasched.test.test_workers:_die", [], {})
+        self.assertRaisesRegex(TaskEngineError, "died", future.result, 5)
+        self.assertEqual(self.pool.recycled, 1)
+
+        future = self.pool.submit("pytasched.test.test_workers:_add", [1], {})
+        self.assertEqual(future.result(5), 1)
+
+    def test_recycle(self):
+        pool = WorkerPool(1, max_tasks=2)
+        self.addCleanup(pool.close)
+
+        pids = [
+            pool.submit("pytasched.test.test_workers:_get_pid", [], {}).result(5)
+            for _ in range(4)
+        ]
+
+        self.assertEqual(pids[0], pids[1])
+        self.assertNotEqual(pids[1], pids[2])
+        self.assertEqual(pids[2], pids[3])
+        self.assertEqual(pool.recycled, 2)
+
+    def test_max_memory(self):
+        pool = WorkerPool(1, max_memory=1)
+        self.addCleanup(pool.close)
+
+        pool.submit("pytasched.test.test_workers:_add", [1], {}).result(5)
+        pool.submit("pytasched.test.test_workers:_add", [1], {}).result(5)
+        self.assertEqual(pool.recycled, 2)
+
+
+class TestFunctionTaskEngineProcesses(TestCase):
+    def test_run(self):
+        engine = FunctionTaskEngine({"processes": 2})
+        self.addCleanup(engine.close)
+
+        self.assertEqual(engine.prepare({"pytasched.test.test_workers:_add"}), [])
+        self.assertEqual(engine.workers.preload, ["pytasched.test.test_workers:_add"])
+
+        future = engine.run(Task("pytasched.test.test_workers:_add", args=[2, 3]))
+        self.assertEqual(future.result(5), 5)
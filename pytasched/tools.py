@@ -3,6 +3,9 @@ from __future__ import unicode_literals
 from builtins import str
 from builtins import object
 import importlib
+from collections import OrderedDict
+from random import random
+from threading import Event, Lock
 from time import time, sleep
 
 
@@ -29,6 +32,24 @@ def get_duration(days=0, hours=0, minutes=0, seconds=0, millis=0):
     return duration
 
 
+def get_backoff(attempts, backoff, max_backoff, jitter=0.0):
+    """
+    Get how long to wait before retrying something that has failed, doubling
+    the wait for every attempt up to a limit. Jitter takes a random share off
+    the wait, so things that failed together don't all retry at once.
+
+    :param int attempts: How many times it has failed so far, at least 1
+    :param float backoff: Seconds to wait after the first failure
+    :param float max_backoff: Longest wait in seconds
+    :param float jitter: Share of the wait to randomize, from 0 to 1
+    :return float: Seconds to wait
+    """
+
+    wait = min(max_backoff, backoff * 2 ** min(attempts - 1, 64))
+
+    return wait * (1 - min(1.0, max(0.0, jitter)) * random())
+
+
 class TickManager(object):
     """
     Makes tick-rate limiting of loops easy
@@ -72,6 +93,75 @@ class TickManager(object):
         self.running = False
 
 
+class DueTimeWaiter(object):
+    """
+    Waits until the next task is due, within limits, or until notified about a
+    task that is due earlier than that.
+    """
+
+    def __init__(self, min_wait, max_wait):
+        """
+        :param float min_wait: Minimum number of seconds to wait
+        :param float max_wait: Maximum number of seconds to wait
+        """
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        self.running = True
+        self.wake_at = None
+        self._event = Event()
+
+    def get_delay(self, next_when):
+        """
+        Get the number of seconds to wait for a task due at next_when
+
+        :param float|None next_when: None if nothing is known to be due
+        :return float:
+        """
+
+        if next_when is None:
+            return self.max_wait
+
+        return min(max(next_when - time(), self.min_wait), self.max_wait)
+
+    def wait(self, next_when):
+        """
+        Wait until next_when, or until notified of something earlier.
+
+        :param float|None next_when: None if nothing is known to be due
+        :return bool: If we should still be running
+        """
+
+        delay = self.get_delay(next_when)
+        self.wake_at = time() + delay
+
+        if self.running:
+            self._event.wait(delay)
+
+        self._event.clear()
+        self.wake_at = None
+
+        return self.running
+
+    def notify(self, when=None):
+        """
+        Wake up the waiting thread if something is due before it would
+        otherwise wake up.
+
+        :param float|None when: When the new thing is due, None for now
+        """
+
+        wake_at = self.wake_at
+        if when is None or wake_at is None or when < wake_at:
+            self._event.set()
+
+    def stop(self):
+        """
+        Stop waiting
+        """
+        self.running = False
+        self._event.set()
+
+
 def load_from_module(search_definition):
     """
     Dynamically load the module property as defined by the search parameter.
@@ -117,3 +207,62 @@ def load_from_module(search_definition):
             )
 
     return property
+
+
+class CallableCache(object):
+    """
+    LRU cache of the callables found with load_from_module, so running a task
+    again doesn't need to go through the import machinery.
+    """
+
+    def __init__(self, size=1024):
+        """
+        :param int size: Maximum number of callables to keep
+        """
+        self.size = size
+        self._callables = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._callables)
+
+    def __getstate__(self):
+        # For sending the task engines to process pools, the callables are
+        # loaded again on the other side
+        return {"size": self.size}
+
+    def __setstate__(self, state):
+        self.__init__(state["size"])
+
+    def get(self, search_definition):
+        """
+        Get the callable, loading it if it's not cached
+
+        :param str search_definition: module.path:property_name
+        :raises ValueError: In case the definition is invalid
+        :return callable:
+        """
+
+        with self._lock:
+            if search_definition in self._callables:
+                self._callables.move_to_end(search_definition)
+                return self._callables[search_definition]
+
+        # Not holding the lock while importing, the import has its own locks
+        runnable = load_from_module(search_definition)
+
+        with self._lock:
+            self._callables[search_definition] = runnable
+
+            while len(self._callables) > self.size:
+                self._callables.popitem(last=False)
+
+        return runnable
+
+    def clear(self):
+        """
+        Forget all the callables, e.g. when the modules are reloaded
+        """
+
+        with self._lock:
+            self._callables.clear()
@@ -0,0 +1,278 @@
+"""
+Pool of persistent worker processes for running Python functions, so CPU
+heavy tasks can use all the cores without starting a new interpreter for
+every task.
+"""
+from __future__ import unicode_literals
+
+import multiprocessing
+import pickle
+import resource
+import sys
+import traceback
+from builtins import object
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from threading import Lock
+
+from pytasched.errors import TaskEngineError
+from pytasched.tools import CallableCache
+
+# Sent to a worker to make it exit
+_STOP = b""
+
+
+def _dumps(message):
+    return pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+
+
+def _get_memory():
+    """
+    :return float: Peak resident memory of this process in MB
+    """
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Bytes on macOS, kilobytes elsewhere
+    if sys.platform == "darwin":
+        return peak / 1024.0 / 1024.0
+
+    return peak / 1024.0
+
+
+def _worker_main(connection, paths, preload, cache_size):
+    """
+    Main loop of a worker process, runs functions until told to stop
+
+    :param multiprocessing.connection.Connection connection:
+    :param list paths: Extra paths for sys.path
+    :param list preload: Functions to load before taking any tasks
+    :param int cache_size: Maximum number of functions to keep loaded
+    """
+
+    for path in paths:
+        if path not in sys.path:
+            sys.path.append(path)
+
+    callables = CallableCache(cache_size)
+
+    for name in preload:
+        try:
+            callables.get(name)
+        except ValueError:
+            # Reported when the task is run
+            pass
+
+    while True:
+        try:
+            message = connection.recv_bytes()
+        except (EOFError, KeyboardInterrupt):
+            break
+
+        if message == _STOP:
+            break
+
+        name, args, kwargs = pickle.loads(message)
+
+        try:
+            result = callables.get(name)(*args, **kwargs)
+            reply = (True, result, _get_memory())
+
+            try:
+                data = _dumps(reply)
+            except Exception:
+                data = _dumps((True, repr(result), _get_memory()))
+        except Exception:
+            data = _dumps((False, traceback.format_exc(), _get_memory()))
+
+        connection.send_bytes(data)
+
+    connection.close()
+
+
+class _Worker(object):
+    """
+    A worker process and the connection to it
+    """
+
+    def __init__(self, context, paths, preload, cache_size):
+        self.connection, child = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child, paths, preload, cache_size),
+            name="pytasched-worker",
+        )
+        self.process.daemon = True
+        self.process.start()
+        child.close()
+        self.tasks = 0
+        self.memory = 0.0
+        self.broken = False
+
+    def run(self, name, args, kwargs):
+        """
+        Run the function in the worker and wait for it
+
+        :return: What the function returned
+        :raises TaskEngineError: If the function raised or the worker died
+        """
+
+        self.tasks += 1
+
+        try:
+            self.connection.send_bytes(_dumps((name, args, kwargs)))
+            ok, result, self.memory = pickle.loads(self.connection.recv_bytes())
+        except (EOFError, OSError) as e:
+            # The process might not have exited yet, but it's of no use
+            self.broken = True
+            raise TaskEngineError(
+                "Worker {} died while running {}: {}".format(self.process.pid, name, e)
+            )
+
+        if not ok:
+            raise TaskEngineError(
+                "Task {} failed in worker {}:\n{}".format(
+                    name, self.process.pid, result
+                )
+            )
+
+        return result
+
+    def is_alive(self):
+        return not self.broken and self.process.is_alive()
+
+    def stop(self, timeout=5.0):
+        """
+        Ask the worker to exit, killing it if it doesn't
+        """
+
+        try:
+            self.connection.send_bytes(_STOP)
+        except (EOFError, OSError):
+            pass
+
+        self.process.join(timeout)
+
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+
+        self.connection.close()
+
+
+class WorkerPool(object):
+    """
+    Pre-forked worker processes that load the functions once and run them
+    for as long as they live. Workers are replaced after "max_tasks" tasks or
+    when they've used more than "max_memory" MB, to contain leaks.
+    """
+
+    def __init__(
+        self,
+        size,
+        paths=(),
+        max_tasks=None,
+        max_memory=None,
+        start_method=None,
+        cache_size=1024,
+    ):
+        """
+        :param int size: Number of worker processes
+        :param list paths: Extra paths for sys.path in the workers
+        :param int max_tasks: Replace workers after this many tasks
+        :param float max_memory: Replace workers using more MB than this
+        :param str start_method: multiprocessing start method, e.g. "fork"
+                                 or "forkserver", None for the default
+        :param int cache_size: Maximum number of functions to keep loaded
+        """
+        self.size = size
+        self.paths = list(paths)
+        self.max_tasks = max_tasks
+        self.max_memory = max_memory
+        self.cache_size = cache_size
+        self.preload = []
+        self.recycled = 0
+        self._context = multiprocessing.get_context(start_method)
+        self._idle = Queue()
+        self._workers = []
+        self._executor = None
+        self._lock = Lock()
+
+    def start(self):
+        """
+        Start the workers, if not running yet
+        """
+
+        with self._lock:
+            if self._executor is not None:
+                return
+
+            for _ in range(self.size):
+                self._idle.put(self._start_worker())
+
+            # A thread per worker to wait for its results
+            self._executor = ThreadPoolExecutor(max_workers=self.size)
+
+    def _start_worker(self):
+        worker = _Worker(self._context, self.paths, self.preload, self.cache_size)
+        self._workers.append(worker)
+        return worker
+
+    def _replace_worker(self, worker):
+        worker.stop()
+
+        with self._lock:
+            self._workers.remove(worker)
+            self.recycled += 1
+            return self._start_worker()
+
+    def _needs_replacing(self, worker):
+        if not worker.is_alive():
+            return True
+
+        if self.max_tasks and worker.tasks >= self.max_tasks:
+            return True
+
+        return bool(self.max_memory and worker.memory >= self.max_memory)
+
+    def _run(self, name, args, kwargs):
+        worker = self._idle.get()
+
+        try:
+            return worker.run(name, args, kwargs)
+        finally:
+            if self._needs_replacing(worker):
+                worker = self._replace_worker(worker)
+
+            self._idle.put(worker)
+
+    def submit(self, name, args, kwargs):
+        """
+        Run a function in one of the workers
+
+        :param str name: module.path:function_name
+        :param list args:
+        :param dict kwargs:
+        :return concurrent.futures.Future: For what the function returns
+        """
+
+        self.start()
+        return self._executor.submit(self._run, name, args, kwargs)
+
+    def close(self):
+        """
+        Wait for the running functions and stop the workers
+        """
+
+        with self._lock:
+            executor, self._executor = self._executor, None
+
+        if executor is None:
+            return
+
+        executor.shutdown(wait=True)
+
+        while not self._idle.empty():
+            self._idle.get().stop()
+
+        self._workers = []
@@ -8,30 +8,145 @@
 #
 
 # Storage engine configuration.
+# For MongoDB "watch" enables waking up for new tasks via change streams, which
+# needs a replica set, otherwise it falls back to polling every tick.
+# "indices" adds indexes or replaces the default ones, mapping a field or a
+# tuple of fields to create_index options, e.g.
+# {("task", "when"): {"partialFilterExpression": {"recurring": True}}}
+# "shards" splits the tasks to that many shards shared between the servers.
+# For SQLite use "pytasched.engines:SQLiteStorageEngine" with "path" to the
+# database file, and optionally "timeout" for waiting on other processes.
+# For Redis use "pytasched.engines:RedisStorageEngine" with "url" and
+# "prefix" for the keys.
+# For PostgreSQL use "pytasched.engines:PostgresStorageEngine" with "dsn",
+# "table", and "watch" to wake up via LISTEN/NOTIFY.
 STORAGE = {
     "engine": "pytasched.engines:MongoDBStorageEngine",
-    "params": {"indices": {},},
+    "params": {"indices": {}, "watch": False,},
 }
 
 # Task engine configuration
 TASKS = {"engine": "pytasched.engines:ShellTaskEngine", "params": {"style": "system",}}
 
+# Prepare the task engine for all the scheduled tasks when the server starts,
+# e.g. load the functions for FunctionTaskEngine, logging the ones that can't be
+# run. Needs to go through the names of all the tasks in storage.
+PREPARE_TASKS = False
+
+# Claim due tasks atomically in the storage engine instead of locking them one
+# by one, with this enabled LOCKS are not needed
+CLAIM_TASKS = True
+
+# How many seconds a claimed task is reserved for the server that claimed it.
+# The claims of tasks still running are extended every LEASE_SECONDS / 2, if
+# the server dies the tasks may run elsewhere once the lease runs out
+LEASE_SECONDS = 300.0
+
+# How many times to run a failing task before moving it to the dead letters,
+# unless the task has its own max_attempts
+MAX_ATTEMPTS = 5
+
+# Seconds to wait before retrying a failed task, doubled for every retry up to
+# MAX_RETRY_BACKOFF_SECONDS, and the share of it to randomize so tasks that
+# failed together don't all retry at once. Tasks can have their own.
+RETRY_BACKOFF_SECONDS = 10.0
+MAX_RETRY_BACKOFF_SECONDS = 3600.0
+RETRY_JITTER = 0.5
+
+# Maximum number of tasks to claim or load per tick
+BATCH_SIZE = 100
+
+# How to run tasks: "inline" runs them one by one in the server loop, "thread"
+# and "process" run them concurrently in a pool of threads or processes
+EXECUTOR = "inline"
+
+# Maximum number of tasks running at the same time with "thread" and "process"
+MAX_CONCURRENCY = 4
+
+# Run the asyncio server instead, STORAGE and TASKS then need to use the engines
+# in pytasched.aioengines, e.g. MotorStorageEngine and AsyncFunctionTaskEngine
+ASYNCIO = False
+
+# Maximum number of tasks running at the same time in the asyncio server
+MAX_IN_FLIGHT = 1000
+
+# Cache the tasks due in the next this many seconds in memory and run them from
+# there, refreshing the cache every LOOKAHEAD_SECONDS / 2 and when tasks are
+# added or rescheduled by this server or seen via "watch". None to disable.
+LOOKAHEAD_SECONDS = None
+
+# Maximum number of tasks to cache
+LOOKAHEAD_LIMIT = 10000
+
+# Identifier of this server in task claims, None to use hostname and PID
+WORKER_ID = None
+
+# How the servers share the work: "peers" all look for due tasks themselves,
+# "dispatcher" elects a leader that claims the due tasks and puts them in a
+# work queue in the storage engine for all the servers to take
+TOPOLOGY = "peers"
+
+# How long the dispatcher leadership lasts if the leader stops renewing it
+LEADER_LEASE_SECONDS = 15.0
+
+# With "shards" in the STORAGE params, each task is put in one of that many
+# shards and each server only looks for tasks in the shards it owns. Servers
+# send heartbeats every SHARD_HEARTBEAT_SECONDS, and if one stops for
+# SHARD_MEMBER_TIMEOUT seconds its shards are taken over by the others.
+SHARD_HEARTBEAT_SECONDS = 5.0
+SHARD_MEMBER_TIMEOUT = 20.0
+
+# Locks are only used if CLAIM_TASKS is disabled
 # None if no locks are needed
 # "sherlock" - If we should use Sherlock for memcached based locks
 # "shylock" - If we should use Shylock for MongoDB based locks
 LOCKS = False
 
-# MongoDB connection information, needed if above is "shylock"
+# Seconds until a task lock expires if the server holding it goes away, locks
+# of tasks running longer than this are renewed every LOCK_TTL / 2
+LOCK_TTL = 300.0
+
+# Serve Prometheus metrics of the server internals over HTTP on this port, e.g.
+# dispatch lag, task run times and storage engine latency. None to disable.
+METRICS_PORT = None
+METRICS_HOST = "127.0.0.1"
+
+# MongoDB connection information, used by MongoDBStorageEngine and for "shylock"
+# locks
 MONGODB_CONNECTION_STRING = "mongodb://localhost"
 MONGODB_DATABASE = "pytasched"
 MONGODB_COLLECTION = "pytasched_tasks"
 
+# Size of the MongoDB connection pool shared by the storage engine and locks
+MONGODB_MAX_POOL_SIZE = 100
+MONGODB_MIN_POOL_SIZE = 0
+
+# Redis connection information, used by RedisStorageEngine
+REDIS_URL = "redis://localhost:6379/0"
+
+# PostgreSQL connection information, used by PostgresStorageEngine
+POSTGRES_DSN = "dbname=pytasched"
+POSTGRES_MAX_POOL_SIZE = 10
+
 # Addresses to Memcached servers, needed if above is "sherlock"
 MEMCACHED = ["127.0.0.1:11211"]
 
-# How many seconds to wait between checks for tasks to be run
+# Maximum number of seconds to wait between checks for tasks to be run, the
+# server wakes up earlier if it knows a task will be due before that
 SECONDS_PER_TICK = 1.0
 
+# Minimum number of seconds to wait between checks, stops the server from busy
+# looping when the due tasks are being run by other servers
+MIN_SECONDS_PER_TICK = 0.05
+
+# Adapt polling to the load to start tasks within TARGET_LAG_SECONDS of when
+# they're due. When tasks start later than that or more tasks are due than fit
+# in a batch, the server polls more often, down to MIN_SECONDS_PER_TICK, and
+# gets more tasks per tick, up to MAX_BATCH_SIZE. When idle it backs off to
+# SECONDS_PER_TICK and BATCH_SIZE. None to always use those.
+TARGET_LAG_SECONDS = None
+MAX_BATCH_SIZE = 1000
+
 # Auto-reload the app if changes to files are detected
 AUTORELOAD = False
 